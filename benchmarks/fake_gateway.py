@@ -0,0 +1,353 @@
+"""Fake Discord API and gateway for exercising the sharded deployment offline.
+
+Serves just enough of the REST API and the gateway websocket for discord.py to
+log in, identify each shard and receive ``GUILD_CREATE`` for the guilds that
+shard owns. Events can then be injected into the owning shard and the bot's
+REST calls (messages, interaction responses) are recorded.
+
+Run from the repository root, it starts ``sharding.py`` against the fake with
+a scratch database and checks that:
+
+- every shard comes up and reports its guilds in the supervisor's metrics,
+- a command in each guild is answered exactly once, by the worker owning it,
+- a lookup cached by one worker is invalidated when another worker changes the row,
+- a title added in one worker shows up in another worker's autocomplete,
+- no worker crashed along the way,
+- SIGTERM stops every worker.
+
+    python -m benchmarks.fake_gateway --workers 2 --shards 4 --guilds 8
+"""
+import argparse
+import asyncio
+import inspect
+import itertools
+import json
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from aiohttp import web, WSMsgType, ClientSession
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_PREFIX = "/api/v10"
+APPLICATION_ID = 900000000000000001
+BOT_USER_ID = 900000000000000002
+OWNER_ID = 900000000000000003
+HEARTBEAT_INTERVAL_MS = 41250
+
+# Gateway opcodes
+DISPATCH, HEARTBEAT, IDENTIFY, RESUME, HELLO, HEARTBEAT_ACK = 0, 1, 2, 6, 10, 11
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def json_response(data, status=200):
+    # discord.py only decodes bodies whose content type is exactly application/json, without a charset
+    return web.Response(body=json.dumps(data).encode("utf-8"), status=status, headers={"Content-Type": "application/json"})
+
+def user_payload(user_id, name, bot=False):
+    return {"id": str(user_id), "username": name, "global_name": name, "discriminator": "0", "avatar": None, "bot": bot}
+
+class FakeDiscord:
+    """In-process stand-in for Discord's REST API and gateway, on 127.0.0.1."""
+
+    def __init__(self, shard_count, guild_count):
+        self.shard_count = shard_count
+        # Guild n lands on shard (n + 1) % shard_count
+        self.guild_ids = [(n + 1) << 22 for n in range(guild_count)]
+        self.port = free_port()
+        self.shards = {}  # shard id -> websocket
+        self.sequences = {}
+        self.identifies = 0
+        self.messages = []  # (channel_id, content or embed title)
+        self.interaction_responses = {}  # interaction id -> response body
+        self.unknown_routes = []
+        self.ids = itertools.count(1 << 40)
+        self.runner = None
+
+    @property
+    def api_base(self):
+        return f"http://127.0.0.1:{self.port}{API_PREFIX}"
+
+    @property
+    def gateway_url(self):
+        return f"ws://127.0.0.1:{self.port}/gateway"
+
+    def shard_for_guild(self, guild_id):
+        return (guild_id >> 22) % self.shard_count
+
+    def channel_for_guild(self, guild_id):
+        return guild_id + 1
+
+    def guild_payload(self, guild_id):
+        return {
+            "id": str(guild_id), "name": f"Guild {guild_id >> 22}", "icon": None, "owner_id": str(OWNER_ID),
+            "unavailable": False, "member_count": 2, "large": False, "features": [], "emojis": [], "stickers": [],
+            "roles": [{"id": str(guild_id), "name": "@everyone", "permissions": "1071698660929", "position": 0,
+                       "color": 0, "hoist": False, "managed": False, "mentionable": False, "flags": 0}],
+            "channels": [{"id": str(self.channel_for_guild(guild_id)), "type": 0, "name": "books", "position": 0,
+                          "permission_overwrites": [], "guild_id": str(guild_id)}],
+            "members": [], "threads": [], "voice_states": [], "presences": [], "stage_instances": [],
+            "guild_scheduled_events": [], "premium_tier": 0, "preferred_locale": "en-US", "system_channel_flags": 0,
+            "verification_level": 0, "default_message_notifications": 0, "explicit_content_filter": 0,
+            "mfa_level": 0, "nsfw_level": 0, "afk_timeout": 300, "joined_at": self.timestamp(),
+        }
+
+    def timestamp(self):
+        return datetime.now(timezone.utc).isoformat()
+
+    def member_payload(self, user_id, name):
+        return {"user": user_payload(user_id, name), "roles": [], "joined_at": self.timestamp(), "deaf": False, "mute": False, "flags": 0,
+                "permissions": "1071698660929"}
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/gateway", self.gateway)
+        app.router.add_route("*", API_PREFIX + "/{path:.*}", self.api)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", self.port).start()
+
+    async def close(self):
+        for ws in list(self.shards.values()):
+            await ws.close()
+        await self.runner.cleanup()
+
+    async def api(self, request):
+        path = "/" + request.match_info["path"]
+        if path == "/gateway/bot":
+            return json_response({"url": self.gateway_url, "shards": self.shard_count,
+                                      "session_start_limit": {"total": 1000, "remaining": 1000, "reset_after": 0, "max_concurrency": 16}})
+        if path == "/gateway":
+            return json_response({"url": self.gateway_url})
+        if path == "/users/@me":
+            return json_response(user_payload(BOT_USER_ID, "BookBot", bot=True))
+        if path == "/oauth2/applications/@me":
+            return json_response({"id": str(APPLICATION_ID), "name": "BookBot", "icon": None, "description": "",
+                                      "bot_public": True, "bot_require_code_grant": False, "verify_key": "0" * 64,
+                                      "owner": user_payload(OWNER_ID, "owner"), "flags": 0})
+        if path == f"/applications/{APPLICATION_ID}/commands":
+            commands = await request.json()
+            return json_response([{**command, "id": str(next(self.ids)), "application_id": str(APPLICATION_ID), "version": "1"}
+                                      for command in commands])
+        parts = path.strip("/").split("/")
+        if request.method == "POST" and len(parts) == 3 and parts[0] == "channels" and parts[2] == "messages":
+            body = await request.json()
+            embeds = body.get("embeds") or [{}]
+            self.messages.append((int(parts[1]), body.get("content") or embeds[0].get("title")))
+            return json_response({"id": str(next(self.ids)), "channel_id": parts[1], "author": user_payload(BOT_USER_ID, "BookBot", bot=True),
+                                      "content": body.get("content") or "", "timestamp": self.timestamp(), "edited_timestamp": None,
+                                      "tts": False, "mention_everyone": False, "mentions": [], "mention_roles": [],
+                                      "attachments": [], "embeds": body.get("embeds") or [], "pinned": False, "type": 0})
+        if request.method == "POST" and len(parts) == 4 and parts[0] == "interactions" and parts[3] == "callback":
+            self.interaction_responses[int(parts[1])] = await request.json()
+            return web.Response(status=204)
+        self.unknown_routes.append((request.method, path))
+        return json_response({"message": "Unknown route", "code": 0}, status=404)
+
+    async def gateway(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await ws.send_json({"op": HELLO, "d": {"heartbeat_interval": HEARTBEAT_INTERVAL_MS}, "s": None, "t": None})
+        shard_id = None
+        async for message in ws:
+            if message.type != WSMsgType.TEXT:
+                break
+            payload = json.loads(message.data)
+            op = payload["op"]
+            if op == HEARTBEAT:
+                await ws.send_json({"op": HEARTBEAT_ACK, "d": None, "s": None, "t": None})
+            elif op in (IDENTIFY, RESUME):
+                # Resumes are answered like a fresh identify; the bot falls back to a new session
+                shard_id, _ = payload["d"].get("shard", [0, 1])
+                self.identifies += 1
+                self.shards[shard_id] = ws
+                await self.identify(shard_id)
+        if shard_id is not None and self.shards.get(shard_id) is ws:
+            del self.shards[shard_id]
+        return ws
+
+    async def identify(self, shard_id):
+        guilds = [guild_id for guild_id in self.guild_ids if self.shard_for_guild(guild_id) == shard_id]
+        await self.dispatch(shard_id, "READY", {
+            "v": 10, "user": user_payload(BOT_USER_ID, "BookBot", bot=True), "session_id": f"session-{shard_id}-{self.identifies}",
+            "resume_gateway_url": self.gateway_url, "shard": [shard_id, self.shard_count],
+            "guilds": [{"id": str(guild_id), "unavailable": True} for guild_id in guilds],
+            "application": {"id": str(APPLICATION_ID), "flags": 0}, "private_channels": [], "relationships": [],
+        })
+        for guild_id in guilds:
+            await self.dispatch(shard_id, "GUILD_CREATE", self.guild_payload(guild_id))
+
+    async def dispatch(self, shard_id, event, data):
+        ws = self.shards[shard_id]
+        self.sequences[shard_id] = self.sequences.get(shard_id, 0) + 1
+        await ws.send_json({"op": DISPATCH, "t": event, "s": self.sequences[shard_id], "d": data})
+
+    async def send_message(self, guild_id, content, user_id=OWNER_ID):
+        """Deliver a MESSAGE_CREATE to the shard owning ``guild_id``."""
+        await self.dispatch(self.shard_for_guild(guild_id), "MESSAGE_CREATE", {
+            "id": str(next(self.ids)), "channel_id": str(self.channel_for_guild(guild_id)), "guild_id": str(guild_id),
+            "author": user_payload(user_id, f"user{user_id}"), "member": self.member_payload(user_id, f"user{user_id}"),
+            "content": content, "timestamp": self.timestamp(), "edited_timestamp": None, "tts": False,
+            "mention_everyone": False, "mentions": [], "mention_roles": [], "attachments": [], "embeds": [],
+            "pinned": False, "type": 0,
+        })
+
+    async def autocomplete(self, guild_id, command, option, value, user_id=OWNER_ID):
+        """Deliver an autocomplete INTERACTION_CREATE to the shard owning ``guild_id``; returns the interaction id."""
+        interaction_id = next(self.ids)
+        channel_id = self.channel_for_guild(guild_id)
+        await self.dispatch(self.shard_for_guild(guild_id), "INTERACTION_CREATE", {
+            "id": str(interaction_id), "application_id": str(APPLICATION_ID), "type": 4, "token": f"token-{interaction_id}",
+            "version": 1, "guild_id": str(guild_id), "channel_id": str(channel_id),
+            "channel": {"id": str(channel_id), "type": 0, "guild_id": str(guild_id), "name": "books", "position": 0,
+                        "permission_overwrites": []},
+            "member": self.member_payload(user_id, f"user{user_id}"), "locale": "en-US", "guild_locale": "en-US",
+            "app_permissions": "1071698660929", "entitlements": [], "attachment_size_limit": 8388608,
+            "data": {"id": str(next(self.ids)), "name": command, "type": 1,
+                     "options": [{"name": option, "type": 3, "value": value, "focused": True}]},
+        })
+        return interaction_id
+
+    def messages_in(self, guild_id):
+        return [content for channel_id, content in self.messages if channel_id == self.channel_for_guild(guild_id)]
+
+async def wait_for(predicate, timeout, interval=0.1):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = predicate()
+        if inspect.isawaitable(result):
+            result = await result
+        if result:
+            return True
+        await asyncio.sleep(interval)
+    return False
+
+async def scrape_metrics(port):
+    samples = {}
+    try:
+        async with ClientSession() as session:
+            async with session.get(f"http://127.0.0.1:{port}/metrics") as response:
+                text = await response.text()
+    except OSError:
+        return samples
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, _, value = line.rpartition(" ")
+            samples[name] = float(value)
+    return samples
+
+class Check:
+    def __init__(self):
+        self.results = []
+
+    def record(self, name, ok, detail=""):
+        self.results.append((name, ok, detail))
+        print(f"{'PASS' if ok else 'FAIL'}  {name}{f' ({detail})' if detail else ''}", flush=True)
+
+    @property
+    def ok(self):
+        return all(ok for _, ok, _ in self.results)
+
+async def main_async(args):
+    fake = FakeDiscord(args.shards, args.guilds)
+    await fake.start()
+    workdir = tempfile.mkdtemp(prefix="bookbot-shards-")
+    metrics_port = free_port()
+    env = {
+        **os.environ, "TOKEN": "fake-token", "DISCORD_API_BASE": fake.api_base, "DISCORD_GATEWAY_URL": fake.gateway_url,
+        "METRICS_PORT": str(metrics_port), "SHARD_HEALTH_INTERVAL": "0.5", "CATALOG_PATH": os.path.join(workdir, "catalog.db"),
+        "PYTHONPATH": os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get("PYTHONPATH")])),
+    }
+    supervisor = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(REPO_ROOT, "sharding.py"), "--shards", str(args.shards), "--workers", str(args.workers),
+        "--socket", os.path.join(workdir, "bus.sock"), cwd=workdir, env=env,
+        stdout=None if args.verbose else asyncio.subprocess.DEVNULL, stderr=None if args.verbose else asyncio.subprocess.DEVNULL)
+    check = Check()
+    try:
+        await run_checks(fake, metrics_port, args, check)
+    finally:
+        start = time.perf_counter()
+        supervisor.send_signal(signal.SIGTERM)
+        try:
+            returncode = await asyncio.wait_for(supervisor.wait(), args.timeout * 2)
+        except asyncio.TimeoutError:
+            supervisor.kill()
+            returncode = await supervisor.wait()
+        check.record("supervisor stops on SIGTERM", returncode == 0 and not fake.shards,
+                     f"exit code {returncode} in {time.perf_counter() - start:.1f}s, {len(fake.shards)} shards still connected")
+        await fake.close()
+    if fake.unknown_routes:
+        print(f"Unhandled API routes: {sorted(set(fake.unknown_routes))}")
+    print(f"Scratch directory: {workdir}")
+    return check.ok
+
+async def run_checks(fake, metrics_port, args, check):
+    async def all_guilds_reported():
+        samples = await scrape_metrics(metrics_port)
+        guilds = sum(value for name, value in samples.items() if name.startswith("bookbot_shard_guilds{"))
+        up = sum(value for name, value in samples.items() if name.startswith("bookbot_shard_up{"))
+        return guilds == args.guilds and up == args.shards
+    started = time.perf_counter()
+    ok = await wait_for(all_guilds_reported, args.timeout)
+    check.record("all shards up with their guilds in supervisor metrics", ok, f"{time.perf_counter() - started:.1f}s, {fake.identifies} identifies")
+    if not ok:
+        return
+
+    # Every guild gets one answer, from the worker whose shards own it
+    for guild_id in fake.guild_ids:
+        await fake.send_message(guild_id, "$help")
+    def all_answered():
+        return all(fake.messages_in(guild_id) for guild_id in fake.guild_ids)
+    await wait_for(all_answered, args.timeout)
+    counts = [len(fake.messages_in(guild_id)) for guild_id in fake.guild_ids]
+    check.record("each guild answered exactly once", counts == [1] * len(counts), f"answers per guild {counts}")
+
+    # Shards are split into contiguous ranges, so the first and last shard belong to different workers
+    first_guild = next(guild_id for guild_id in fake.guild_ids if fake.shard_for_guild(guild_id) == 0)
+    other_guild = next((guild_id for guild_id in fake.guild_ids if fake.shard_for_guild(guild_id) == args.shards - 1), None)
+    if other_guild is None or args.workers < 2:
+        return
+
+    # A miss cached by the first guild's worker must not hide a book the other worker adds
+    isbn, user_id = "9780441013593", OWNER_ID + 1
+    await fake.send_message(first_guild, f"$rate {isbn} 7", user_id)
+    await wait_for(lambda: answered(fake, first_guild, "No book with ISBN"), args.timeout)
+    await fake.send_message(other_guild, f'$add "Dune Messiah" "Frank Herbert" {isbn} http://example.com/cover.jpg', user_id)
+    await wait_for(lambda: answered(fake, other_guild, "Added"), args.timeout)
+    await fake.send_message(first_guild, f"$rate {isbn} 9", user_id)
+    ok = await wait_for(lambda: answered(fake, first_guild, "Updated rating"), args.timeout)
+    check.record("cached lookup invalidated across workers", ok, fake.messages_in(first_guild)[-1])
+
+    # ... and its title reaches the first worker's autocomplete index
+    interaction_id = await fake.autocomplete(first_guild, "search", "title", "dune mes")
+    await wait_for(lambda: interaction_id in fake.interaction_responses, args.timeout)
+    choices = fake.interaction_responses.get(interaction_id, {}).get("data", {}).get("choices", [])
+    check.record("title added in one worker autocompletes in another", [choice["value"] for choice in choices] == ["Dune Messiah"],
+                 f"choices {choices}")
+
+    samples = await scrape_metrics(metrics_port)
+    restarts = sum(value for name, value in samples.items() if name.startswith("bookbot_worker_restarts_total{"))
+    check.record("no worker restarted", restarts == 0, f"{restarts:.0f} restarts")
+
+def answered(fake, guild_id, prefix):
+    return any(content and content.startswith(prefix) for content in fake.messages_in(guild_id))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--guilds", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds to wait for each step")
+    parser.add_argument("--verbose", action="store_true", help="show the supervisor's and workers' logs")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(main_async(args)) else 1)
+
+if __name__ == "__main__":
+    main()
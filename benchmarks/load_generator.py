@@ -0,0 +1,165 @@
+"""Synthetic command load against the database layer.
+
+Simulates ``--guilds`` guilds with ``--users`` users each, seeds every user's
+library, then replays a weighted mix of ``$list``, ``$rate``, ``$add`` and
+``$topten`` calls through the same ``database.py`` functions the command
+handlers use. Usage (from the repository root):
+
+    python -m benchmarks.load_generator --guilds 10 --users 50 --library-size 40 --operations 20000 --concurrency 16 --profile load.prof
+"""
+import argparse
+import asyncio
+import cProfile
+import os
+import pstats
+import random
+import tempfile
+import time
+
+import database
+from database import add_book, update_rating, mark_top_ten, list_books, list_top_ten, get_designated_channel
+from benchmarks.run_benchmarks import percentile
+from isbn import isbn13_check_digit
+
+DEFAULT_MIX = "list=40,rate=25,add=20,topten=15"
+LIST_PAGE_ROWS = 6  # first $list page plus the look-ahead row
+
+class FakeContext:
+    __slots__ = ('guild_id', 'channel_id', 'author_id')
+
+    def __init__(self, guild_id, channel_id, author_id):
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.author_id = author_id
+
+def make_isbn(n):
+    first_twelve = f"978{n:09d}"
+    return first_twelve + isbn13_check_digit(first_twelve)
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(','):
+        name, weight = part.split('=')
+        weights[name.strip()] = float(weight)
+    unknown = set(weights) - set(COMMANDS)
+    if unknown:
+        raise ValueError(f"Unknown commands in mix: {', '.join(sorted(unknown))}")
+    return weights
+
+class LoadGenerator:
+    def __init__(self, guilds, users, library_size, catalog_size, seed=None):
+        self.random = random.Random(seed)
+        self.catalog_size = catalog_size
+        self.library_size = library_size
+        self.contexts = [FakeContext(guild_id, guild_id * 10, guild_id * 100000 + user)
+                         for guild_id in range(1, guilds + 1) for user in range(users)]
+        self.libraries = {}
+        self.next_isbn = catalog_size
+
+    async def seed(self):
+        for ctx in self.contexts:
+            isbns = [make_isbn(n) for n in self.random.sample(range(self.catalog_size), self.library_size)]
+            for isbn in isbns:
+                await add_book(ctx.author_id, f"Book {isbn}", f"Author {int(isbn[:12]) % 997}", isbn, None, self.random.randint(1, 10))
+            for isbn in isbns[:10]:
+                await mark_top_ten(ctx.author_id, isbn, True)
+            self.libraries[ctx.author_id] = isbns
+
+    # Each command mirrors its handler: the designated channel check, then the query
+
+    async def run_list(self, ctx):
+        await get_designated_channel(ctx.guild_id)
+        await list_books(ctx.author_id, LIST_PAGE_ROWS)
+
+    async def run_rate(self, ctx):
+        await get_designated_channel(ctx.guild_id)
+        await update_rating(ctx.author_id, self.random.choice(self.libraries[ctx.author_id]), self.random.randint(1, 10))
+
+    async def run_add(self, ctx):
+        await get_designated_channel(ctx.guild_id)
+        # Mostly books that already exist in the catalog, sometimes brand new ones
+        if self.random.random() < 0.8:
+            isbn = make_isbn(self.random.randrange(self.catalog_size))
+        else:
+            isbn = make_isbn(self.next_isbn)
+            self.next_isbn += 1
+        await add_book(ctx.author_id, f"Book {isbn}", f"Author {int(isbn[:12]) % 997}", isbn)
+        self.libraries[ctx.author_id].append(isbn)
+
+    async def run_topten(self, ctx):
+        await get_designated_channel(ctx.guild_id)
+        await list_top_ten(ctx.author_id)
+
+    async def run(self, weights, operations, concurrency):
+        names = list(weights)
+        plan = self.random.choices(names, weights=[weights[name] for name in names], k=operations)
+        latencies = {name: [] for name in names}
+        queue = asyncio.Queue()
+        for name in plan:
+            queue.put_nowait((name, self.random.choice(self.contexts)))
+
+        async def worker():
+            while not queue.empty():
+                name, ctx = queue.get_nowait()
+                start = time.perf_counter()
+                await getattr(self, COMMANDS[name])(ctx)
+                latencies[name].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return latencies, time.perf_counter() - start
+
+COMMANDS = {
+    'list': 'run_list',
+    'rate': 'run_rate',
+    'add': 'run_add',
+    'topten': 'run_topten',
+}
+
+def print_report(latencies, elapsed):
+    total = sum(len(values) for values in latencies.values())
+    print(f"{'command':<8} {'calls':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, values in latencies.items():
+        values = sorted(values)
+        print(f"{name:<8} {len(values):>7} {percentile(values, 50) * 1000:>9.3f} {percentile(values, 95) * 1000:>9.3f} {percentile(values, 99) * 1000:>9.3f}")
+    print(f"{total} commands in {elapsed:.2f}s ({total / elapsed if elapsed else 0:.1f} commands/s)")
+
+async def main_async(args):
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="bookbot-load-"), "library.db")
+    database.db.db_path = db_path
+    await database.db.connect()
+    try:
+        generator = LoadGenerator(args.guilds, args.users, args.library_size, args.catalog_size, args.seed)
+        seed_start = time.perf_counter()
+        await generator.seed()
+        print(f"Seeded {len(generator.contexts)} users x {args.library_size} books in {time.perf_counter() - seed_start:.2f}s ({db_path})")
+
+        profiler = cProfile.Profile() if args.profile else None
+        if profiler:
+            profiler.enable()
+        latencies, elapsed = await generator.run(parse_mix(args.mix), args.operations, args.concurrency)
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+
+        print_report(latencies, elapsed)
+    finally:
+        await database.db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=5)
+    parser.add_argument("--users", type=int, default=20, help="users per guild")
+    parser.add_argument("--library-size", type=int, default=30, help="books seeded per user")
+    parser.add_argument("--catalog-size", type=int, default=5000, help="distinct books to draw libraries from")
+    parser.add_argument("--operations", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"weighted command mix (default: {DEFAULT_MIX})")
+    parser.add_argument("--db", default=None, help="database file to use (default: a fresh temporary file)")
+    parser.add_argument("--profile", default=None, help="write cProfile stats of the measured run to this file")
+    parser.add_argument("--seed", type=int, default=None)
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
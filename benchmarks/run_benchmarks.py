@@ -0,0 +1,122 @@
+"""Offline latency benchmarks for the search, select and price flows.
+
+Usage (from the repository root):
+
+    python -m benchmarks.run_benchmarks --iterations 200 --concurrency 8 --latency 0.05 --error-rate 0.01
+
+The fetch modules read their base URLs from the environment at import time,
+so the stand-in servers are started and the variables set before importing them.
+"""
+import argparse
+import math
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.stand_in_servers import StandInServer, FIXTURES_DIR, OPENLIBRARY_ROUTES, HPB_ROUTES, BOOKFINDER_ROUTES
+
+SEARCH_QUERY = "The Way of Kings"
+SELECT_TITLE = "The Way of Kings"
+PRICE_ISBN = "9780765326355"
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def summarize(name, latencies, failures, elapsed):
+    latencies = sorted(latencies)
+    total = len(latencies)
+    return {
+        "flow": name,
+        "calls": total,
+        "failures": failures,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "throughput": total / elapsed if elapsed else 0.0,
+    }
+
+def run_flow(name, func, iterations, concurrency):
+    def timed_call(_):
+        start = time.perf_counter()
+        try:
+            ok = bool(func())
+        except Exception:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed_call, range(iterations)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for latency, _ in results]
+    failures = sum(1 for _, ok in results if not ok)
+    return summarize(name, latencies, failures, elapsed)
+
+def print_report(rows):
+    print(f"{'flow':<8} {'calls':>6} {'fail':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ops/s':>9}")
+    for row in rows:
+        print(f"{row['flow']:<8} {row['calls']:>6} {row['failures']:>5} {row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f} {row['p99_ms']:>9.2f} {row['throughput']:>9.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.0, help="fixed server latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 503")
+    parser.add_argument("--flows", default="search,catalog,select", help="comma-separated flows: search, catalog, select, price (needs Chrome)")
+    parser.add_argument("--catalog", default=None, help="catalog database for the catalog flow (default: built from the fixture dump)")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server_options = dict(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, seed=args.seed)
+    servers = {
+        "openlibrary": StandInServer(OPENLIBRARY_ROUTES, **server_options).start(),
+        "hpb": StandInServer(HPB_ROUTES, **server_options).start(),
+        "bookfinder": StandInServer(BOOKFINDER_ROUTES, **server_options).start(),
+    }
+    try:
+        os.environ["OPENLIBRARY_BASE_URL"] = servers["openlibrary"].base_url
+        os.environ["OPENLIBRARY_COVERS_URL"] = servers["openlibrary"].base_url
+        os.environ["HPB_BASE_URL"] = servers["hpb"].base_url
+        os.environ["BOOKFINDER_BASE_URL"] = servers["bookfinder"].base_url
+        # The search flow measures the network path, so point the catalog at an empty location
+        scratch_dir = tempfile.mkdtemp(prefix="bookbot-bench-")
+        os.environ["CATALOG_PATH"] = os.path.join(scratch_dir, "missing.db")
+
+        flows = {}
+        requested = [flow.strip() for flow in args.flows.split(",") if flow.strip()]
+        if "search" in requested:
+            from fetch_openlibrary_data import search_openlibrary
+            flows["search"] = lambda: search_openlibrary(SEARCH_QUERY)
+        if "catalog" in requested:
+            from catalog import Catalog
+            if args.catalog:
+                local_catalog = Catalog(args.catalog)
+            else:
+                local_catalog = Catalog(os.path.join(scratch_dir, "catalog.db"))
+                local_catalog.build(os.path.join(FIXTURES_DIR, "ol_dump_sample.txt"))
+            flows["catalog"] = lambda: local_catalog.search_title(SEARCH_QUERY)
+        if "select" in requested:
+            from fetch_HPB_data import search_book
+            flows["select"] = lambda: search_book(SELECT_TITLE)
+        if "price" in requested:
+            from fetch_bookfinder_data import search_bookfinder
+            flows["price"] = lambda: search_bookfinder(PRICE_ISBN)
+
+        rows = [run_flow(name, func, args.iterations, args.concurrency) for name, func in flows.items()]
+        print_report(rows)
+        for name, server in servers.items():
+            print(f"{name}: {server.requests_served} requests, {server.errors_injected} injected errors")
+    finally:
+        for server in servers.values():
+            server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Local HTTP stand-ins for OpenLibrary, Half Price Books and BookFinder.
+
+Each server replays a recorded fixture from ``benchmarks/fixtures`` with an
+optional artificial latency and error rate, so the fetch modules can be
+exercised without network access.
+"""
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+OPENLIBRARY_ROUTES = [
+    ("/search.json", "openlibrary_search.json", "application/json"),
+    ("/api/books", "openlibrary_books.json", "application/json"),
+]
+HPB_ROUTES = [
+    ("/search", "hpb_search.html", "text/html"),
+    ("/products/", "hpb_listing.html", "text/html"),
+]
+BOOKFINDER_ROUTES = [
+    ("/isbn/", "bookfinder_isbn.html", "text/html"),
+]
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), "rb") as f:
+        return f.read()
+
+class StandInServer:
+    """Serves fixtures by path prefix on 127.0.0.1 from a background thread."""
+
+    def __init__(self, routes, latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        self.routes = [(prefix, load_fixture(name), content_type) for prefix, name, content_type in routes]
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests_served = 0
+        self.errors_injected = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self.make_handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def handle(self, request):
+        with self.lock:
+            self.requests_served += 1
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            fail = self.random.random() < self.error_rate
+            if fail:
+                self.errors_injected += 1
+        if delay:
+            time.sleep(delay)
+
+        if fail:
+            request.send_error(503, "Injected error")
+            return
+
+        path = urlparse(request.path).path
+        for prefix, body, content_type in self.routes:
+            if path.startswith(prefix):
+                request.send_response(200)
+                request.send_header("Content-Type", content_type)
+                request.send_header("Content-Length", str(len(body)))
+                request.end_headers()
+                request.wfile.write(body)
+                return
+        request.send_error(404)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
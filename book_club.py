@@ -2,7 +2,10 @@ import discord
 from discord.ext import commands, tasks
 from datetime import datetime, timedelta
 import asyncio
+import json
 import aiosqlite
+from components import router, encode_custom_id, StatelessView
+from shards import shard_config
 
 class BookClub(commands.Cog):
     def __init__(self, bot):
@@ -10,11 +13,15 @@ class BookClub(commands.Cog):
         self.pending_requests = {}
         self.active_book_clubs = {}
         self.db_lock = asyncio.Lock()
-        self.check_join_phase.start_called = False
-        self.check_poll_end.start_called = False
+        self.closed = False
+        router.add_route('club_join', self.join_component)
+        router.add_route('club_leave', self.leave_component)
+        router.add_route('club_vote', self.vote_component)
 
     async def connect_db(self):
         self.db = await aiosqlite.connect("book_club.db")
+        # Shard workers share the file
+        await self.db.execute('PRAGMA journal_mode=WAL')
         await self.db.execute('''CREATE TABLE IF NOT EXISTS book_clubs (
                                     guild_id INTEGER PRIMARY KEY,
                                     title TEXT,
@@ -36,32 +43,161 @@ class BookClub(commands.Cog):
                                     user_id INTEGER,
                                     PRIMARY KEY (guild_id, title COLLATE NOCASE)
                                  )''')
+        # In-memory club state (votes, end votes) saved on shutdown and restored by get_book_club
+        await self.db.execute('''CREATE TABLE IF NOT EXISTS book_club_checkpoints (
+                                    guild_id INTEGER PRIMARY KEY,
+                                    end_vote BOOLEAN,
+                                    message_id INTEGER,
+                                    votes TEXT,
+                                    poll_message_id INTEGER,
+                                    poll_end_time TEXT
+                                 )''')
+        async with self.db.execute('PRAGMA table_info(book_club_checkpoints)') as cursor:
+            columns = {row[1] for row in await cursor.fetchall()}
+        for column, column_type in (('poll_message_id', 'INTEGER'), ('poll_end_time', 'TEXT')):
+            if column not in columns:
+                await self.db.execute(f'ALTER TABLE book_club_checkpoints ADD COLUMN {column} {column_type}')
         await self.db.commit()
 
-    @commands.Cog.listener()
-    async def on_ready(self):
-        if not self.check_join_phase.start_called:
+    async def get_book_club(self, guild_id):
+        book_club = self.active_book_clubs.get(guild_id)
+        if book_club is not None:
+            return book_club
+
+        # Rebuild the in-memory state from the database, e.g. after a restart
+        async with self.db.execute('SELECT title, description, start_time, end_time, join_phase_end_time FROM book_clubs WHERE guild_id = ?', (guild_id,)) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        title, description, start_time, end_time, join_phase_end_time = row
+
+        async with self.db.execute('SELECT user_id, is_member FROM book_club_members WHERE guild_id = ?', (guild_id,)) as cursor:
+            memberships = await cursor.fetchall()
+        async with self.db.execute('SELECT title FROM book_suggestions WHERE guild_id = ?', (guild_id,)) as cursor:
+            suggestions = {suggestion: 1 for (suggestion,) in await cursor.fetchall()}
+        async with self.db.execute('SELECT end_vote, message_id, votes, poll_message_id, poll_end_time FROM book_club_checkpoints WHERE guild_id = ?',
+                                   (guild_id,)) as cursor:
+            checkpoint = await cursor.fetchone()
+        end_vote, message_id, votes, poll_message_id, poll_end_time = checkpoint if checkpoint else (False, None, '{}', None, None)
+
+        book_club = {
+            'title': title,
+            'description': description,
+            'start_time': datetime.fromisoformat(start_time),
+            'end_time': datetime.fromisoformat(end_time),
+            'join_phase_end_time': datetime.fromisoformat(join_phase_end_time) if join_phase_end_time else datetime.min,
+            'members': {user_id for user_id, is_member in memberships if is_member},
+            'non_members': {user_id for user_id, is_member in memberships if not is_member},
+            'end_vote': bool(end_vote),
+            'votes': {int(user_id): vote for user_id, vote in json.loads(votes).items()},
+            'suggestions': suggestions,
+            'message_id': message_id,
+            'poll_message_id': poll_message_id,
+            'poll_end_time': datetime.fromisoformat(poll_end_time) if poll_end_time else None
+        }
+        self.active_book_clubs[guild_id] = book_club
+        return book_club
+
+    async def set_membership(self, guild_id, user_id, is_member):
+        book_club = await self.get_book_club(guild_id)
+        if book_club is None or datetime.now() > book_club['join_phase_end_time']:
+            return False
+
+        async with self.db_lock:
+            await self.db.execute('''INSERT OR REPLACE INTO book_club_members (
+                                        guild_id, user_id, is_member
+                                     ) VALUES (?, ?, ?)''',
+                                  (guild_id, user_id, is_member))
+            await self.db.commit()
+
+        if is_member:
+            book_club['members'].add(user_id)
+            book_club['non_members'].discard(user_id)
+        else:
+            book_club['non_members'].add(user_id)
+            book_club['members'].discard(user_id)
+        return True
+
+    async def join_component(self, interaction, guild_id, target_id, cursor):
+        if not await self.set_membership(guild_id, interaction.user.id, True):
+            await interaction.response.send_message("There is no active book club join phase at the moment.", ephemeral=True)
+            return
+        await interaction.response.send_message(f"{interaction.user.mention}, you have joined the book club.")
+
+    async def leave_component(self, interaction, guild_id, target_id, cursor):
+        if not await self.set_membership(guild_id, interaction.user.id, False):
+            await interaction.response.send_message("There is no active book club join phase at the moment.", ephemeral=True)
+            return
+        await interaction.response.send_message(f"{interaction.user.mention}, you have left the book club.")
+
+    async def vote_component(self, interaction, guild_id, target_id, cursor):
+        selected_book = interaction.data['values'][0]
+        book_club = await self.get_book_club(guild_id)
+        if book_club:
+            book_club['votes'][interaction.user.id] = selected_book
+            await interaction.response.send_message(f"You voted for: {selected_book}", ephemeral=True)
+        else:
+            await interaction.response.send_message("There is no active book club poll.", ephemeral=True)
+
+    async def cog_load(self):
+        # Called when the cog is added in setup_hook, before the gateway connects,
+        # so the database is ready before any command or loop iteration runs
+        await self.connect_db()
+
+        if not self.check_join_phase.is_running():
             self.check_join_phase.start()
-            self.check_join_phase.start_called = True
 
-        if not self.check_poll_end.start_called:
+        if not self.check_poll_end.is_running():
             self.check_poll_end.start()
-            self.check_poll_end.start_called = True
 
         if not self.reminder_loop.is_running():
             self.reminder_loop.start()
 
-        await self.connect_db()
+    async def checkpoint(self, *guild_ids):
+        """Save the in-memory state of the given clubs, or of every club. Callers hold db_lock."""
+        rows = []
+        for guild_id in guild_ids or list(self.active_book_clubs):
+            book_club = self.active_book_clubs.get(guild_id)
+            if book_club is None:
+                continue
+            poll_end_time = book_club.get('poll_end_time')
+            rows.append((guild_id, book_club['end_vote'], book_club.get('message_id'), json.dumps(book_club['votes']),
+                         book_club.get('poll_message_id'), poll_end_time.isoformat() if poll_end_time else None))
+        await self.db.executemany('''INSERT OR REPLACE INTO book_club_checkpoints (
+                                        guild_id, end_vote, message_id, votes, poll_message_id, poll_end_time
+                                     ) VALUES (?, ?, ?, ?, ?, ?)''', rows)
+        await self.db.commit()
+        return len(rows)
+
+    async def shutdown(self):
+        """Stop the loops, save in-memory state and close the database."""
+        if self.closed:
+            return
+        self.closed = True
+        # Loop iterations and writes all hold db_lock, so taking it waits for the one in progress
+        # instead of cutting it off; loops waiting for the lock are cancelled before they write
+        async with self.db_lock:
+            for loop in (self.check_join_phase, self.check_poll_end, self.reminder_loop):
+                loop.cancel()
+            await self.checkpoint()
+            await self.db.close()
+
+    async def cog_unload(self):
+        await self.shutdown()
 
     @tasks.loop(hours=1)
     async def check_join_phase(self):
         async with self.db_lock:
-            async with self.db.execute('SELECT guild_id, join_phase_end_time, voting_enabled FROM book_clubs') as cursor:
+            async with self.db.execute('SELECT guild_id, join_phase_end_time, voting_enabled FROM book_clubs WHERE join_phase_end_time IS NOT NULL') as cursor:
                 async for row in cursor:
                     guild_id, join_phase_end_time, voting_enabled = row
+                    if not shard_config.owns_guild(guild_id):
+                        continue
                     join_phase_end_time = datetime.fromisoformat(join_phase_end_time)
                     if datetime.now() > join_phase_end_time:
-                        channel = self.bot.get_channel(self.active_book_clubs[guild_id]['message_id'])
+                        # After a restart the club is only in the database until something loads it
+                        book_club = await self.get_book_club(guild_id)
+                        channel = self.bot.get_channel(book_club['message_id']) if book_club and book_club['message_id'] else None
                         if channel:
                             await channel.send("The join phase for the book club has ended.")
                         if voting_enabled:
@@ -72,9 +208,11 @@ class BookClub(commands.Cog):
     @tasks.loop(hours=1)
     async def check_poll_end(self):
         async with self.db_lock:
-            async with self.db.execute('SELECT guild_id, poll_end_time FROM book_clubs WHERE poll_end_time IS NOT NULL') as cursor:
+            async with self.db.execute('SELECT guild_id, poll_end_time FROM book_club_checkpoints WHERE poll_end_time IS NOT NULL') as cursor:
                 async for row in cursor:
                     guild_id, poll_end_time = row
+                    if not shard_config.owns_guild(guild_id):
+                        continue
                     poll_end_time = datetime.fromisoformat(poll_end_time)
                     if datetime.now() > poll_end_time:
                         await self.end_poll(guild_id)
@@ -85,6 +223,9 @@ class BookClub(commands.Cog):
             async with self.db.execute('SELECT guild_id, title, end_time, channel_id FROM book_clubs WHERE active = 1') as cursor:
                 async for row in cursor:
                     guild_id, title, end_time_str, channel_id = row
+                    # Each shard worker reminds its own guilds
+                    if not shard_config.owns_guild(guild_id):
+                        continue
                     end_time = datetime.fromisoformat(end_time_str)
                     time_remaining = end_time - datetime.now()
 
@@ -161,49 +302,29 @@ class BookClub(commands.Cog):
         event_description = f"{request['description']}\n\nJoin Phase ends on: {join_phase_end_time.strftime('%Y-%m-%d %H:%M:%S')}"
         join_message = await ctx.send(
             f"**{event_name}**\n{event_description}\n\nClick the button below to join or leave the book club.",
-            view=JoinBookClubView(self, ctx.guild.id)
+            view=JoinBookClubView(ctx.guild.id)
         )
         self.active_book_clubs[request['guild_id']]['message_id'] = join_message.id
+        async with self.db_lock:
+            await self.checkpoint(request['guild_id'])
 
     @commands.command(name='join_book_club')
     async def join_book_club(self, ctx):
-        book_club = self.active_book_clubs.get(ctx.guild.id)
-        if book_club is None or datetime.now() > book_club['join_phase_end_time']:
+        if not await self.set_membership(ctx.guild.id, ctx.author.id, True):
             await ctx.send("There is no active book club join phase at the moment.")
             return
-
-        async with self.db_lock:
-            await self.db.execute('''INSERT OR REPLACE INTO book_club_members (
-                                        guild_id, user_id, is_member
-                                     ) VALUES (?, ?, ?)''',
-                                  (ctx.guild.id, ctx.author.id, True))
-            await self.db.commit()
-
-        book_club['members'].add(ctx.author.id)
-        book_club['non_members'].discard(ctx.author.id)
         await ctx.send(f"{ctx.author.mention}, you have joined the book club.")
 
     @commands.command(name='leave_book_club')
     async def leave_book_club(self, ctx):
-        book_club = self.active_book_clubs.get(ctx.guild.id)
-        if book_club is None or datetime.now() > book_club['join_phase_end_time']:
+        if not await self.set_membership(ctx.guild.id, ctx.author.id, False):
             await ctx.send("There is no active book club join phase at the moment.")
             return
-
-        async with self.db_lock:
-            await self.db.execute('''INSERT OR REPLACE INTO book_club_members (
-                                        guild_id, user_id, is_member
-                                     ) VALUES (?, ?, ?)''',
-                                  (ctx.guild.id, ctx.author.id, False))
-            await self.db.commit()
-
-        book_club['non_members'].add(ctx.author.id)
-        book_club['members'].discard(ctx.author.id)
         await ctx.send(f"{ctx.author.mention}, you have left the book club.")
 
     @commands.command(name='suggest_book')
     async def suggest_book(self, ctx, *, title: str):
-        book_club = self.active_book_clubs.get(ctx.guild.id)
+        book_club = await self.get_book_club(ctx.guild.id)
         if not book_club or datetime.now() > book_club['join_phase_end_time']:
             await ctx.send("There is no active book club or join phase has ended.")
             return
@@ -244,7 +365,7 @@ class BookClub(commands.Cog):
 
     @commands.command(name='end_book_club')
     async def end_book_club(self, ctx):
-        book_club = self.active_book_clubs.get(ctx.guild.id)
+        book_club = await self.get_book_club(ctx.guild.id)
         if not book_club:
             await ctx.send("There is no active book club to end.")
             return
@@ -259,7 +380,7 @@ class BookClub(commands.Cog):
 
     @commands.command(name='vote_end')
     async def vote_end(self, ctx):
-        book_club = self.active_book_clubs.get(ctx.guild.id)
+        book_club = await self.get_book_club(ctx.guild.id)
         if not book_club or not book_club['end_vote']:
             await ctx.send("There is no active vote to end the book club.")
             return
@@ -283,13 +404,15 @@ class BookClub(commands.Cog):
             await self.db.execute('DELETE FROM book_clubs WHERE guild_id = ?', (guild_id,))
             await self.db.execute('DELETE FROM book_club_members WHERE guild_id = ?', (guild_id,))
             await self.db.execute('DELETE FROM book_suggestions WHERE guild_id = ?', (guild_id,))
+            await self.db.execute('DELETE FROM book_club_checkpoints WHERE guild_id = ?', (guild_id,))
             await self.db.commit()
 
         if guild_id in self.active_book_clubs:
             del self.active_book_clubs[guild_id]
 
     async def start_book_poll(self, guild_id):
-        book_club = self.active_book_clubs.get(guild_id)
+        # Called by check_join_phase, which holds db_lock
+        book_club = await self.get_book_club(guild_id)
         if not book_club:
             return
 
@@ -301,12 +424,15 @@ class BookClub(commands.Cog):
         poll_message += "\n".join([f"{idx+1}. {title} ({count} suggestion(s))" for idx, (title, count) in enumerate(suggestions.items())])
 
         channel = self.bot.get_channel(book_club['message_id'])
-        poll = await channel.send(poll_message, view=BookPollView(self, guild_id, list(suggestions.keys())))
+        poll = await channel.send(poll_message, view=BookPollView(guild_id, list(suggestions.keys())))
         book_club['poll_message_id'] = poll.id
         book_club['poll_end_time'] = datetime.now() + timedelta(days=1)
+        # check_poll_end finds the poll through the checkpoint, also after a restart
+        await self.checkpoint(guild_id)
 
     async def end_poll(self, guild_id):
-        book_club = self.active_book_clubs.get(guild_id)
+        # Called by check_poll_end, which holds db_lock
+        book_club = await self.get_book_club(guild_id)
         if not book_club:
             return
 
@@ -330,57 +456,36 @@ class BookClub(commands.Cog):
             book_title = book_club['suggestions'][winning_book]
             await channel.send(f"The book club has chosen: {book_title}")
 
-        async with self.db_lock:
-            await self.db.execute('UPDATE book_clubs SET poll_end_time = NULL WHERE guild_id = ?', (guild_id,))
-            await self.db.execute('DELETE FROM book_suggestions WHERE guild_id = ?', (guild_id,))
-            await self.db.commit()
-
+        book_club['poll_message_id'] = None
         book_club['poll_end_time'] = None
         book_club['suggestions'] = {}
+        await self.db.execute('DELETE FROM book_suggestions WHERE guild_id = ?', (guild_id,))
+        await self.checkpoint(guild_id)
 
     @check_join_phase.before_loop
     @check_poll_end.before_loop
     async def before_tasks(self):
         await self.bot.wait_until_ready()
 
-class JoinBookClubView(discord.ui.View):
-    def __init__(self, book_club_cog, guild_id):
-        super().__init__(timeout=259200)  # 3 days in seconds
-        self.book_club_cog = book_club_cog
-        self.guild_id = guild_id
-
-    @discord.ui.button(label='Join', style=discord.ButtonStyle.success, emoji='✅')
-    async def join_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        ctx = await self.book_club_cog.bot.get_context(interaction.message)
-        await self.book_club_cog.join_book_club(ctx)
-
-    @discord.ui.button(label='Leave', style=discord.ButtonStyle.danger, emoji='❌')
-    async def leave_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        ctx = await self.book_club_cog.bot.get_context(interaction.message)
-        await self.book_club_cog.leave_book_club(ctx)
-
-class BookPollView(discord.ui.View):
-    def __init__(self, book_club_cog, guild_id, suggestions):
-        super().__init__(timeout=86400)  # 1 day in seconds
-        self.book_club_cog = book_club_cog
-        self.guild_id = guild_id
-        self.suggestions = suggestions
+class JoinBookClubView(StatelessView):
+    def __init__(self, guild_id):
+        super().__init__()
+        self.add_button('Join', encode_custom_id('club_join', guild_id, guild_id), style=discord.ButtonStyle.success, emoji='✅')
+        self.add_button('Leave', encode_custom_id('club_leave', guild_id, guild_id), style=discord.ButtonStyle.danger, emoji='❌')
+        self.seal()
+
+class BookPollView(StatelessView):
+    def __init__(self, guild_id, suggestions):
+        super().__init__()
         self.add_item(discord.ui.Select(
             placeholder="Select a book to vote for",
             min_values=1,
             max_values=1,
-            options=[discord.SelectOption(label=title) for title in self.suggestions],
-            custom_id="book_select"
+            options=[discord.SelectOption(label=title) for title in suggestions],
+            custom_id=encode_custom_id('club_vote', guild_id, guild_id)
         ))
-
-    @discord.ui.select(custom_id="book_select")
-    async def select_callback(self, interaction: discord.Interaction, select: discord.ui.Select):
-        selected_book = select.values[0]
-        book_club = self.book_club_cog.active_book_clubs.get(self.guild_id)
-        if book_club:
-            book_club['votes'][interaction.user.id] = selected_book
-            await interaction.response.send_message(f"You voted for: {selected_book}", ephemeral=True)
+        self.seal()
 
 
-def setup(bot):
-    bot.add_cog(BookClub(bot))
+async def setup(bot):
+    await bot.add_cog(BookClub(bot))
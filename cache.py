@@ -0,0 +1,87 @@
+from collections import OrderedDict
+
+from ipc import bus
+from metrics import registry
+
+CACHE_LOOKUPS = registry.counter('bookbot_cache_lookups_total', 'In-process cache lookups, by cache and result.', ['cache', 'result'])
+CACHE_INVALIDATIONS = registry.counter('bookbot_cache_invalidations_total', 'Cache keys invalidated, by cache and where the change was made.',
+                                       ['cache', 'origin'])
+CACHE_ENTRIES = registry.gauge('bookbot_cache_entries', 'Entries held by each in-process cache.', ['cache'])
+
+MISSING = object()
+
+caches = {}
+
+class LocalCache:
+    """Bounded LRU map in front of a database lookup, kept coherent across shard workers.
+
+    Whoever changes the underlying rows calls ``invalidate``, which drops the
+    keys locally and broadcasts them on the IPC bus so the other workers drop
+    them too. Keys must survive a JSON round trip (ints and strings).
+    """
+
+    def __init__(self, name, max_entries=10000):
+        self.name = name
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        # Bumped by every invalidation, so a load that raced one is not stored
+        self.generation = 0
+        caches[name] = self
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        value = self.entries.get(key, MISSING)
+        if value is MISSING:
+            CACHE_LOOKUPS.inc(cache=self.name, result='miss')
+        else:
+            self.entries.move_to_end(key)
+            CACHE_LOOKUPS.inc(cache=self.name, result='hit')
+        return value
+
+    def put(self, key, value, generation=None):
+        if generation is not None and generation != self.generation:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        CACHE_ENTRIES.set(len(self.entries), cache=self.name)
+
+    async def get_or_load(self, key, load):
+        """The cached value for ``key``, or else the result of ``await load()``, which is cached for next time."""
+        value = self.get(key)
+        if value is not MISSING:
+            return value
+        generation = self.generation
+        value = await load()
+        # The row may have changed (and been invalidated) while it was being read
+        self.put(key, value, generation)
+        return value
+
+    def invalidate(self, *keys, broadcast=True):
+        self.generation += 1
+        for key in keys:
+            self.entries.pop(key, None)
+        CACHE_ENTRIES.set(len(self.entries), cache=self.name)
+        CACHE_INVALIDATIONS.inc(len(keys), cache=self.name, origin='local' if broadcast else 'remote')
+        if broadcast:
+            bus.publish('invalidate', cache=self.name, keys=list(keys))
+
+    def clear(self):
+        self.generation += 1
+        self.entries.clear()
+        CACHE_ENTRIES.set(0, cache=self.name)
+
+def apply_invalidation(message):
+    cache = caches.get(message['cache'])
+    if cache is not None:
+        cache.invalidate(*message['keys'], broadcast=False)
+
+def clear_all():
+    for cache in caches.values():
+        cache.clear()
+
+bus.subscribe('invalidate', apply_invalidation)
+bus.on_reset(clear_all)
@@ -0,0 +1,274 @@
+"""Local book catalog built from OpenLibrary bulk dumps.
+
+Build or resume a catalog (dumps may be gzipped, in OpenLibrary's tab-separated
+dump format or as plain JSON lines; authors and editions can be mixed):
+
+    python catalog.py build ol_dump_authors_latest.txt.gz ol_dump_editions_latest.txt.gz
+
+Look something up:
+
+    python catalog.py search "The Way of Kings"
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from isbn import canonical_isbn, isbn_aliases, isbn_lookup_key
+
+logger = logging.getLogger(__name__)
+
+CATALOG_PATH = os.getenv("CATALOG_PATH", "catalog.db")
+COVERS_BASE_URL = os.getenv("OPENLIBRARY_COVERS_URL", "http://covers.openlibrary.org")
+BATCH_SIZE = 5000
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS authors (
+        key TEXT PRIMARY KEY,
+        name TEXT,
+        name_norm TEXT
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS editions (
+        id INTEGER PRIMARY KEY,
+        key TEXT UNIQUE,
+        title TEXT,
+        title_norm TEXT,
+        isbn TEXT,
+        work_key TEXT
+    );
+    CREATE TABLE IF NOT EXISTS edition_isbns (
+        isbn TEXT PRIMARY KEY,
+        edition_id INTEGER
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS edition_authors (
+        author_key TEXT,
+        edition_id INTEGER,
+        position INTEGER,
+        PRIMARY KEY (author_key, edition_id)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS build_progress (
+        path TEXT PRIMARY KEY,
+        lines_done INTEGER,
+        completed BOOLEAN DEFAULT 0
+    );
+"""
+
+# Created after loading, since maintaining them during bulk inserts is slower
+INDEXES = """
+    CREATE INDEX IF NOT EXISTS idx_editions_title_norm ON editions (title_norm);
+    CREATE INDEX IF NOT EXISTS idx_authors_name_norm ON authors (name_norm);
+    CREATE INDEX IF NOT EXISTS idx_edition_authors_edition ON edition_authors (edition_id, position);
+"""
+
+def normalize(text):
+    return ' '.join(re.sub(r'[^\w]+', ' ', text.lower()).split())
+
+def open_dump(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+def parse_line(line):
+    # OpenLibrary dumps are "type<TAB>key<TAB>revision<TAB>last_modified<TAB>json"
+    parts = line.rstrip('\n').split('\t')
+    try:
+        return json.loads(parts[-1])
+    except ValueError:
+        return None
+
+def record_type(record):
+    record_type = record.get('type')
+    if isinstance(record_type, dict):
+        record_type = record_type.get('key')
+    if record_type:
+        return record_type.rsplit('/', 1)[-1]
+    # Plain JSONL search docs have no type but carry their authors by name
+    return 'edition' if 'title' in record else None
+
+def edition_rows(record):
+    """Turn an edition record into (edition, isbns, authors) rows, or None if it has no ISBN."""
+    raw_isbns = record.get('isbn_13', []) + record.get('isbn_10', []) + record.get('isbn', [])
+    canonical = [isbn for isbn in dict.fromkeys(canonical_isbn(raw) for raw in raw_isbns) if isbn]
+    title = record.get('title')
+    if not canonical or not title:
+        return None
+    # Index the ISBN-10 spelling too, so any form the bot is given resolves in one lookup
+    isbns = list(dict.fromkeys(alias for isbn in canonical for alias in isbn_aliases(isbn)))
+    key = record.get('key') or f'isbn:{canonical[0]}'
+    works = record.get('works') or []
+    work_key = works[0].get('key') if works and isinstance(works[0], dict) else record.get('work_key')
+
+    authors = []
+    for author in record.get('authors', []):
+        author_key = author.get('key') or (author.get('author') or {}).get('key')
+        if author_key:
+            authors.append((author_key, None))
+    for name in record.get('author_name', []):
+        authors.append((f'name:{normalize(name)}', name))
+    return (key, title, normalize(title), canonical[0], work_key), isbns, authors
+
+class Catalog:
+    def __init__(self, path=CATALOG_PATH):
+        self.path = path
+        self.conn = None
+        # The bot searches from worker threads as well as the event loop; they share the connection one at a time
+        self.lock = threading.RLock()
+
+    def available(self):
+        return self.conn is not None or os.path.exists(self.path)
+
+    def connect(self):
+        with self.lock:
+            if self.conn is None:
+                self.conn = sqlite3.connect(self.path, check_same_thread=False)
+                self.conn.executescript(SCHEMA)
+            return self.conn
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def build(self, dump_path, batch_size=BATCH_SIZE):
+        """Load a dump file in batches; an interrupted build resumes after the last committed batch."""
+        conn = self.connect()
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        progress_key = os.path.abspath(dump_path)
+        row = conn.execute("SELECT lines_done, completed FROM build_progress WHERE path = ?", (progress_key,)).fetchone()
+        lines_done, completed = row if row else (0, False)
+        if completed:
+            logger.info(f"{dump_path} is already loaded")
+            return lines_done
+
+        start = time.perf_counter()
+        authors, editions, isbns, edition_authors = [], [], [], []
+        line_number = 0
+        with open_dump(dump_path) as dump:
+            for line_number, line in enumerate(dump, 1):
+                if line_number <= lines_done:
+                    continue
+                record = parse_line(line)
+                kind = record_type(record) if record else None
+                if kind == 'author' and record.get('name'):
+                    authors.append((record['key'], record['name'], normalize(record['name'])))
+                elif kind == 'edition':
+                    rows = edition_rows(record)
+                    if rows:
+                        edition, edition_isbns, edition_author_list = rows
+                        editions.append(edition)
+                        isbns.extend((isbn, edition[0]) for isbn in edition_isbns)
+                        for position, (author_key, name) in enumerate(edition_author_list):
+                            edition_authors.append((author_key, edition[0], position))
+                            if name:
+                                authors.append((author_key, name, normalize(name)))
+
+                if line_number % batch_size == 0:
+                    self.flush(authors, editions, isbns, edition_authors, progress_key, line_number)
+                    authors, editions, isbns, edition_authors = [], [], [], []
+                    logger.info(f"{dump_path}: {line_number} lines ({line_number / (time.perf_counter() - start):.0f} lines/s)")
+
+        self.flush(authors, editions, isbns, edition_authors, progress_key, max(line_number, lines_done), completed=True)
+        conn.executescript(INDEXES)
+        logger.info(f"Loaded {dump_path} in {time.perf_counter() - start:.1f}s")
+        return line_number
+
+    def flush(self, authors, editions, isbns, edition_authors, progress_key, lines_done, completed=False):
+        # One transaction per batch, including the progress marker, so a resume never double counts
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO authors (key, name, name_norm) VALUES (?, ?, ?)", authors)
+            self.conn.executemany("INSERT OR IGNORE INTO editions (key, title, title_norm, isbn, work_key) VALUES (?, ?, ?, ?, ?)", editions)
+            self.conn.executemany("INSERT OR IGNORE INTO edition_isbns (isbn, edition_id) SELECT ?, id FROM editions WHERE key = ?", isbns)
+            self.conn.executemany("""
+                INSERT OR IGNORE INTO edition_authors (author_key, edition_id, position) SELECT ?, id, ? FROM editions WHERE key = ?
+            """, [(author_key, position, key) for author_key, key, position in edition_authors])
+            self.conn.execute("INSERT OR REPLACE INTO build_progress (path, lines_done, completed) VALUES (?, ?, ?)",
+                              (progress_key, lines_done, completed))
+
+    def author_names(self, edition_id):
+        rows = self.conn.execute("""
+            SELECT authors.name FROM edition_authors
+            JOIN authors ON authors.key = edition_authors.author_key
+            WHERE edition_authors.edition_id = ?
+            ORDER BY edition_authors.position
+        """, (edition_id,)).fetchall()
+        return ", ".join(name for (name,) in rows) or "N/A"
+
+    def to_result(self, edition_id, title, isbn):
+        return title, self.author_names(edition_id), isbn, f"{COVERS_BASE_URL}/b/ISBN/{isbn}-L.jpg"
+
+    def search_title(self, query, limit=10):
+        """Exact normalized title matches first, then titles starting with the query."""
+        if not self.available():
+            return []
+        query_norm = normalize(query)
+        if not query_norm:
+            return []
+        with self.lock:
+            rows = self.connect().execute("""
+                SELECT id, title, isbn FROM editions
+                WHERE title_norm >= ? AND title_norm < ?
+                ORDER BY title_norm != ?, length(title_norm), id
+                LIMIT ?
+            """, (query_norm, query_norm + '\uffff', query_norm, limit)).fetchall()
+            return [self.to_result(*row) for row in rows]
+
+    def lookup_isbn(self, isbn):
+        if not self.available():
+            return None
+        with self.lock:
+            row = self.connect().execute("""
+                SELECT editions.id, editions.title, editions.isbn FROM edition_isbns
+                JOIN editions ON editions.id = edition_isbns.edition_id
+                WHERE edition_isbns.isbn = ?
+            """, (isbn_lookup_key(isbn),)).fetchone()
+            return self.to_result(*row) if row else None
+
+    def search_author(self, name, limit=10):
+        if not self.available():
+            return []
+        name_norm = normalize(name)
+        with self.lock:
+            rows = self.connect().execute("""
+                SELECT editions.id, editions.title, editions.isbn FROM authors
+                JOIN edition_authors ON edition_authors.author_key = authors.key
+                JOIN editions ON editions.id = edition_authors.edition_id
+                WHERE authors.name_norm >= ? AND authors.name_norm < ?
+                LIMIT ?
+            """, (name_norm, name_norm + '\uffff', limit)).fetchall()
+            return [self.to_result(*row) for row in rows]
+
+catalog = Catalog()
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the local OpenLibrary catalog.")
+    parser.add_argument("--catalog", default=CATALOG_PATH)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build")
+    build_parser.add_argument("dumps", nargs="+")
+    build_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    search_parser = subparsers.add_parser("search")
+    search_parser.add_argument("title")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    local_catalog = Catalog(args.catalog)
+    if args.command == "build":
+        for dump in args.dumps:
+            local_catalog.build(dump, args.batch_size)
+    else:
+        start = time.perf_counter()
+        results = local_catalog.search_title(args.title)
+        for result in results:
+            print(result)
+        print(f"{len(results)} results in {(time.perf_counter() - start) * 1000:.2f} ms")
+    local_catalog.close()
+
+if __name__ == "__main__":
+    main()
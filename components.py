@@ -0,0 +1,93 @@
+import discord
+import logging
+import time
+from metrics import INTERACTION_LATENCY, INTERACTION_ERRORS
+from stall_watchdog import stall_watchdog
+
+logger = logging.getLogger(__name__)
+
+CUSTOM_ID_PREFIX = "bb"
+MAX_CUSTOM_ID_LENGTH = 100
+
+def encode_custom_id(action, guild_id=0, target_id=0, cursor=0):
+    # custom_id layout: bb:<action>:<guild id>:<target id>:<cursor>
+    custom_id = f"{CUSTOM_ID_PREFIX}:{action}:{guild_id or 0}:{target_id or 0}:{cursor}"
+    if len(custom_id) > MAX_CUSTOM_ID_LENGTH:
+        raise ValueError(f"custom_id too long: {custom_id}")
+    return custom_id
+
+def decode_custom_id(custom_id):
+    parts = custom_id.split(':')
+    if len(parts) != 5 or parts[0] != CUSTOM_ID_PREFIX:
+        return None
+    _, action, guild_id, target_id, cursor = parts
+    try:
+        return action, int(guild_id), int(target_id), int(cursor)
+    except ValueError:
+        return None
+
+class ComponentRouter:
+    """Routes component interactions to handlers by the action encoded in their custom_id.
+
+    Handlers are called as ``handler(interaction, guild_id, target_id, cursor)`` and
+    load whatever state they need themselves, so nothing is kept per message.
+    """
+
+    def __init__(self):
+        self.routes = {}
+
+    def route(self, action):
+        def decorator(func):
+            self.add_route(action, func)
+            return func
+        return decorator
+
+    def add_route(self, action, handler):
+        if action in self.routes:
+            logger.warning(f"Replacing handler for component action '{action}'")
+        self.routes[action] = handler
+
+    async def dispatch(self, interaction: discord.Interaction):
+        if interaction.type != discord.InteractionType.component:
+            return False
+
+        decoded = decode_custom_id((interaction.data or {}).get('custom_id', ''))
+        if decoded is None:
+            return False
+
+        action, guild_id, target_id, cursor = decoded
+        handler = self.routes.get(action)
+        if handler is None:
+            logger.warning(f"No handler registered for component action '{action}'")
+            return False
+
+        stall_watchdog.track_activity(f'interaction:{action}')
+        start = time.perf_counter()
+        try:
+            await handler(interaction, guild_id, target_id, cursor)
+        except Exception:
+            INTERACTION_ERRORS.inc(action=action)
+            raise
+        finally:
+            INTERACTION_LATENCY.observe(time.perf_counter() - start, action=action)
+        return True
+
+router = ComponentRouter()
+
+class StatelessView(discord.ui.View):
+    """A view that only carries encoded custom_ids.
+
+    Call ``seal()`` once all items are added: a finished view is serialized into the
+    message but never stored by the client, so open messages cost no memory and keep
+    working across restarts because ``router`` handles their interactions.
+    """
+
+    def __init__(self):
+        super().__init__(timeout=None)
+
+    def add_button(self, label, custom_id, style=discord.ButtonStyle.primary, emoji=None, disabled=False):
+        self.add_item(discord.ui.Button(label=label, custom_id=custom_id, style=style, emoji=emoji, disabled=disabled))
+
+    def seal(self):
+        self.stop()
+        return self
@@ -1,4 +1,34 @@
 import aiosqlite
+import os
+import time
+from datetime import datetime, timedelta
+from metrics import DB_STATEMENT_LATENCY, statement_type
+from isbn import canonical_isbn, normalize_isbn, isbn_aliases, isbn_lookup_key
+from title_index import title_index
+from cache import LocalCache
+
+SEARCH_SESSION_MAX_AGE = timedelta(days=7)
+
+# Leaderboard scores are ratings shrunk towards a fixed prior, so one 10/10 does not
+# outrank a book twenty members rated 9; a fixed prior keeps updates local to one book
+LEADERBOARD_PRIOR_RATING = float(os.getenv('LEADERBOARD_PRIOR_RATING', '6'))
+LEADERBOARD_PRIOR_WEIGHT = float(os.getenv('LEADERBOARD_PRIOR_WEIGHT', '3'))
+
+BOOK_METADATA_COLUMNS = [
+    ('publisher', 'TEXT'),
+    ('publish_year', 'INTEGER'),
+    ('page_count', 'INTEGER'),
+    ('subjects', 'TEXT'),
+    ('work_key', 'TEXT'),
+    ('enriched_at', 'TEXT'),
+]
+
+# Id maps and per-row lookups kept in memory; writers invalidate them here and,
+# over the IPC bus, in the other shard workers
+user_id_cache = LocalCache('user_ids')
+book_id_cache = LocalCache('book_ids')
+designated_channel_cache = LocalCache('designated_channels')
+search_session_cache = LocalCache('search_sessions', max_entries=1000)
 
 class Database:
     def __init__(self, db_path="library.db"):
@@ -6,7 +36,10 @@ class Database:
 
     async def connect(self):
         self.conn = await aiosqlite.connect(self.db_path)
+        # Lets shard workers keep reading while one of them writes
+        await self.conn.execute("PRAGMA journal_mode=WAL")
         await self.create_tables()
+        await self.migrate()
 
     async def create_tables(self):
         await self.conn.execute("""
@@ -21,7 +54,13 @@ class Database:
                 isbn TEXT UNIQUE,
                 title TEXT,
                 author TEXT,
-                image_url TEXT
+                image_url TEXT,
+                publisher TEXT,
+                publish_year INTEGER,
+                page_count INTEGER,
+                subjects TEXT,
+                work_key TEXT,
+                enriched_at TEXT
             )
         """)
         await self.conn.execute("""
@@ -41,53 +80,352 @@ class Database:
                 channel_id INTEGER
             )
         """)
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS search_sessions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                query TEXT,
+                result_count INTEGER,
+                created_at TEXT,
+                total_results INTEGER
+            )
+        """)
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS search_results (
+                session_id INTEGER,
+                position INTEGER,
+                title TEXT,
+                author TEXT,
+                isbn TEXT,
+                image_url TEXT,
+                FOREIGN KEY(session_id) REFERENCES search_sessions(id),
+                PRIMARY KEY (session_id, position)
+            )
+        """)
+        await self.conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_search_sessions_created_at ON search_sessions (created_at)
+        """)
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS isbn_aliases (
+                alias TEXT PRIMARY KEY,
+                book_id INTEGER,
+                FOREIGN KEY(book_id) REFERENCES books(id)
+            ) WITHOUT ROWID
+        """)
+        # Top-K item-item similarities maintained by recommendations.py
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS book_neighbours (
+                book_id INTEGER,
+                neighbour_id INTEGER,
+                score REAL,
+                PRIMARY KEY (book_id, neighbour_id)
+            ) WITHOUT ROWID
+        """)
+        await self.conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_book_neighbours_neighbour ON book_neighbours (neighbour_id)
+        """)
+        await self.conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_user_books_book ON user_books (book_id)
+        """)
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS guild_members (
+                guild_id INTEGER,
+                user_id INTEGER,
+                FOREIGN KEY(user_id) REFERENCES users(id),
+                PRIMARY KEY (guild_id, user_id)
+            ) WITHOUT ROWID
+        """)
+        await self.conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_guild_members_user ON guild_members (user_id)
+        """)
+        # Materialized per-guild aggregates, kept current by refresh_leaderboards
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS guild_leaderboard (
+                guild_id INTEGER,
+                book_id INTEGER,
+                rating_count INTEGER,
+                rating_sum INTEGER,
+                score REAL,
+                FOREIGN KEY(book_id) REFERENCES books(id),
+                PRIMARY KEY (guild_id, book_id)
+            ) WITHOUT ROWID
+        """)
+        await self.conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_guild_leaderboard_score ON guild_leaderboard (guild_id, score DESC, book_id)
+        """)
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS price_watches (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                guild_id INTEGER,
+                channel_id INTEGER,
+                isbn TEXT,
+                title TEXT,
+                target_cents INTEGER,
+                last_notified_cents INTEGER,
+                created_at TEXT,
+                UNIQUE (user_id, isbn)
+            )
+        """)
+        await self.conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_price_watches_isbn ON price_watches (isbn)
+        """)
+        # One row per ISBN, source and check; integer cents and epoch seconds keep rows small
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS price_history (
+                isbn TEXT,
+                source TEXT,
+                checked_at INTEGER,
+                price_cents INTEGER,
+                PRIMARY KEY (isbn, source, checked_at)
+            ) WITHOUT ROWID
+        """)
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS price_checks (
+                isbn TEXT PRIMARY KEY,
+                checked_at INTEGER,
+                best_cents INTEGER
+            ) WITHOUT ROWID
+        """)
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS recommendation_dirty_books (
+                marked_at INTEGER PRIMARY KEY AUTOINCREMENT,
+                book_id INTEGER UNIQUE
+            )
+        """)
+        await self.conn.commit()
+
+    async def migrate(self):
+        async with self.conn.execute("PRAGMA user_version") as cursor:
+            (version,) = await cursor.fetchone()
+        if version < 1:
+            await self.canonicalize_isbns()
+            await self.conn.execute("PRAGMA user_version = 1")
+            await self.conn.commit()
+        if version < 2:
+            # Columns filled in by the enrichment worker
+            await self.add_missing_columns('books', BOOK_METADATA_COLUMNS)
+            await self.conn.execute("CREATE INDEX IF NOT EXISTS idx_books_enriched_at ON books (enriched_at)")
+            await self.conn.execute("PRAGMA user_version = 2")
+            await self.conn.commit()
+        if version < 3:
+            # Paged searches know how many matches exist beyond the pages loaded so far
+            await self.add_missing_columns('search_sessions', [('total_results', 'INTEGER')])
+            await self.conn.execute("PRAGMA user_version = 3")
+            await self.conn.commit()
+        if version < 4:
+            # Dirty marks carry a sequence number, so a refresh only clears the marks it has seen
+            async with self.conn.execute("PRAGMA table_info(recommendation_dirty_books)") as cursor:
+                columns = {row[1] for row in await cursor.fetchall()}
+            if 'marked_at' not in columns:
+                await self.conn.execute("ALTER TABLE recommendation_dirty_books RENAME TO recommendation_dirty_books_old")
+                await self.conn.execute("""
+                    CREATE TABLE recommendation_dirty_books (
+                        marked_at INTEGER PRIMARY KEY AUTOINCREMENT,
+                        book_id INTEGER UNIQUE
+                    )
+                """)
+                await self.conn.execute("INSERT INTO recommendation_dirty_books (book_id) SELECT book_id FROM recommendation_dirty_books_old")
+                await self.conn.execute("DROP TABLE recommendation_dirty_books_old")
+            await self.conn.execute("PRAGMA user_version = 4")
+            await self.conn.commit()
+
+    async def add_missing_columns(self, table, columns):
+        # Fresh databases get these from create_tables; older ones need them added
+        async with self.conn.execute(f"PRAGMA table_info({table})") as cursor:
+            existing = {row[1] for row in await cursor.fetchall()}
+        for column, column_type in columns:
+            if column not in existing:
+                await self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+    async def canonicalize_isbns(self):
+        # Rewrite every books.isbn as ISBN-13, merge rows that turn out to be the same
+        # edition (and their user_books), and index every known spelling in isbn_aliases
+        async with self.conn.execute("SELECT id, isbn, title, author, image_url FROM books ORDER BY id") as cursor:
+            books = await cursor.fetchall()
+
+        groups = {}
+        for book in books:
+            groups.setdefault(normalize_isbn(book[1]), []).append(book)
+
+        aliases = []
+        for isbn, rows in groups.items():
+            keeper_id = rows[0][0]
+            for duplicate_id, _, title, author, image_url in rows[1:]:
+                await self.conn.execute("""
+                    INSERT OR IGNORE INTO user_books (user_id, book_id, rating, top_ten)
+                    SELECT user_id, ?, rating, top_ten FROM user_books WHERE book_id = ?
+                """, (keeper_id, duplicate_id))
+                # Users who had both rows keep their rating if they had one, and the top ten mark if either row had it
+                await self.conn.execute("""
+                    UPDATE user_books SET
+                        rating = COALESCE(rating, (SELECT d.rating FROM user_books d WHERE d.book_id = ? AND d.user_id = user_books.user_id)),
+                        top_ten = MAX(COALESCE(top_ten, 0), COALESCE((SELECT d.top_ten FROM user_books d WHERE d.book_id = ? AND d.user_id = user_books.user_id), 0))
+                    WHERE book_id = ?
+                """, (duplicate_id, duplicate_id, keeper_id))
+                await self.conn.execute("DELETE FROM user_books WHERE book_id = ?", (duplicate_id,))
+                await self.conn.execute("DELETE FROM books WHERE id = ?", (duplicate_id,))
+                await self.conn.execute("""
+                    UPDATE books SET title = COALESCE(title, ?), author = COALESCE(author, ?), image_url = COALESCE(image_url, ?) WHERE id = ?
+                """, (title, author, image_url, keeper_id))
+            await self.conn.execute("UPDATE books SET isbn = ? WHERE id = ?", (isbn, keeper_id))
+            for _, raw_isbn, _, _, _ in rows:
+                aliases.extend((alias, keeper_id) for alias in isbn_aliases(raw_isbn))
+
+        await self.conn.executemany("INSERT OR REPLACE INTO isbn_aliases (alias, book_id) VALUES (?, ?)", aliases)
         await self.conn.commit()
 
     async def close(self):
         await self.conn.close()
 
     async def execute(self, query, params=()):
+        start = time.perf_counter()
         async with self.conn.execute(query, params) as cursor:
             await self.conn.commit()
+            DB_STATEMENT_LATENCY.observe(time.perf_counter() - start, statement=statement_type(query))
             return cursor
 
+    async def executemany(self, query, params_seq):
+        start = time.perf_counter()
+        await self.conn.executemany(query, params_seq)
+        await self.conn.commit()
+        DB_STATEMENT_LATENCY.observe(time.perf_counter() - start, statement=statement_type(query))
+
+    async def execute_together(self, statements):
+        """Run ``(query, params)`` statements with a single commit, so readers see all or none of them."""
+        for query, params in statements:
+            start = time.perf_counter()
+            await self.conn.execute(query, params)
+            DB_STATEMENT_LATENCY.observe(time.perf_counter() - start, statement=statement_type(query))
+        await self.conn.commit()
+
     async def fetchone(self, query, params=()):
+        start = time.perf_counter()
         async with self.conn.execute(query, params) as cursor:
-            return await cursor.fetchone()
+            row = await cursor.fetchone()
+        DB_STATEMENT_LATENCY.observe(time.perf_counter() - start, statement=statement_type(query))
+        return row
+
+    async def fetchvalue(self, query, params=()):
+        row = await self.fetchone(query, params)
+        return row[0] if row else None
 
     async def fetchall(self, query, params=()):
+        start = time.perf_counter()
         async with self.conn.execute(query, params) as cursor:
-            return await cursor.fetchall()
+            rows = await cursor.fetchall()
+        DB_STATEMENT_LATENCY.observe(time.perf_counter() - start, statement=statement_type(query))
+        return rows
 
 db = Database()
 
 async def add_user(user_id):
-    await db.execute("""
+    cursor = await db.execute("""
         INSERT OR IGNORE INTO users (user_id) VALUES (?)
     """, (user_id,))
+    if cursor.rowcount:
+        # Unknown users are cached too
+        user_id_cache.invalidate(user_id)
 
-async def add_book(user_id, title, author, isbn, image_url=None, rating=None):
+async def get_book_id(isbn):
+    # Any spelling of an ISBN (ISBN-10 or 13, with or without hyphens) resolves in one lookup
+    key = isbn_lookup_key(isbn)
+    return await book_id_cache.get_or_load(key, lambda: db.fetchvalue("SELECT book_id FROM isbn_aliases WHERE alias = ?", (key,)))
+
+async def mark_recommendations_dirty(book_id):
+    # Picked up by the next incremental recommendation refresh. REPLACE gives the mark a new,
+    # never reused marked_at, so a refresh already running leaves it for the next one
+    await db.execute("INSERT OR REPLACE INTO recommendation_dirty_books (book_id) VALUES (?)", (book_id,))
+
+async def refresh_leaderboards(user_db_id, book_id):
+    # Re-aggregate one book in every guild the user belongs to; only that book's readers are read.
+    # Both statements commit together so the book never drops off a leaderboard in between
+    await db.execute_together([("""
+        DELETE FROM guild_leaderboard
+        WHERE book_id = ? AND guild_id IN (SELECT guild_id FROM guild_members WHERE user_id = ?)
+    """, (book_id, user_db_id)), ("""
+        INSERT INTO guild_leaderboard (guild_id, book_id, rating_count, rating_sum, score)
+        SELECT guild_members.guild_id, user_books.book_id, COUNT(user_books.rating), SUM(user_books.rating),
+               (? * ? + SUM(user_books.rating)) / (? + COUNT(user_books.rating))
+        FROM user_books
+        JOIN guild_members ON guild_members.user_id = user_books.user_id
+        WHERE user_books.book_id = ? AND user_books.rating IS NOT NULL
+          AND guild_members.guild_id IN (SELECT guild_id FROM guild_members WHERE user_id = ?)
+        GROUP BY guild_members.guild_id
+    """, (LEADERBOARD_PRIOR_WEIGHT, LEADERBOARD_PRIOR_RATING, LEADERBOARD_PRIOR_WEIGHT, book_id, user_db_id))])
+
+async def add_guild_member(guild_id, user_id):
+    await add_user(user_id)
+    user_db_id = await get_user_db_id(user_id)
+    cursor = await db.execute("INSERT OR IGNORE INTO guild_members (guild_id, user_id) VALUES (?, ?)", (guild_id, user_db_id))
+    if cursor.rowcount == 0:
+        return False
+    # A new member's rated books change those books' aggregates in this guild
     await db.execute("""
+        INSERT OR REPLACE INTO guild_leaderboard (guild_id, book_id, rating_count, rating_sum, score)
+        SELECT guild_members.guild_id, user_books.book_id, COUNT(user_books.rating), SUM(user_books.rating),
+               (? * ? + SUM(user_books.rating)) / (? + COUNT(user_books.rating))
+        FROM user_books AS own
+        JOIN user_books ON user_books.book_id = own.book_id
+        JOIN guild_members ON guild_members.user_id = user_books.user_id AND guild_members.guild_id = ?
+        WHERE own.user_id = ? AND own.rating IS NOT NULL AND user_books.rating IS NOT NULL
+        GROUP BY user_books.book_id
+    """, (LEADERBOARD_PRIOR_WEIGHT, LEADERBOARD_PRIOR_RATING, LEADERBOARD_PRIOR_WEIGHT, guild_id, user_db_id))
+    return True
+
+async def get_book_title(isbn):
+    row = await db.fetchone("""
+        SELECT books.title FROM isbn_aliases JOIN books ON books.id = isbn_aliases.book_id WHERE isbn_aliases.alias = ?
+    """, (isbn_lookup_key(isbn),))
+    return row[0] if row else None
+
+async def get_user_db_id(user_id):
+    return await user_id_cache.get_or_load(user_id, lambda: db.fetchvalue("SELECT id FROM users WHERE user_id = ?", (user_id,)))
+
+async def add_book(user_id, title, author, isbn, image_url=None, rating=None):
+    canonical = canonical_isbn(isbn)
+    if canonical is None:
+        # Books are keyed by ISBN, so "N/A" and other invalid values would all share one row
+        raise ValueError(f"{isbn!r} is not a valid ISBN-10 or ISBN-13")
+    isbn = canonical
+    cursor = await db.execute("""
         INSERT OR IGNORE INTO books (isbn, title, author, image_url) VALUES (?, ?, ?, ?)
     """, (isbn, title, author, image_url))
     book_id = (await db.fetchone("SELECT id FROM books WHERE isbn = ?", (isbn,)))[0]
+    title_index.add(title)
+    aliases = isbn_aliases(isbn)
+    await db.executemany("""
+        INSERT OR IGNORE INTO isbn_aliases (alias, book_id) VALUES (?, ?)
+    """, [(alias, book_id) for alias in aliases])
+    if cursor.rowcount:
+        # Unknown ISBNs are cached too
+        book_id_cache.invalidate(*aliases)
     
     await add_user(user_id)
-    user_db_id = (await db.fetchone("SELECT id FROM users WHERE user_id = ?", (user_id,)))[0]
+    user_db_id = await get_user_db_id(user_id)
 
     await db.execute("""
         INSERT OR REPLACE INTO user_books (user_id, book_id, rating, top_ten) 
         VALUES (?, ?, ?, (SELECT top_ten FROM user_books WHERE user_id = ? AND book_id = ?))
     """, (user_db_id, book_id, rating, user_db_id, book_id))
+    await refresh_leaderboards(user_db_id, book_id)
+    await mark_recommendations_dirty(book_id)
 
 async def remove_book(user_id, isbn):
-    book_id = (await db.fetchone("SELECT id FROM books WHERE isbn = ?", (isbn,)))[0]
-    user_db_id = (await db.fetchone("SELECT id FROM users WHERE user_id = ?", (user_id,)))[0]
-    await db.execute("""
+    book_id = await get_book_id(isbn)
+    user_db_id = await get_user_db_id(user_id)
+    if book_id is None or user_db_id is None:
+        return False
+    cursor = await db.execute("""
         DELETE FROM user_books WHERE user_id = ? AND book_id = ?
     """, (user_db_id, book_id))
+    if cursor.rowcount == 0:
+        return False
+    await refresh_leaderboards(user_db_id, book_id)
+    await mark_recommendations_dirty(book_id)
+    return True
 
-async def list_books(user_id):
+async def list_books(user_id, limit=-1, offset=0):
     user_db_id = await db.fetchone("SELECT id FROM users WHERE user_id = ?", (user_id,))
     if user_db_id is None:
         await add_user(user_id)
@@ -98,21 +436,33 @@ async def list_books(user_id):
         FROM books 
         JOIN user_books ON books.id = user_books.book_id 
         WHERE user_books.user_id = ?
-    """, (user_db_id,))
+        ORDER BY books.id
+        LIMIT ? OFFSET ?
+    """, (user_db_id, limit, offset))
 
 async def update_rating(user_id, isbn, rating):
-    book_id = (await db.fetchone("SELECT id FROM books WHERE isbn = ?", (isbn,)))[0]
-    user_db_id = (await db.fetchone("SELECT id FROM users WHERE user_id = ?", (user_id,)))[0]
-    await db.execute("""
+    book_id = await get_book_id(isbn)
+    user_db_id = await get_user_db_id(user_id)
+    if book_id is None or user_db_id is None:
+        return False
+    cursor = await db.execute("""
         UPDATE user_books SET rating = ? WHERE user_id = ? AND book_id = ?
     """, (rating, user_db_id, book_id))
+    if cursor.rowcount == 0:
+        return False
+    await refresh_leaderboards(user_db_id, book_id)
+    await mark_recommendations_dirty(book_id)
+    return True
 
 async def mark_top_ten(user_id, isbn, top_ten):
-    book_id = (await db.fetchone("SELECT id FROM books WHERE isbn = ?", (isbn,)))[0]
-    user_db_id = (await db.fetchone("SELECT id FROM users WHERE user_id = ?", (user_id,)))[0]
-    await db.execute("""
+    book_id = await get_book_id(isbn)
+    user_db_id = await get_user_db_id(user_id)
+    if book_id is None or user_db_id is None:
+        return False
+    cursor = await db.execute("""
         UPDATE user_books SET top_ten = ? WHERE user_id = ? AND book_id = ?
     """, (top_ten, user_db_id, book_id))
+    return cursor.rowcount > 0
 
 async def list_top_ten(user_id):
     user_db_id = await db.fetchone("SELECT id FROM users WHERE user_id = ?", (user_id,))
@@ -168,15 +518,199 @@ async def list_books_by_title(user_id, title_part):
         WHERE user_books.user_id = ? AND books.title LIKE ?
     """, (user_db_id, f"%{title_part}%"))
 
+async def list_recommendations(user_id, limit=10):
+    user_db_id = await get_user_db_id(user_id)
+    if user_db_id is None:
+        return []
+    # Neighbours of the books the user has, weighted by how they rated them, minus what they already own
+    return await db.fetchall("""
+        SELECT books.title, books.author, books.isbn, SUM(book_neighbours.score * COALESCE(user_books.rating, 5)) AS score
+        FROM user_books
+        JOIN book_neighbours ON book_neighbours.book_id = user_books.book_id
+        JOIN books ON books.id = book_neighbours.neighbour_id
+        WHERE user_books.user_id = ?
+          AND book_neighbours.neighbour_id NOT IN (SELECT book_id FROM user_books WHERE user_id = ?)
+        GROUP BY book_neighbours.neighbour_id
+        ORDER BY score DESC
+        LIMIT ?
+    """, (user_db_id, user_db_id, limit))
+
+async def list_leaderboard(guild_id, limit, offset=0):
+    return await db.fetchall("""
+        SELECT books.title, books.author, guild_leaderboard.rating_sum * 1.0 / guild_leaderboard.rating_count,
+               guild_leaderboard.rating_count, guild_leaderboard.score
+        FROM guild_leaderboard
+        JOIN books ON books.id = guild_leaderboard.book_id
+        WHERE guild_leaderboard.guild_id = ?
+        ORDER BY guild_leaderboard.score DESC, guild_leaderboard.book_id
+        LIMIT ? OFFSET ?
+    """, (guild_id, limit, offset))
+
+async def list_books_needing_enrichment(stale_before, limit):
+    # Never-enriched books (NULL sorts first) then the stalest; rows stay here until an
+    # update stamps enriched_at, so an interrupted worker resumes with the same books
+    return await db.fetchall("""
+        SELECT id, isbn FROM books
+        WHERE enriched_at IS NULL OR enriched_at < ?
+        ORDER BY enriched_at, id
+        LIMIT ?
+    """, (stale_before.isoformat(), limit))
+
+async def update_book_metadata(rows):
+    """Apply (publisher, publish_year, page_count, subjects, work_key, book_id) rows in one transaction.
+
+    Missing values keep what the row already had; every row is stamped as enriched now.
+    """
+    enriched_at = datetime.now().isoformat()
+    await db.executemany("""
+        UPDATE books SET
+            publisher = COALESCE(?, publisher),
+            publish_year = COALESCE(?, publish_year),
+            page_count = COALESCE(?, page_count),
+            subjects = COALESCE(?, subjects),
+            work_key = COALESCE(?, work_key),
+            enriched_at = ?
+        WHERE id = ?
+    """, [(*metadata, enriched_at, book_id) for *metadata, book_id in rows])
+
+async def add_price_watch(user_id, guild_id, channel_id, isbn, title, target_cents):
+    await db.execute("""
+        INSERT OR REPLACE INTO price_watches (user_id, guild_id, channel_id, isbn, title, target_cents, last_notified_cents, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, NULL, ?)
+    """, (user_id, guild_id, channel_id, normalize_isbn(isbn), title, target_cents, datetime.now().isoformat()))
+
+async def remove_price_watch(user_id, isbn):
+    cursor = await db.execute("DELETE FROM price_watches WHERE user_id = ? AND isbn = ?", (user_id, normalize_isbn(isbn)))
+    return cursor.rowcount > 0
+
+async def list_price_watches(user_id):
+    return await db.fetchall("""
+        SELECT price_watches.title, price_watches.isbn, price_watches.target_cents, price_checks.best_cents
+        FROM price_watches
+        LEFT JOIN price_checks ON price_checks.isbn = price_watches.isbn
+        WHERE price_watches.user_id = ?
+        ORDER BY price_watches.id
+    """, (user_id,))
+
+async def list_due_price_checks(checked_before, limit):
+    # Each watched ISBN once, however many users watch it, least recently checked first
+    return await db.fetchall("""
+        SELECT price_watches.isbn, MIN(price_watches.title)
+        FROM price_watches
+        LEFT JOIN price_checks ON price_checks.isbn = price_watches.isbn
+        WHERE price_checks.checked_at IS NULL OR price_checks.checked_at < ?
+        GROUP BY price_watches.isbn
+        ORDER BY MIN(COALESCE(price_checks.checked_at, 0)), price_watches.isbn
+        LIMIT ?
+    """, (checked_before, limit))
+
+async def record_price_check(isbn, checked_at, prices):
+    """Store the {source: cents} found by one check; sources that found nothing are left out."""
+    await db.executemany("""
+        INSERT OR REPLACE INTO price_history (isbn, source, checked_at, price_cents) VALUES (?, ?, ?, ?)
+    """, [(isbn, source, checked_at, cents) for source, cents in prices.items()])
+    await db.execute("""
+        INSERT OR REPLACE INTO price_checks (isbn, checked_at, best_cents) VALUES (?, ?, ?)
+    """, (isbn, checked_at, min(prices.values()) if prices else None))
+
+async def list_triggered_price_watches(isbns):
+    # Watches at or under target that have not already been told about this price (or a lower one)
+    placeholders = ','.join('?' * len(isbns))
+    return await db.fetchall(f"""
+        SELECT price_watches.id, price_watches.user_id, price_watches.channel_id, price_watches.title,
+               price_watches.isbn, price_watches.target_cents, price_checks.best_cents
+        FROM price_watches
+        JOIN price_checks ON price_checks.isbn = price_watches.isbn
+        WHERE price_watches.isbn IN ({placeholders})
+          AND price_checks.best_cents <= price_watches.target_cents
+          AND (price_watches.last_notified_cents IS NULL OR price_checks.best_cents < price_watches.last_notified_cents)
+        ORDER BY price_watches.channel_id, price_watches.id
+    """, tuple(isbns))
+
+async def mark_price_watches_notified(rows):
+    await db.executemany("UPDATE price_watches SET last_notified_cents = ? WHERE id = ?", rows)
+
 async def set_designated_channel(guild_id, channel_id):
     await db.execute("""
         INSERT OR REPLACE INTO designated_channels (guild_id, channel_id) 
         VALUES (?, ?)
     """, (guild_id, channel_id))
     await db.conn.commit()
+    designated_channel_cache.invalidate(guild_id)
 
 async def get_designated_channel(guild_id):
-    row = await db.fetchone("""
+    return await designated_channel_cache.get_or_load(guild_id, lambda: db.fetchvalue("""
         SELECT channel_id FROM designated_channels WHERE guild_id = ?
-    """, (guild_id,))
-    return row[0] if row else None
+    """, (guild_id,)))
+
+
+async def create_search_session(user_id, query, results, total_results=None):
+    await prune_search_sessions()
+    cursor = await db.execute("""
+        INSERT INTO search_sessions (user_id, query, result_count, created_at, total_results) VALUES (?, ?, 0, ?, ?)
+    """, (user_id, query, datetime.now().isoformat(), total_results))
+    session_id = cursor.lastrowid
+    await append_search_results(session_id, 0, results, total_results or len(results))
+    return session_id
+
+async def append_search_results(session_id, start, results, total_results):
+    """Store one page of results at positions ``start`` onwards and record the latest known total."""
+    await db.executemany("""
+        INSERT OR IGNORE INTO search_results (session_id, position, title, author, isbn, image_url) VALUES (?, ?, ?, ?, ?, ?)
+    """, [(session_id, position, title, author, isbn, image_url) for position, (title, author, isbn, image_url) in enumerate(results, start)])
+    loaded = start + len(results)
+    # The total never goes down: a short or empty page says nothing about how many matches there are
+    await db.execute("""
+        UPDATE search_sessions SET result_count = MAX(result_count, ?), total_results = MAX(COALESCE(total_results, 0), ?, ?) WHERE id = ?
+    """, (loaded, total_results, loaded, session_id))
+    search_session_cache.invalidate(session_id)
+    title_index.add_many(title for title, _, _, _ in results)
+
+async def list_indexed_titles():
+    """(library titles, titles of searches still kept around, least recently searched first) for title_index.build."""
+    library = await db.fetchall("SELECT title FROM books")
+    recent = await db.fetchall("""
+        SELECT r.title FROM search_results r JOIN search_sessions s ON s.id = r.session_id
+        GROUP BY r.title ORDER BY MAX(s.created_at) DESC LIMIT ?
+    """, (title_index.max_recent,))
+    return [title for (title,) in library], [title for (title,) in reversed(recent)]
+
+async def load_search_session(session_id):
+    """((user_id, query, loaded, total), {position: (title, author, isbn, image_url)}), or None if the session is gone."""
+    session = await db.fetchone("""
+        SELECT user_id, query, result_count, COALESCE(total_results, result_count) FROM search_sessions WHERE id = ?
+    """, (session_id,))
+    if session is None:
+        return None
+    rows = await db.fetchall("""
+        SELECT position, title, author, isbn, image_url FROM search_results WHERE session_id = ?
+    """, (session_id,))
+    return session, {position: result for position, *result in rows}
+
+async def get_search_result(session_id, position):
+    """(user_id, query, loaded, total, title, author, isbn, image_url); the result fields are None if that page is not loaded."""
+    # Paging through a search re-reads the same session, so it is loaded once and kept until the next page is appended
+    session = await search_session_cache.get_or_load(session_id, lambda: load_search_session(session_id))
+    if session is None:
+        return None
+    header, results = session
+    return (*header, *results.get(position, (None,) * 4))
+
+async def prune_search_sessions(max_age=SEARCH_SESSION_MAX_AGE):
+    cutoff = (datetime.now() - max_age).isoformat()
+    expired = await db.fetchall("SELECT id FROM search_sessions WHERE created_at < ?", (cutoff,))
+    if not expired:
+        return
+    # Titles only the expired searches returned leave autocomplete with them
+    stale = await db.fetchall("""
+        SELECT title FROM search_results WHERE session_id IN (SELECT id FROM search_sessions WHERE created_at < ?)
+        EXCEPT SELECT title FROM search_results WHERE session_id IN (SELECT id FROM search_sessions WHERE created_at >= ?)
+    """, (cutoff, cutoff))
+    await db.execute("""
+        DELETE FROM search_results WHERE session_id IN (SELECT id FROM search_sessions WHERE created_at < ?)
+    """, (cutoff,))
+    await db.execute("""
+        DELETE FROM search_sessions WHERE created_at < ?
+    """, (cutoff,))
+    search_session_cache.invalidate(*(session_id for (session_id,) in expired))
+    title_index.discard_recent(title for (title,) in stale)
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+from database import list_books_needing_enrichment, update_book_metadata
+from fetch_openlibrary_data import fetch_book_details
+from isbn import canonical_isbn
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+ENRICHMENT_BATCH_SIZE = int(os.getenv("ENRICHMENT_BATCH_SIZE", "50"))
+ENRICHMENT_REQUESTS_PER_MINUTE = float(os.getenv("ENRICHMENT_REQUESTS_PER_MINUTE", "6"))
+ENRICHMENT_MAX_AGE = timedelta(days=int(os.getenv("ENRICHMENT_MAX_AGE_DAYS", "30")))
+ENRICHMENT_IDLE_SECONDS = 300
+ENRICHMENT_RETRY_SECONDS = 60
+
+ENRICHED_BOOKS = registry.counter('bookbot_enrichment_books_total', 'Books processed by the enrichment worker.', ['result'])
+ENRICHMENT_BATCH_SECONDS = registry.histogram('bookbot_enrichment_batch_seconds', 'Time to fetch and store one enrichment batch.')
+
+class RateBudget:
+    """Token bucket allowing ``per_minute`` requests, with bursts of up to ``burst``."""
+
+    def __init__(self, per_minute, burst=1, clock=time.monotonic):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.tokens = float(burst)
+        self.clock = clock
+        self.updated_at = clock()
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        self.refill()
+        while self.tokens < 1:
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+            self.refill()
+        self.tokens -= 1
+
+class EnrichmentWorker:
+    """Fills in publisher, year, page count, subjects and work id for books missing them or gone stale.
+
+    Progress lives in books.enriched_at, so a restarted worker carries on with
+    whatever has not been stamped yet.
+    """
+
+    def __init__(self, batch_size=ENRICHMENT_BATCH_SIZE, requests_per_minute=ENRICHMENT_REQUESTS_PER_MINUTE, max_age=ENRICHMENT_MAX_AGE):
+        self.batch_size = batch_size
+        self.budget = RateBudget(requests_per_minute)
+        self.max_age = max_age
+
+    async def run_batch(self):
+        """Enrich one batch; returns how many books it covered (0 when nothing needs enriching)."""
+        books = await list_books_needing_enrichment(datetime.now() - self.max_age, self.batch_size)
+        if not books:
+            return 0
+        start = time.perf_counter()
+        by_isbn = {}
+        for book_id, isbn in books:
+            by_isbn.setdefault(canonical_isbn(isbn) or isbn, []).append(book_id)
+
+        await self.budget.acquire()
+        # requests is blocking, so the one request per batch runs in a thread
+        details = await asyncio.to_thread(fetch_book_details, list(by_isbn))
+
+        rows = []
+        for isbn, book_ids in by_isbn.items():
+            # Books OpenLibrary does not know are stamped too, so they wait max_age before the next try
+            metadata = details.get(isbn, (None,) * 5)
+            rows.extend((*metadata, book_id) for book_id in book_ids)
+        await update_book_metadata(rows)
+
+        found = sum(len(by_isbn[isbn]) for isbn in details if isbn in by_isbn)
+        ENRICHED_BOOKS.inc(found, result='enriched')
+        ENRICHED_BOOKS.inc(len(books) - found, result='not_found')
+        ENRICHMENT_BATCH_SECONDS.observe(time.perf_counter() - start)
+        logger.info(f"Enriched {found} of {len(books)} books")
+        return len(books)
+
+    async def run(self):
+        while True:
+            try:
+                processed = await self.run_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Enrichment batch failed: {e}")
+                await asyncio.sleep(ENRICHMENT_RETRY_SECONDS)
+                continue
+            if processed < self.batch_size:
+                await asyncio.sleep(ENRICHMENT_IDLE_SECONDS)
+
+enrichment_worker = EnrichmentWorker()
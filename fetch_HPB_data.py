@@ -1,10 +1,17 @@
-import requests
-from bs4 import BeautifulSoup
+import os
+from metrics import track_fetch
 
-BASE_URL = "https://www.hpb.com"
+# requests and bs4 are imported inside the functions: they are only needed in
+# scrape worker processes, so the bot itself never pays for loading them
+
+BASE_URL = os.getenv("HPB_BASE_URL", "https://www.hpb.com")
+REQUEST_TIMEOUT = 20  # seconds per HPB request, well inside the scrape job timeout
 
 def fetch_listing_details(listing_url):
-    page = requests.get(listing_url)
+    import requests
+    from bs4 import BeautifulSoup
+
+    page = requests.get(listing_url, timeout=REQUEST_TIMEOUT)
     soup = BeautifulSoup(page.content, 'html.parser')
 
     # Scrape ISBN
@@ -17,10 +24,14 @@ def fetch_listing_details(listing_url):
 
     return isbn, image_url
 
+@track_fetch("hpb")
 def search_book(book_title):
+    import requests
+    from bs4 import BeautifulSoup
+
     query = book_title.replace(' ', '+')
     URL = f"{BASE_URL}/search?q={query}&search-button=&lang=en_US"
-    page = requests.get(URL)
+    page = requests.get(URL, timeout=REQUEST_TIMEOUT)
     soup = BeautifulSoup(page.content, 'html.parser')
 
     results = soup.find(id="product-search-results")
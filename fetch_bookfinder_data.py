@@ -1,14 +1,20 @@
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-
-BASE_URL = "https://www.bookfinder.com"
+import os
+from metrics import record_fetch, track_fetch
+
+BASE_URL = os.getenv("BOOKFINDER_BASE_URL", "https://www.bookfinder.com")
+CHROMEDRIVER_PATH = os.getenv("CHROMEDRIVER_PATH", "/usr/local/bin/chromedriver")
 MAX_LISTINGS = 5
 
+@track_fetch("bookfinder")
 def search_bookfinder(book_isbn):
+    # selenium is only needed in scrape worker processes, so load it on first use
+    from selenium import webdriver
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.chrome.service import Service
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
     query = book_isbn
     URL = f"{BASE_URL}/isbn/{query}/?st=sr&ac=qr&mode=basic&author=&title=&isbn={query}&lang=en&destination=us&currency=USD&binding=*&keywords=&publisher=&min_year=&max_year=&minprice=&maxprice="
     
@@ -17,7 +23,7 @@ def search_bookfinder(book_isbn):
     chrome_options.add_argument("--disable-dev-shm-usage")
     chrome_options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36")
     
-    service = Service("/usr/local/bin/chromedriver")  
+    service = Service(CHROMEDRIVER_PATH)
     
     driver = webdriver.Chrome(service=service, options=chrome_options)
     driver.get(URL)
@@ -56,6 +62,7 @@ def search_bookfinder(book_isbn):
         }
 
     except Exception as e:
+        record_fetch("bookfinder", error=True)
         print(f"An error occurred: {e}")
     finally:
         driver.quit()
@@ -1,44 +1,111 @@
-import requests
+import os
+import re
 import logging
+from collections import namedtuple
+from metrics import FETCH_ERRORS, registry, track_fetch
+from catalog import catalog
+from isbn import first_valid_isbn
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def search_openlibrary(query):
-    base_url = "http://openlibrary.org/search.json"
-    cover_base_url = "http://covers.openlibrary.org/b/ISBN/"
+BASE_URL = os.getenv("OPENLIBRARY_BASE_URL", "http://openlibrary.org")
+COVERS_BASE_URL = os.getenv("OPENLIBRARY_COVERS_URL", "http://covers.openlibrary.org")
+
+CATALOG_LOOKUPS = registry.counter('bookbot_catalog_lookups_total', 'Title searches answered by the local catalog.', ['result'])
+
+SEARCH_PAGE_SIZE = 10
+CATALOG_RESULT_LIMIT = 50  # local matches are cheap, so they come back as one complete result set
+SEARCH_FIELDS = "title,author_name,isbn"
+
+SearchResult = namedtuple("SearchResult", "title author isbn image_url")
+
+def to_search_result(doc):
+    isbn_list = doc.get("isbn", [])
+    # Editions mix ISBN-10 and ISBN-13, so keep only the canonical ISBN-13 of the first valid one
+    isbn = first_valid_isbn(isbn_list) or (isbn_list[0] if isbn_list else "N/A")
+    image_url = f"{COVERS_BASE_URL}/b/ISBN/{isbn}-L.jpg" if isbn_list else None
+    return SearchResult(doc.get("title", "N/A"), ", ".join(doc.get("author_name", ["N/A"])), isbn, image_url)
+
+@track_fetch("openlibrary")
+def search_openlibrary_page(query, offset=0, limit=SEARCH_PAGE_SIZE):
+    """Return ``(results, total)`` for one page of a title search; ``total`` counts every match.
+
+    Returns None when OpenLibrary could not be reached or sent an unusable
+    response, so callers can tell a failure from running out of results.
+    """
+    # Try the local catalog first and only go to the network on a miss
+    if offset == 0:
+        local_results = catalog.search_title(query, CATALOG_RESULT_LIMIT)
+        if local_results:
+            CATALOG_LOOKUPS.inc(result="hit")
+            logger.info(f"Found {len(local_results)} results in the local catalog")
+            return [SearchResult(*result) for result in local_results], len(local_results)
+        CATALOG_LOOKUPS.inc(result="miss")
+
+    # Imported on first search so startup does not wait on requests/urllib3
+    import requests
+
     params = {
         "title": query,
-        "limit": 10
+        "fields": SEARCH_FIELDS,
+        "limit": limit,
+        "offset": offset,
     }
     try:
-        response = requests.get(base_url, params=params, timeout=10)
+        response = requests.get(f"{BASE_URL}/search.json", params=params, timeout=10)
         response.raise_for_status()
         data = response.json()
 
         if 'docs' not in data:
-            logger.info("No 'docs' field found in response")
-            return []
-
-        search_results = []
-        for doc in data["docs"]:
-            title = doc.get("title", "N/A")
-            author = ", ".join(doc.get("author_name", ["N/A"]))
-            isbn_list = doc.get("isbn", [])
-            isbn = isbn_list[0] if isbn_list else "N/A"
-            image_url = f"{cover_base_url}{isbn}-L.jpg" if isbn_list else None
-            search_results.append((title, author, isbn, image_url))
+            logger.warning("No 'docs' field found in response")
+            return None
 
+        search_results = [to_search_result(doc) for doc in data["docs"]]
         if not search_results:
             logger.info("No search results found")
         else:
             logger.info(f"Found {len(search_results)} results")
-
-        return search_results
+        return search_results, max(data.get("numFound", 0), offset + len(search_results))
 
     except requests.exceptions.RequestException as e:
+        FETCH_ERRORS.inc(source="openlibrary")
         logger.error(f"An error occurred: {e}")
-        return []
+        return None
+
+def search_openlibrary(query):
+    page = search_openlibrary_page(query)
+    return page[0] if page else []
+
+def parse_book_details(details):
+    """(publisher, year, page count, subjects, work key) from an /api/books ``details`` record."""
+    publishers = details.get("publishers") or []
+    year = re.search(r"\d{4}", details.get("publish_date") or "")
+    subjects = [subject if isinstance(subject, str) else subject.get("name", "") for subject in details.get("subjects") or []]
+    works = details.get("works") or []
+    return (publishers[0] if publishers else None,
+            int(year.group()) if year else None,
+            details.get("number_of_pages"),
+            ", ".join(subject for subject in subjects if subject) or None,
+            works[0].get("key") if works else None)
+
+@track_fetch("openlibrary_books")
+def fetch_book_details(isbns):
+    """Look up many ISBNs in one request; returns {isbn: parse_book_details(...)} for the ones OpenLibrary knows.
+
+    Raises requests.RequestException on failure so the caller can retry the batch later.
+    """
+    import requests
+
+    response = requests.get(f"{BASE_URL}/api/books", params={
+        "bibkeys": ",".join(f"ISBN:{isbn}" for isbn in isbns),
+        "format": "json",
+        "jscmd": "details",
+    }, timeout=30)
+    response.raise_for_status()
+    data = response.json()
+    return {bib_key.split(":", 1)[1]: parse_book_details(entry.get("details") or {})
+            for bib_key, entry in data.items() if bib_key.startswith("ISBN:")}
 
 # Example usage
 if __name__ == "__main__":
@@ -0,0 +1,189 @@
+import asyncio
+import inspect
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_BYTES = 1024 * 1024
+# A client this far behind is dropped; it clears its caches when it reconnects instead of reading stale entries
+MAX_PENDING_BYTES = 4 * 1024 * 1024
+RECONNECT_BACKOFF_MIN = 0.5
+RECONNECT_BACKOFF_MAX = 10.0
+
+def encode(message):
+    return (json.dumps(message, separators=(',', ':')) + '\n').encode('utf-8')
+
+class BusServer:
+    """Unix socket hub that fans every newline-delimited JSON message out to all other connected clients.
+
+    ``on_message(message)`` additionally sees every message, which is how the
+    shard supervisor collects worker health reports.
+    """
+
+    def __init__(self, path, on_message=None):
+        self.path = path
+        self.on_message = on_message
+        self.clients = set()
+        self.server = None
+
+    async def start(self):
+        # A socket file left behind by a killed supervisor would make bind() fail
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(self.handle, path=self.path, limit=MAX_MESSAGE_BYTES)
+        logger.info(f"IPC bus listening on {self.path}")
+
+    async def handle(self, reader, writer):
+        self.clients.add(writer)
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ConnectionError, ValueError):
+                    break
+                if not line:
+                    break
+                self.fan_out(writer, line)
+                if self.on_message is not None:
+                    try:
+                        self.on_message(json.loads(line))
+                    except Exception:
+                        logger.exception("IPC bus message handler failed")
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+    def fan_out(self, sender, line):
+        for client in list(self.clients):
+            if client is sender:
+                continue
+            if client.transport.get_write_buffer_size() > MAX_PENDING_BYTES:
+                logger.warning("Dropping an IPC bus client that stopped reading")
+                self.clients.discard(client)
+                client.close()
+                continue
+            client.write(line)
+
+    async def close(self):
+        if self.server is None:
+            return
+        self.server.close()
+        for client in list(self.clients):
+            client.close()
+        await self.server.wait_closed()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+class BusClient:
+    """A worker's connection to the bus.
+
+    Until ``connect`` is called (an unsharded bot never calls it) ``publish`` is
+    a no-op. Messages published while the connection is down are lost, so after
+    a reconnect every worker runs its reset handlers to drop whatever it cached.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.worker_id = None
+        self.handlers = {}
+        self.reset_handlers = []
+        self.writer = None
+        self.task = None
+        self.pending = set()  # coroutine handlers still running
+        self.closed = False
+
+    @property
+    def connected(self):
+        return self.writer is not None
+
+    def subscribe(self, message_type, handler):
+        """Call ``handler(message)`` (plain or coroutine function) for messages of ``message_type`` from other workers."""
+        self.handlers.setdefault(message_type, []).append(handler)
+
+    def on_reset(self, handler):
+        self.reset_handlers.append(handler)
+
+    def publish(self, message_type, **payload):
+        if self.writer is None:
+            return
+        self.writer.write(encode({'type': message_type, 'worker': self.worker_id, **payload}))
+
+    async def connect(self, path, worker_id):
+        self.path = path
+        self.worker_id = worker_id
+        reader = await self.open()
+        self.task = asyncio.create_task(self.run(reader))
+
+    async def open(self):
+        reader, self.writer = await asyncio.open_unix_connection(self.path, limit=MAX_MESSAGE_BYTES)
+        return reader
+
+    async def run(self, reader):
+        backoff = RECONNECT_BACKOFF_MIN
+        while not self.closed:
+            if reader is None:
+                try:
+                    reader = await self.open()
+                except OSError:
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+                    continue
+                backoff = RECONNECT_BACKOFF_MIN
+                logger.info("Reconnected to the IPC bus, resetting local caches")
+                self.publish('reset')
+                self.reset()
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    self.dispatch(json.loads(line))
+            except (ConnectionError, ValueError) as e:
+                logger.warning(f"IPC bus connection failed: {e}")
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+            reader = None
+
+    def dispatch(self, message):
+        if message.get('type') == 'reset':
+            self.reset()
+            return
+        for handler in self.handlers.get(message.get('type'), ()):
+            self.call(handler, message)
+
+    def reset(self):
+        for handler in self.reset_handlers:
+            self.call(handler)
+
+    def call(self, handler, *args):
+        try:
+            result = handler(*args)
+            if inspect.isawaitable(result):
+                task = asyncio.ensure_future(result)
+                self.pending.add(task)
+                task.add_done_callback(self.handler_done)
+        except Exception:
+            logger.exception("IPC bus handler failed")
+
+    def handler_done(self, task):
+        self.pending.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("IPC bus handler failed", exc_info=task.exception())
+
+    async def close(self):
+        self.closed = True
+        if self.writer is not None:
+            try:
+                await self.writer.drain()
+            except ConnectionError:
+                pass
+            self.writer.close()
+            self.writer = None
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+bus = BusClient()
@@ -0,0 +1,68 @@
+import re
+
+def clean_isbn(raw):
+    """Uppercase and drop an "ISBN" label, hyphens and whitespace."""
+    if raw is None:
+        return ''
+    isbn = re.sub(r'^ISBN(-1[03])?:?', '', str(raw).strip().upper())
+    return re.sub(r'[\s-]', '', isbn)
+
+def isbn10_check_digit(first_nine):
+    total = sum((10 - i) * int(digit) for i, digit in enumerate(first_nine))
+    check = (11 - total % 11) % 11
+    return 'X' if check == 10 else str(check)
+
+def isbn13_check_digit(first_twelve):
+    total = sum(int(digit) * (1 if i % 2 == 0 else 3) for i, digit in enumerate(first_twelve))
+    return str((10 - total % 10) % 10)
+
+def is_valid_isbn10(isbn):
+    return bool(re.fullmatch(r'\d{9}[\dX]', isbn)) and isbn10_check_digit(isbn[:9]) == isbn[9]
+
+def is_valid_isbn13(isbn):
+    return bool(re.fullmatch(r'97[89]\d{10}', isbn)) and isbn13_check_digit(isbn[:12]) == isbn[12]
+
+def isbn10_to_isbn13(isbn10):
+    first_twelve = '978' + isbn10[:9]
+    return first_twelve + isbn13_check_digit(first_twelve)
+
+def isbn13_to_isbn10(isbn13):
+    # Only 978-prefixed ISBN-13s have an ISBN-10 form
+    if not isbn13.startswith('978'):
+        return None
+    first_nine = isbn13[3:12]
+    return first_nine + isbn10_check_digit(first_nine)
+
+def canonical_isbn(raw):
+    """Return the ISBN-13 for any valid ISBN-10/13 spelling, or None if it is not a valid ISBN."""
+    isbn = clean_isbn(raw)
+    if len(isbn) == 13 and is_valid_isbn13(isbn):
+        return isbn
+    if len(isbn) == 10 and is_valid_isbn10(isbn):
+        return isbn10_to_isbn13(isbn)
+    return None
+
+def normalize_isbn(raw):
+    """Canonical ISBN-13 when valid, otherwise the stripped input so legacy values are kept as is."""
+    return canonical_isbn(raw) or (str(raw).strip() if raw is not None else raw)
+
+def isbn_lookup_key(raw):
+    """The key any spelling of an ISBN is looked up by: the ISBN-13, or the cleaned input if invalid."""
+    return canonical_isbn(raw) or clean_isbn(raw)
+
+def isbn_aliases(raw):
+    """Every key that should resolve to the book stored under ``raw``."""
+    aliases = {isbn_lookup_key(raw)}
+    canonical = canonical_isbn(raw)
+    if canonical is not None:
+        isbn10 = isbn13_to_isbn10(canonical)
+        if isbn10:
+            aliases.add(isbn10)
+    return aliases
+
+def first_valid_isbn(isbns):
+    for raw in isbns:
+        canonical = canonical_isbn(raw)
+        if canonical:
+            return canonical
+    return None
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import os
+import signal
+import time
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', '25'))
+
+class Lifecycle:
+    """Coordinates a graceful shutdown.
+
+    Once shutdown starts, ``accepting`` turns False so no new commands or
+    interactions are taken. The registered steps then run in order (wait for
+    in-flight work, drain queues, checkpoint, close connections), sharing one
+    overall deadline; a step may also be capped at its own ``timeout``. A step
+    that overruns is abandoned so the ones after it still get to run.
+    """
+
+    def __init__(self, timeout=SHUTDOWN_TIMEOUT):
+        self.timeout = timeout
+        self.accepting = True
+        self.steps = []
+        self.timings = {}
+        self.in_flight = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.started_at = None
+        self.shutdown_task = None
+
+    def add_step(self, name, func, timeout=None):
+        self.steps.append((name, func, timeout))
+
+    def begin(self):
+        self.in_flight += 1
+        self.idle.clear()
+
+    def end(self):
+        self.in_flight = max(0, self.in_flight - 1)
+        if not self.in_flight:
+            self.idle.set()
+
+    @asynccontextmanager
+    async def tracking(self):
+        self.begin()
+        try:
+            yield
+        finally:
+            self.end()
+
+    async def wait_idle(self):
+        await self.idle.wait()
+
+    def remaining(self):
+        if self.started_at is None:
+            return self.timeout
+        return max(0.0, self.timeout - (time.perf_counter() - self.started_at))
+
+    async def shutdown(self, reason='shutdown'):
+        if self.started_at is not None:
+            return
+        self.started_at = time.perf_counter()
+        self.accepting = False
+        logger.info(f"Shutting down ({reason}), {self.in_flight} requests in flight, {self.timeout:.0f}s deadline")
+        for name, func, timeout in self.steps:
+            start = time.perf_counter()
+            status = 'ok'
+            step_timeout = self.remaining() if timeout is None else min(timeout, self.remaining())
+            try:
+                # Every step gets at least a moment, so connections are still closed after an overrun
+                await asyncio.wait_for(func(), max(step_timeout, 0.5))
+            except asyncio.TimeoutError:
+                status = 'timed out'
+            except Exception:
+                status = 'failed'
+                logger.exception(f"Shutdown step {name} failed")
+            self.timings[name] = (time.perf_counter() - start, status)
+        self.report()
+
+    def report(self):
+        total = time.perf_counter() - self.started_at
+        lines = [f"Shutdown took {total:.3f}s:"]
+        lines.extend(f"  {name:<24} {seconds * 1000:9.1f} ms  {status}" for name, (seconds, status) in self.timings.items())
+        logger.info('\n'.join(lines))
+
+    def install_signal_handlers(self, on_signal):
+        """Call ``on_signal(name)`` (a coroutine function) once on SIGTERM or SIGINT."""
+        loop = asyncio.get_running_loop()
+
+        def handle(signal_name):
+            if self.shutdown_task is None:
+                self.shutdown_task = loop.create_task(on_signal(signal_name))
+
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, handle, sig.name)
+            except (NotImplementedError, RuntimeError):
+                # Not available on Windows event loops; Ctrl+C still stops the bot there
+                pass
+
+lifecycle = Lifecycle()
@@ -1,16 +1,39 @@
-import discord
+from startup import startup_timer  # imported first so the import phases below are timed
+
+with startup_timer.phase('import discord'):
+    import discord
+    from discord import app_commands
+    from discord.ext import commands
 import os
-from discord.ext import commands
 from dotenv import load_dotenv
-from fetch_HPB_data import search_book as search_hpb
-from fetch_bookfinder_data import search_bookfinder
-from fetch_openlibrary_data import search_openlibrary
 from urllib.parse import urlparse
-from database import db, add_book, remove_book, list_books, update_rating, mark_top_ten, list_top_ten, list_books_by_author, list_books_by_rating, list_books_by_title, set_designated_channel, get_designated_channel
-from book_club import BookClub
+with startup_timer.phase('import bot modules'):
+    from fetch_HPB_data import search_book as search_hpb
+    from fetch_bookfinder_data import search_bookfinder
+    from fetch_openlibrary_data import search_openlibrary_page, SearchResult
+    from database import db, add_book, remove_book, list_books, update_rating, mark_top_ten, list_top_ten, list_books_by_author, list_books_by_rating, list_books_by_title, set_designated_channel, get_designated_channel, create_search_session, append_search_results, get_search_result, list_recommendations, add_guild_member, list_leaderboard, list_indexed_titles, get_book_title, add_price_watch, remove_price_watch, list_price_watches
+    from book_club import BookClub
+    from components import router, encode_custom_id, StatelessView
+    from sessions import SearchSessionStore
+    from metrics import COMMAND_LATENCY, COMMAND_ERRORS, INTERACTION_LATENCY, INTERACTION_ERRORS, register_collected, monitor_event_loop_lag, start_metrics_server
+    from stall_watchdog import stall_watchdog
+    from scrape_queue import scrape_queue, QueueFull
+    from rendering import render_page, send_chunked, truncate
+    from isbn import canonical_isbn
+    from recommendations import refresh_periodically as refresh_recommendations
+    from enrichment import enrichment_worker
+    from title_index import title_index
+    from watchlist import PriceWatcher, parse_price, format_cents
+    from catalog import catalog
+    from lifecycle import lifecycle
+    from ipc import bus
+    from cache import LocalCache, MISSING
+    from shards import shard_config, report_health
 
 import logging
+import time
 import asyncio  # Import asyncio to handle locks
+import yarl
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -20,26 +43,60 @@ load_dotenv()
 intents = discord.Intents.default()
 intents.message_content = True
 
-bot = commands.Bot(command_prefix='$', intents=intents)
+# Point the client at another Discord API and gateway, e.g. benchmarks/fake_gateway.py
+if os.getenv('DISCORD_API_BASE'):
+    discord.http.Route.BASE = os.getenv('DISCORD_API_BASE')
+if os.getenv('DISCORD_GATEWAY_URL'):
+    discord.gateway.DiscordWebSocket.DEFAULT_GATEWAY = yarl.URL(os.getenv('DISCORD_GATEWAY_URL'))
+
+if shard_config.sharded:
+    # One worker of a sharded deployment (see sharding.py), connecting only its own range of shards
+    bot = commands.AutoShardedBot(command_prefix='$', intents=intents, shard_ids=shard_config.shard_ids, shard_count=shard_config.shard_count)
+else:
+    bot = commands.Bot(command_prefix='$', intents=intents)
 bot.db_lock = asyncio.Lock()  # Ensure the database lock is available globally
 
-search_requests = {}
+search_requests = SearchSessionStore()
+register_collected('bookbot_', SearchSessionStore.METRICS, search_requests.metrics)
+
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+# Registering slash commands is rate limited, so only do it when asked to with SYNC_APP_COMMANDS=1
+# after they have changed
+SYNC_APP_COMMANDS = os.getenv('SYNC_APP_COMMANDS', '0') == '1'
+SHUTDOWN_CLOSE_RESERVE = 5
+# Handlers waiting on a price lookup only finish once the scrape queue step drains or cancels
+# it, so waiting for them gets just this share of the deadline
+SHUTDOWN_IN_FLIGHT_SHARE = 0.4
+event_loop_lag_task = None
+recommendation_task = None
+enrichment_task = None
+watchlist_task = None
+health_task = None
+
+LIBRARY_PAGE_SIZE = 5
+SEARCH_PREFETCH_MARGIN = 3  # start loading the next page of results this close to the end of the loaded ones
+
+# session_id -> task loading that session's next page of search results
+search_prefetches = {}
+LEADERBOARD_PAGE_SIZE = 10
 
-def split_message(message, max_length=2000):
-    return [message[i:i + max_length] for i in range(0, len(message), max_length)]
+# (guild_id, user_id) pairs recently recorded in guild_members; an evicted pair just costs one INSERT OR IGNORE
+known_guild_members = LocalCache('guild_members', max_entries=50000)
+
+price_watcher = PriceWatcher(bot)
 
 def is_valid_url(url):
     parsed = urlparse(url)
     return bool(parsed.netloc) and bool(parsed.scheme)
 
-def create_message(search_results, index=0):
-    if len(search_results[index]) == 4:
-        title, author, isbn, image_url = search_results[index]
+def create_message(result, index, total):
+    if len(result) == 4:
+        title, author, isbn, image_url = result
     else:
-        title, author, isbn = search_results[index]
+        title, author, isbn = result
         image_url = None
 
-    message = (f"**Result {index + 1} of {len(search_results)}**\n"
+    message = (f"**Result {index + 1} of {total}**\n"
                f"**Title:** {title}\n"
                f"**Author:** {author}\n"
                f"**ISBN:** {isbn}\n")
@@ -47,137 +104,341 @@ def create_message(search_results, index=0):
         message += f"**Image:** {image_url}\n"
     return message
 
-class NavigationView(discord.ui.View):
-    def __init__(self, user_id, search_results):
-        super().__init__()
-        self.user_id = user_id
-        self.search_results = search_results
-        self.index = 0
-        self.add_item(AddToLibraryButton(user_id, search_results[self.index]))
-
-    @discord.ui.button(label='Previous', style=discord.ButtonStyle.primary, emoji='⬅️')
-    async def previous(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if interaction.user and interaction.user.id != self.user_id:
-            await interaction.response.send_message("You cannot interact with this message.", ephemeral=True)
-            return
+def format_book_row(number, row):
+    title, author, isbn, rating = row
+    return f'{number}. **{title}** by **{author}** (ISBN: {isbn}) - Rating: {rating or "N/A"}'
 
-        if self.index > 0:
-            self.index -= 1
-            self.children[-1].book = self.search_results[self.index]  # Update the book for the add to library button
-            await interaction.response.edit_message(content=create_message(self.search_results, self.index), view=self)
+def format_author_book_row(number, row):
+    title, isbn, rating = row
+    return f'{number}. **{title}** (ISBN: {isbn}) - Rating: {rating or "N/A"}'
 
-    @discord.ui.button(label='Next', style=discord.ButtonStyle.primary, emoji='➡️')
-    async def next(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if interaction.user and interaction.user.id != self.user_id:
-            await interaction.response.send_message("You cannot interact with this message.", ephemeral=True)
-            return
+def format_recommendation_row(number, row):
+    title, author, isbn, _ = row
+    return f'{number}. **{title}** by **{author}** (ISBN: {isbn})'
 
-        if self.index < len(self.search_results) - 1:
-            self.index += 1
-            self.children[-1].book = self.search_results[self.index]  # Update the book for the add to library button
-            await interaction.response.edit_message(content=create_message(self.search_results, self.index), view=self)
+def format_leaderboard_row(number, row):
+    title, author, mean_rating, rating_count, score = row
+    ratings = 'rating' if rating_count == 1 else 'ratings'
+    return f'{number}. **{title}** by **{author}** - {mean_rating:.1f} avg from {rating_count} {ratings} (score {score:.2f})'
 
-    @discord.ui.button(label='Select', style=discord.ButtonStyle.success, emoji='✅')
-    async def select(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if interaction.user and interaction.user.id != self.user_id:
-            await interaction.response.send_message("You cannot interact with this message.", ephemeral=True)
-            return
+def format_leaderboard_page(books, offset=0):
+    return render_page(books, format_leaderboard_row, header='**Top Rated Books in This Server:**', start=offset + 1)
 
-        title, author, isbn, image_url = self.search_results[self.index]
-        price_message = (f"**Title:** {title}\n"
-                         f"**Author:** {author}\n"
-                         f"**ISBN:** {isbn}\n")
-        await interaction.response.send_message(price_message)
-        if is_valid_url(image_url):
-            await interaction.channel.send(f"**Image:** {image_url}")
-
-        # Perform HPB search
-        hpb_results = search_hpb(title)
-        if hpb_results:
-            for idx, (hpb_title, hpb_url, hpb_isbn, hpb_image_url, hpb_prices) in enumerate(hpb_results):
-                hpb_price_text = " - ".join(hpb_prices) if hpb_prices else "N/A"
-                hpb_message = (f"**Match found at Half Price Books:**\n"
-                               f"**Title:** {hpb_title}\n"
-                               f"**Price Range:** {hpb_price_text}\n"
-                               f"**ISBN:** {hpb_isbn}\n"
-                               f"**Link:** [HPB]({hpb_url})\n")
-                await interaction.channel.send(hpb_message)
-                if is_valid_url(hpb_image_url):
-                    embed = discord.Embed()
-                    embed.set_image(url=hpb_image_url)
-                    await interaction.channel.send(embed=embed)
-        else:
-            await interaction.channel.send("No matches found at Half Price Books.")
-
-        # Perform BookFinder search
-        bookfinder_data = search_bookfinder(isbn)
-        if bookfinder_data:
-            bookfinder_message = (f"**BookFinder Price Range:** {bookfinder_data['price_range']}\n"
-                                  f"**Range Minimum:** {bookfinder_data['first_listing_price']}\n"
-                                  f"**Range Maximum:** {bookfinder_data['fifth_listing_price']}")
-            await interaction.channel.send(bookfinder_message)
-        else:
-            await interaction.channel.send('No suitable format found on BookFinder.')
+def format_watch_row(number, row):
+    title, isbn, target_cents, best_cents = row
+    return f'{number}. **{title}** (ISBN: {isbn}) - Target: {format_cents(target_cents)}, Latest: {format_cents(best_cents)}'
+
+def format_library_page(books, offset=0):
+    # A page is a handful of rows, but long titles could still push it past the limit
+    return render_page(books, format_book_row, start=offset + 1)
+
+class NavigationView(StatelessView):
+    def __init__(self, guild_id, session_id, index, total):
+        super().__init__()
+        self.add_button('Previous', encode_custom_id('search_nav', guild_id, session_id, index - 1), emoji='⬅️', disabled=index <= 0)
+        self.add_button('Next', encode_custom_id('search_nav', guild_id, session_id, index + 1), emoji='➡️', disabled=index >= total - 1)
+        self.add_button('Select', encode_custom_id('search_select', guild_id, session_id, index), style=discord.ButtonStyle.success, emoji='✅')
+        self.add_button('Add to Library', encode_custom_id('search_add', guild_id, session_id, index), style=discord.ButtonStyle.secondary, emoji='📚')
+        self.seal()
+
+class LibraryView(StatelessView):
+    def __init__(self, guild_id, user_id, page_index, has_next):
+        super().__init__()
+        self.add_button('Previous', encode_custom_id('library_page', guild_id, user_id, page_index - 1), emoji='⬅️', disabled=page_index <= 0)
+        self.add_button('Next', encode_custom_id('library_page', guild_id, user_id, page_index + 1), emoji='➡️', disabled=not has_next)
+        self.seal()
 
-class AddToLibraryButton(discord.ui.Button):
-    def __init__(self, user_id, book):
-        super().__init__(label='Add to Library', style=discord.ButtonStyle.secondary, emoji='📚')
-        self.user_id = user_id
-        self.book = book
+class LeaderboardView(StatelessView):
+    def __init__(self, guild_id, page_index, has_next):
+        super().__init__()
+        self.add_button('Previous', encode_custom_id('leaderboard_page', guild_id, 0, page_index - 1), emoji='⬅️', disabled=page_index <= 0)
+        self.add_button('Next', encode_custom_id('leaderboard_page', guild_id, 0, page_index + 1), emoji='➡️', disabled=not has_next)
+        self.seal()
 
-    async def callback(self, interaction: discord.Interaction):
-        if interaction.user and interaction.user.id != self.user_id:
-            await interaction.response.send_message("You cannot interact with this message.", ephemeral=True)
+async def track_guild_member(guild_id, user_id):
+    # Library users count towards the leaderboards of every guild they use the bot in
+    if not guild_id or known_guild_members.get((guild_id, user_id)) is not MISSING:
+        return
+    await add_guild_member(guild_id, user_id)
+    known_guild_members.put((guild_id, user_id), True)
+
+async def load_search_result(interaction, session_id, index):
+    """(query, loaded, total, result) for the user's own search; result is None if its page is still being fetched."""
+    row = await get_search_result(session_id, index)
+    if row is None or index >= row[3]:
+        await interaction.response.send_message("This search has expired. Please run `$search` again.", ephemeral=True)
+        return None
+    user_id, query, loaded, total = row[:4]
+    if interaction.user and interaction.user.id != user_id:
+        await interaction.response.send_message("You cannot interact with this message.", ephemeral=True)
+        return None
+    return query, loaded, total, SearchResult(*row[4:]) if row[4] is not None else None
+
+async def fetch_search_page(session_id, query, start):
+    """Load and store the page at ``start``; returns False if OpenLibrary failed, leaving the session as it was."""
+    page = await asyncio.to_thread(search_openlibrary_page, query, start)
+    if page is None:
+        return False
+    results, total = page
+    await append_search_results(session_id, start, results, total)
+    return True
+
+def prefetch_search_page(session_id, query, start):
+    """Start loading the page after ``start`` unless it is already on its way; returns the task."""
+    task = search_prefetches.get(session_id)
+    if task is None:
+        task = asyncio.create_task(fetch_search_page(session_id, query, start))
+        search_prefetches[session_id] = task
+        task.add_done_callback(lambda _: search_prefetches.pop(session_id, None))
+    return task
+
+@router.route('search_nav')
+async def search_nav(interaction, guild_id, session_id, index):
+    loaded_result = await load_search_result(interaction, session_id, index)
+    if loaded_result is None:
+        return
+    query, loaded, total, result = loaded_result
+    respond = interaction.response.edit_message
+    if result is None:
+        # Next outran the prefetch: acknowledge within the interaction deadline, then wait for the page
+        await interaction.response.defer()
+        if not await prefetch_search_page(session_id, query, loaded):
+            await interaction.followup.send("Could not load more results right now. Please try again.", ephemeral=True)
+            return
+        row = await get_search_result(session_id, index)
+        if row is None or row[4] is None:
+            await interaction.followup.send("No more results.", ephemeral=True)
             return
+        _, query, loaded, total = row[:4]
+        result = SearchResult(*row[4:])
+        respond = interaction.edit_original_response
+    await respond(content=create_message(result, index, total), view=NavigationView(guild_id, session_id, index, total))
+    if loaded < total and loaded - index <= SEARCH_PREFETCH_MARGIN:
+        prefetch_search_page(session_id, query, loaded)
+
+async def scrape_result(job):
+    try:
+        return await job.result()
+    except asyncio.TimeoutError:
+        logger.warning(f"Scrape job {job.name} timed out")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Scrape job {job.name} failed: {e}")
+    return None
+
+@router.route('search_select')
+async def search_select(interaction, guild_id, session_id, index):
+    loaded = await load_search_result(interaction, session_id, index)
+    if loaded is None:
+        return
+    _, _, _, (title, author, isbn, image_url) = loaded
+
+    hpb_job = None
+    try:
+        hpb_job, position = scrape_queue.submit(search_hpb, title, user_id=interaction.user.id, guild_id=guild_id)
+        bookfinder_job, _ = scrape_queue.submit(search_bookfinder, isbn, user_id=interaction.user.id, guild_id=guild_id)
+    except QueueFull as e:
+        if hpb_job is not None:
+            hpb_job.cancel()
+        await interaction.response.send_message(f"{e} Please try again in a minute.", ephemeral=True)
+        return
 
-        if len(self.book) == 4:
-            title, author, isbn, image_url = self.book
-        else:
-            title, author, isbn = self.book
-            image_url = None
+    price_message = (f"**Title:** {title}\n"
+                     f"**Author:** {author}\n"
+                     f"**ISBN:** {isbn}\n"
+                     f"Price lookup queued, position {position}.")
+    await interaction.response.send_message(price_message)
+    if is_valid_url(image_url):
+        await interaction.channel.send(f"**Image:** {image_url}")
+
+    # Perform HPB search
+    hpb_results = await scrape_result(hpb_job)
+    if hpb_results:
+        for idx, (hpb_title, hpb_url, hpb_isbn, hpb_image_url, hpb_prices) in enumerate(hpb_results):
+            hpb_price_text = " - ".join(hpb_prices) if hpb_prices else "N/A"
+            hpb_message = (f"**Match found at Half Price Books:**\n"
+                           f"**Title:** {hpb_title}\n"
+                           f"**Price Range:** {hpb_price_text}\n"
+                           f"**ISBN:** {hpb_isbn}\n"
+                           f"**Link:** [HPB]({hpb_url})\n")
+            await interaction.channel.send(hpb_message)
+            if is_valid_url(hpb_image_url):
+                embed = discord.Embed()
+                embed.set_image(url=hpb_image_url)
+                await interaction.channel.send(embed=embed)
+    else:
+        await interaction.channel.send("No matches found at Half Price Books.")
+
+    # Perform BookFinder search
+    bookfinder_data = await scrape_result(bookfinder_job)
+    if bookfinder_data:
+        bookfinder_message = (f"**BookFinder Price Range:** {bookfinder_data['price_range']}\n"
+                              f"**Range Minimum:** {bookfinder_data['first_listing_price']}\n"
+                              f"**Range Maximum:** {bookfinder_data['fifth_listing_price']}")
+        await interaction.channel.send(bookfinder_message)
+    else:
+        await interaction.channel.send('No suitable format found on BookFinder.')
 
-        await add_book(self.user_id, title, author, isbn, image_url)
-        await interaction.response.send_message(f'Added "{title}" by {author} to your library.', ephemeral=True)
+@router.route('search_add')
+async def search_add(interaction, guild_id, session_id, index):
+    loaded = await load_search_result(interaction, session_id, index)
+    if loaded is None:
+        return
+    _, _, _, (title, author, isbn, image_url) = loaded
+    canonical = canonical_isbn(isbn)
+    if canonical is None:
+        await interaction.response.send_message(f'"{title}" has no valid ISBN on OpenLibrary, so it cannot be added to your library.', ephemeral=True)
+        return
+    await track_guild_member(guild_id, interaction.user.id)
+    await add_book(interaction.user.id, title, author, canonical, image_url)
+    await interaction.response.send_message(f'Added "{title}" by {author} to your library.', ephemeral=True)
+
+@router.route('library_page')
+async def library_page(interaction, guild_id, user_id, page_index):
+    if interaction.user and interaction.user.id != user_id:
+        await interaction.response.send_message("You cannot interact with this message.", ephemeral=True)
+        return
 
-class LibraryView(discord.ui.View):
-    def __init__(self, user_id, books, page_size=5):
-        super().__init__()
-        self.user_id = user_id
-        self.books = books
-        self.page_size = page_size
-        self.page_index = 0
-
-    def get_page(self):
-        start = self.page_index * self.page_size
-        end = start + self.page_size
-        page_books = self.books[start:end]
-        message = '\n'.join([f'{idx + 1}. **{title}** by **{author}** (ISBN: {isbn}) - Rating: {rating or "N/A"}' for idx, (title, author, isbn, rating) in enumerate(page_books)])
-        return message
-
-    @discord.ui.button(label='Previous', style=discord.ButtonStyle.primary, emoji='⬅️')
-    async def previous(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if interaction.user and interaction.user.id != self.user_id:
-            await interaction.response.send_message("You cannot interact with this message.", ephemeral=True)
-            return
+    # Fetch one extra row to know whether there is a next page
+    books = await list_books(user_id, LIBRARY_PAGE_SIZE + 1, page_index * LIBRARY_PAGE_SIZE)
+    if not books:
+        await interaction.response.defer()
+        return
+    has_next = len(books) > LIBRARY_PAGE_SIZE
+    await interaction.response.edit_message(content=format_library_page(books[:LIBRARY_PAGE_SIZE], page_index * LIBRARY_PAGE_SIZE),
+                                            view=LibraryView(guild_id, user_id, page_index, has_next))
+
+@router.route('leaderboard_page')
+async def leaderboard_page(interaction, guild_id, _, page_index):
+    books = await list_leaderboard(guild_id, LEADERBOARD_PAGE_SIZE + 1, page_index * LEADERBOARD_PAGE_SIZE)
+    if not books:
+        await interaction.response.defer()
+        return
+    has_next = len(books) > LEADERBOARD_PAGE_SIZE
+    await interaction.response.edit_message(content=format_leaderboard_page(books[:LEADERBOARD_PAGE_SIZE], page_index * LEADERBOARD_PAGE_SIZE),
+                                            view=LeaderboardView(guild_id, page_index, has_next))
 
-        if self.page_index > 0:
-            self.page_index -= 1
-            await interaction.response.edit_message(content=self.get_page(), view=self)
+async def rebuild_title_index():
+    # After an IPC bus outage this worker may have missed other workers' titles
+    title_index.build(*await list_indexed_titles())
 
-    @discord.ui.button(label='Next', style=discord.ButtonStyle.primary, emoji='➡️')
-    async def next(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if interaction.user and interaction.user.id != self.user_id:
-            await interaction.response.send_message("You cannot interact with this message.", ephemeral=True)
-            return
+async def relay_channel_message(message):
+    # Sent by a worker's background job for a channel in a guild this worker's shards own
+    channel = bot.get_channel(message['channel_id'])
+    if channel is not None:
+        for content in message['contents']:
+            await channel.send(content)
 
-        if (self.page_index + 1) * self.page_size < len(self.books):
-            self.page_index += 1
-            await interaction.response.edit_message(content=self.get_page(), view=self)
+bus.on_reset(rebuild_title_index)
+bus.subscribe('channel_message', relay_channel_message)
+
+@bot.event
+async def setup_hook():
+    # Runs after login but before connecting to the gateway, so both databases
+    # are ready before the first command can arrive
+    global event_loop_lag_task, recommendation_task, enrichment_task, watchlist_task, health_task
+    startup_timer.mark('logged in')
+    startup_timer.between('login', 'starting', 'logged in')
+    if shard_config.ipc_socket:
+        with startup_timer.phase('ipc bus'):
+            await bus.connect(shard_config.ipc_socket, shard_config.worker_id)
+    with startup_timer.phase('library database'):
+        await db.connect()
+    with startup_timer.phase('book club cog'):
+        await bot.add_cog(BookClub(bot))
+    with startup_timer.phase('title index'):
+        title_index.build(*await list_indexed_titles())
+    title_index.report()
+    if SYNC_APP_COMMANDS:
+        with startup_timer.phase('sync app commands'):
+            await bot.tree.sync()
+    event_loop_lag_task = asyncio.create_task(monitor_event_loop_lag())
+    # In a sharded deployment only one worker runs the jobs that cover every guild
+    if shard_config.background_jobs:
+        recommendation_task = asyncio.create_task(refresh_recommendations(db.db_path))
+        enrichment_task = asyncio.create_task(enrichment_worker.run())
+        watchlist_task = asyncio.create_task(price_watcher.run())
+    if shard_config.sharded:
+        health_task = asyncio.create_task(report_health(bot))
+    stall_watchdog.start()
+    lifecycle.install_signal_handlers(shutdown)
+    startup_timer.mark('connecting')
+
+async def stop_background_tasks():
+    background = [task for task in (event_loop_lag_task, recommendation_task, enrichment_task, watchlist_task, health_task) if task]
+    background.extend(search_prefetches.values())
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    stall_watchdog.stop()
+
+async def close_catalog():
+    catalog.close()
+
+async def close_scrape_queue():
+    # Leave a few seconds of the deadline for the steps that close the databases
+    await scrape_queue.close(drain_timeout=max(0.0, lifecycle.remaining() - SHUTDOWN_CLOSE_RESERVE))
+
+async def shutdown_book_club():
+    cog = bot.get_cog('BookClub')
+    if cog is not None:
+        await cog.shutdown()
+
+# Run in order on SIGTERM/SIGINT; background tasks go before the scrape queue so their jobs do not hold up the drain
+lifecycle.add_step('in-flight requests', lifecycle.wait_idle, timeout=lifecycle.timeout * SHUTDOWN_IN_FLIGHT_SHARE)
+lifecycle.add_step('background tasks', stop_background_tasks)
+lifecycle.add_step('scrape queue', close_scrape_queue)
+lifecycle.add_step('book club cog', shutdown_book_club)
+lifecycle.add_step('library database', db.close)
+lifecycle.add_step('catalog', close_catalog)
+lifecycle.add_step('ipc bus', bus.close)
+
+async def shutdown(reason):
+    await lifecycle.shutdown(reason)
+    await bot.close()
 
 @bot.event
 async def on_ready():
     print(f'We have logged in as {bot.user}')
-    await db.connect()
+    if not startup_timer.reported:
+        startup_timer.mark('ready')
+        startup_timer.between('gateway', 'connecting', 'ready')
+        startup_timer.report()
+    else:
+        startup_timer.reconnected()
+
+@bot.event
+async def on_disconnect():
+    startup_timer.disconnected()
+
+@bot.event
+async def on_resumed():
+    startup_timer.reconnected()
+
+@bot.before_invoke
+async def start_command_timer(ctx):
+    ctx.command_started_at = time.perf_counter()
+    stall_watchdog.track_activity(f'command:{ctx.command.qualified_name}')
+    if ctx.guild:
+        await track_guild_member(ctx.guild.id, ctx.author.id)
+
+@bot.after_invoke
+async def record_command_latency(ctx):
+    started_at = getattr(ctx, 'command_started_at', None)
+    if started_at is not None:
+        COMMAND_LATENCY.observe(time.perf_counter() - started_at, command=ctx.command.qualified_name)
+    if ctx.command_failed:
+        COMMAND_ERRORS.inc(command=ctx.command.qualified_name)
+
+@bot.event
+async def on_interaction(interaction):
+    if not lifecycle.accepting:
+        if interaction.type == discord.InteractionType.component:
+            await interaction.response.send_message("The bot is restarting, please try again in a moment.", ephemeral=True)
+        return
+    async with lifecycle.tracking():
+        await router.dispatch(interaction)
 
 @bot.command(name='search')
 async def search(ctx):
@@ -185,14 +446,61 @@ async def search(ctx):
     if channel_id and ctx.channel.id != channel_id:
         return
     await ctx.send('Please enter the book title:')
-    search_requests[ctx.author.id] = {'stage': 'awaiting_title'}
+    search_requests.start(ctx.author.id)
+
+async def title_autocomplete(interaction, current):
+    return [app_commands.Choice(name=truncate(title, 100), value=title[:100]) for title in title_index.lookup(current)]
+
+@bot.tree.command(name='search', description='Search OpenLibrary for a book by title.')
+@app_commands.describe(title='Book title; suggestions come from libraries and recent searches')
+@app_commands.autocomplete(title=title_autocomplete)
+async def search_slash(interaction, title: str):
+    # App commands are invoked by the command tree, not on_interaction, so they are gated,
+    # tracked and timed here like routed components
+    if not lifecycle.accepting:
+        await interaction.response.send_message("The bot is restarting, please try again in a moment.", ephemeral=True)
+        return
+    async with lifecycle.tracking():
+        stall_watchdog.track_activity('slash:search')
+        start = time.perf_counter()
+        try:
+            await run_search_slash(interaction, title)
+        except Exception:
+            INTERACTION_ERRORS.inc(action='slash:search')
+            raise
+        finally:
+            INTERACTION_LATENCY.observe(time.perf_counter() - start, action='slash:search')
+
+async def run_search_slash(interaction, title):
+    guild_id = interaction.guild_id or 0
+    channel_id = await get_designated_channel(guild_id)
+    if channel_id and interaction.channel_id != channel_id:
+        await interaction.response.send_message(f'Please use <#{channel_id}> for book commands.', ephemeral=True)
+        return
+    # The search can outlast the 3 second response window, so acknowledge first
+    await interaction.response.defer(thinking=True)
+    page = await asyncio.to_thread(search_openlibrary_page, title)
+    if page is None:
+        await interaction.followup.send('OpenLibrary could not be reached. Please try again later.')
+        return
+    search_results, total = page
+    if not search_results:
+        await interaction.followup.send('No results found.')
+        return
+    session_id = await create_search_session(interaction.user.id, title, search_results, total)
+    view = NavigationView(guild_id, session_id, 0, total)
+    await interaction.followup.send(create_message(search_results[0], 0, total), view=view)
 
 @bot.command(name='add')
 async def add(ctx, title: str, author: str, isbn: str, image_url: str):
     channel_id = await get_designated_channel(ctx.guild.id)
     if channel_id and ctx.channel.id != channel_id:
         return
-    await add_book(ctx.author.id, title, author, isbn, image_url)
+    canonical = canonical_isbn(isbn)
+    if canonical is None:
+        await ctx.send(f'{isbn} is not a valid ISBN-10 or ISBN-13.')
+        return
+    await add_book(ctx.author.id, title, author, canonical, image_url)
     await ctx.send(f'Added "{title}" by {author} to your library.')
 
 @bot.command(name='remove')
@@ -200,8 +508,10 @@ async def remove(ctx, isbn: str):
     channel_id = await get_designated_channel(ctx.guild.id)
     if channel_id and ctx.channel.id != channel_id:
         return
-    await remove_book(ctx.author.id, isbn)
-    await ctx.send(f'Removed book with ISBN {isbn} from your library.')
+    if await remove_book(ctx.author.id, isbn):
+        await ctx.send(f'Removed book with ISBN {isbn} from your library.')
+    else:
+        await ctx.send(f'No book with ISBN {isbn} found in your library.')
 
 @bot.command(name='list')
 async def list_books_command(ctx, filter_type: str = 'all', filter_value: str = None):
@@ -209,40 +519,35 @@ async def list_books_command(ctx, filter_type: str = 'all', filter_value: str =
     if channel_id and ctx.channel.id != channel_id:
         return
     if filter_type == 'all':
-        books = await list_books(ctx.author.id)
+        books = await list_books(ctx.author.id, LIBRARY_PAGE_SIZE + 1)
         if not books:
             await ctx.send('Your library is empty.')
         else:
-            view = LibraryView(ctx.author.id, books)
-            await ctx.send(view.get_page(), view=view)
+            view = LibraryView(ctx.guild.id, ctx.author.id, 0, len(books) > LIBRARY_PAGE_SIZE)
+            await ctx.send(format_library_page(books[:LIBRARY_PAGE_SIZE]), view=view)
     
     elif filter_type == 'author':
         books = await list_books_by_author(ctx.author.id, filter_value)
-        if not books:
-            await ctx.send(f'No books by {filter_value} found in your library.')
-        else:
-            author_books_message = '\n'.join([f'{idx + 1}. **{title}** (ISBN: {isbn}) - Rating: {rating or "N/A"}' for idx, (title, isbn, rating) in enumerate(books)])
-            await ctx.send(f'**Books by {filter_value} in Your Library:**\n{author_books_message}')
+        await send_chunked(ctx, books, format_author_book_row,
+                           header=f'**Books by {filter_value} in Your Library:**',
+                           empty_message=f'No books by {filter_value} found in your library.')
     
     elif filter_type == 'rating':
         try:
             min_rating = int(filter_value)
-            books = await list_books_by_rating(ctx.author.id, min_rating)
-            if not books:
-                await ctx.send(f'No books with rating {min_rating} or higher found in your library.')
-            else:
-                rating_books_message = '\n'.join([f'{idx + 1}. **{title}** by **{author}** (ISBN: {isbn}) - Rating: {rating or "N/A"}' for idx, (title, author, isbn, rating) in enumerate(books)])
-                await ctx.send(f'**Books with Rating {min_rating} or Higher in Your Library:**\n{rating_books_message}')
-        except ValueError:
+        except (TypeError, ValueError):
             await ctx.send('Invalid rating. Please enter a number.')
+            return
+        books = await list_books_by_rating(ctx.author.id, min_rating)
+        await send_chunked(ctx, books, format_book_row,
+                           header=f'**Books with Rating {min_rating} or Higher in Your Library:**',
+                           empty_message=f'No books with rating {min_rating} or higher found in your library.')
     
     elif filter_type == 'title':
         books = await list_books_by_title(ctx.author.id, filter_value)
-        if not books:
-            await ctx.send(f'No books with title containing "{filter_value}" found in your library.')
-        else:
-            title_books_message = '\n'.join([f'{idx + 1}. **{title}** by **{author}** (ISBN: {isbn}) - Rating: {rating or "N/A"}' for idx, (title, author, isbn, rating) in enumerate(books)])
-            await ctx.send(f'**Books with Title Containing "{filter_value}" in Your Library:**\n{title_books_message}')
+        await send_chunked(ctx, books, format_book_row,
+                           header=f'**Books with Title Containing "{filter_value}" in Your Library:**',
+                           empty_message=f'No books with title containing "{filter_value}" found in your library.')
     
     else:
         await ctx.send('Invalid filter type. Use "author", "rating", "title", or "all".')
@@ -253,8 +558,10 @@ async def rate(ctx, isbn: str, rating: int):
     if channel_id and ctx.channel.id != channel_id:
         return
     if 1 <= rating <= 10:
-        await update_rating(ctx.author.id, isbn, rating)
-        await ctx.send(f'Updated rating for book with ISBN {isbn} to {rating}.')
+        if await update_rating(ctx.author.id, isbn, rating):
+            await ctx.send(f'Updated rating for book with ISBN {isbn} to {rating}.')
+        else:
+            await ctx.send(f'No book with ISBN {isbn} found in your library.')
     else:
         await ctx.send('Rating must be between 1 and 10.')
 
@@ -263,16 +570,20 @@ async def mark_top_ten_command(ctx, isbn: str):
     channel_id = await get_designated_channel(ctx.guild.id)
     if channel_id and ctx.channel.id != channel_id:
         return
-    await mark_top_ten(ctx.author.id, isbn, True)
-    await ctx.send(f'Marked book with ISBN {isbn} as one of your top 10.')
+    if await mark_top_ten(ctx.author.id, isbn, True):
+        await ctx.send(f'Marked book with ISBN {isbn} as one of your top 10.')
+    else:
+        await ctx.send(f'No book with ISBN {isbn} found in your library.')
 
 @bot.command(name='unmarktopten')
 async def unmark_topten_command(ctx, isbn: str):
     channel_id = await get_designated_channel(ctx.guild.id)
     if channel_id and ctx.channel.id != channel_id:
         return
-    await mark_top_ten(ctx.author.id, isbn, False)
-    await ctx.send(f'Removed book with ISBN {isbn} from your top 10.')
+    if await mark_top_ten(ctx.author.id, isbn, False):
+        await ctx.send(f'Removed book with ISBN {isbn} from your top 10.')
+    else:
+        await ctx.send(f'No book with ISBN {isbn} found in your library.')
 
 @bot.command(name='topten')
 async def top_ten(ctx):
@@ -280,42 +591,112 @@ async def top_ten(ctx):
     if channel_id and ctx.channel.id != channel_id:
         return
     books = await list_top_ten(ctx.author.id)
-    if not books:
-        await ctx.send('Your top 10 list is empty.')
+    await send_chunked(ctx, books, format_book_row, header='**Your Top 10 Books:**',
+                       empty_message='Your top 10 list is empty.')
+
+@bot.command(name='watch')
+async def watch(ctx, isbn: str, target_price: str):
+    channel_id = await get_designated_channel(ctx.guild.id)
+    if channel_id and ctx.channel.id != channel_id:
+        return
+    canonical = canonical_isbn(isbn)
+    if canonical is None:
+        await ctx.send(f'{isbn} is not a valid ISBN-10 or ISBN-13.')
+        return
+    target_cents = parse_price(target_price)
+    if not target_cents:
+        await ctx.send('Invalid target price. Please enter an amount like 12.50.')
+        return
+    # HPB is searched by title, so the book has to be known already
+    title = await get_book_title(canonical)
+    if title is None:
+        local = await asyncio.to_thread(catalog.lookup_isbn, canonical)
+        title = local[0] if local else None
+    if title is None:
+        await ctx.send(f'No book with ISBN {isbn} is known yet. Add it with `$add` or find it with `$search` first.')
+        return
+    await add_price_watch(ctx.author.id, ctx.guild.id, ctx.channel.id, canonical, title, target_cents)
+    await ctx.send(f'Watching "{title}" for a price of {format_cents(target_cents)} or less.')
+
+@bot.command(name='unwatch')
+async def unwatch(ctx, isbn: str):
+    channel_id = await get_designated_channel(ctx.guild.id)
+    if channel_id and ctx.channel.id != channel_id:
+        return
+    if await remove_price_watch(ctx.author.id, isbn):
+        await ctx.send(f'Stopped watching the price of ISBN {isbn}.')
     else:
-        top_ten_message = '\n'.join([f'{idx + 1}. **{title}** by **{author}** (ISBN: {isbn}) - Rating: {rating or "N/A"}' for idx, (title, author, isbn, rating) in enumerate(books)])
-        await ctx.send(f'**Your Top 10 Books:**\n{top_ten_message}')
+        await ctx.send(f'You are not watching ISBN {isbn}.')
+
+@bot.command(name='watchlist')
+async def watchlist(ctx):
+    channel_id = await get_designated_channel(ctx.guild.id)
+    if channel_id and ctx.channel.id != channel_id:
+        return
+    watches = await list_price_watches(ctx.author.id)
+    await send_chunked(ctx, watches, format_watch_row, header='**Your Price Watchlist:**',
+                       empty_message='You are not watching any prices.')
+
+@bot.command(name='leaderboard')
+async def leaderboard(ctx):
+    channel_id = await get_designated_channel(ctx.guild.id)
+    if channel_id and ctx.channel.id != channel_id:
+        return
+    books = await list_leaderboard(ctx.guild.id, LEADERBOARD_PAGE_SIZE + 1)
+    if not books:
+        await ctx.send('Nobody in this server has rated any books yet.')
+        return
+    view = LeaderboardView(ctx.guild.id, 0, len(books) > LEADERBOARD_PAGE_SIZE)
+    await ctx.send(format_leaderboard_page(books[:LEADERBOARD_PAGE_SIZE]), view=view)
+
+@bot.command(name='recommend')
+async def recommend(ctx):
+    channel_id = await get_designated_channel(ctx.guild.id)
+    if channel_id and ctx.channel.id != channel_id:
+        return
+    books = await list_recommendations(ctx.author.id)
+    await send_chunked(ctx, books, format_recommendation_row, header='**Readers Like You Also Enjoyed:**',
+                       empty_message='No recommendations yet. Add and rate a few more books!')
 
 @bot.event
 async def on_message(message):
-    # Ignore bot's own messages
-    if message.author == bot.user:
+    # Ignore bot's own messages, and everything once shutdown has begun
+    if message.author == bot.user or not lifecycle.accepting:
         return
+    async with lifecycle.tracking():
+        await handle_message(message)
 
+async def handle_message(message):
     await bot.process_commands(message)
 
-    if message.author.id in search_requests:
-        user_request = search_requests[message.author.id]
-
-        if user_request['stage'] == 'awaiting_title':
-            book_title = message.content.strip()
-            if book_title.startswith('$'):  # Ignore commands
-                return
-            
-            search_results = search_openlibrary(book_title)
-            
-            if not search_results:
-                await message.channel.send('No results found.')
-                del search_requests[message.author.id]
-                return
-
-            user_request['results'] = search_results
-            user_request['index'] = 0
-            user_request['stage'] = 'viewing_results'
-
-            result_message = create_message(search_results)
-            view = NavigationView(message.author.id, search_results)
-            await message.channel.send(result_message, view=view)
+    user_request = search_requests.get(message.author.id)
+    if user_request is None:
+        return
+
+    if user_request.stage == 'awaiting_title':
+        book_title = message.content.strip()
+        if book_title.startswith('$'):  # Ignore commands
+            return
+
+        # Results are persisted with the search session, so the prompt is done either way
+        search_requests.pop(message.author.id)
+        stall_watchdog.track_activity('search:title_reply')
+        page = await asyncio.to_thread(search_openlibrary_page, book_title)
+        if page is None:
+            await message.channel.send('OpenLibrary could not be reached. Please try again later.')
+            return
+        search_results, total = page
+
+        if not search_results:
+            await message.channel.send('No results found.')
+            return
+
+        session_id = await create_search_session(message.author.id, book_title, search_results, total)
+
+        guild_id = message.guild.id if message.guild else 0
+        result_message = create_message(search_results[0], 0, total)
+        view = NavigationView(guild_id, session_id, 0, total)
+        await message.channel.send(result_message, view=view)
 
 # Command to set the designated channel
 @bot.command(name='setchannel')
@@ -343,6 +724,12 @@ async def custom_help(ctx):
         inline=False
     )
 
+    embed.add_field(
+        name="/search <title>",
+        value="Search for a book with title suggestions as you type.",
+        inline=False
+    )
+
     embed.add_field(
         name="$add <title> <author> <isbn> <image_url>",
         value="Add a book to your library with the specified details.",
@@ -385,6 +772,36 @@ async def custom_help(ctx):
         inline=False
     )
 
+    embed.add_field(
+        name="$watch <isbn> <target_price>",
+        value="Get notified here when a book's price drops to the target or below.",
+        inline=False
+    )
+
+    embed.add_field(
+        name="$unwatch <isbn>",
+        value="Stop watching a book's price.",
+        inline=False
+    )
+
+    embed.add_field(
+        name="$watchlist",
+        value="List the prices you are watching.",
+        inline=False
+    )
+
+    embed.add_field(
+        name="$leaderboard",
+        value="Show the top rated books among members of this server.",
+        inline=False
+    )
+
+    embed.add_field(
+        name="$recommend",
+        value="Suggest books read by people with libraries like yours.",
+        inline=False
+    )
+
     embed.add_field(
         name="$setchannel <channel>",
         value="Set the designated channel where the bot will respond and send messages.",
@@ -399,8 +816,12 @@ async def custom_help(ctx):
 
     await ctx.send(embed=embed)
 
-# Register the BookClub cog
-bot.add_cog(BookClub(bot))
+# Scrape workers are spawned processes that re-import this module, so only start the bot when run directly
+if __name__ == '__main__':
+    # Expose metrics in Prometheus text format; set METRICS_PORT=0 to disable
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
 
-# Run the bot
-bot.run(os.getenv('TOKEN'))
+    # Run the bot
+    startup_timer.mark('starting')
+    bot.run(os.getenv('TOKEN'))
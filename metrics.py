@@ -0,0 +1,243 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in pairs) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class Metric:
+    type_name = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+
+    def label_key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        lines.extend(self.samples())
+        return lines
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.values = {}
+        self.function = function
+
+    def inc(self, amount=1, **labels):
+        key = self.label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self.label_key(labels), 0)
+
+    def set_function(self, function):
+        # Read the current value from ``function`` at scrape time (unlabelled metrics only)
+        self.function = function
+
+    def samples(self):
+        if self.function is not None:
+            return [f'{self.name} {format_value(self.function())}']
+        with self.lock:
+            items = list(self.values.items())
+        return [f'{self.name}{format_labels(self.labelnames, key)} {format_value(value)}' for key, value in items]
+
+class Gauge(Counter):
+    type_name = 'gauge'
+
+    def set(self, value, **labels):
+        key = self.label_key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self.series = {}
+
+    def observe(self, value, **labels):
+        key = self.label_key(labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self.lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self.series.items()]
+        lines = []
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = format_labels(self.labelnames, key, [('le', format_value(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=(), function=None):
+        return self.register(Counter(name, documentation, labelnames, function))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self.register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+COMMAND_LATENCY = registry.histogram('bookbot_command_latency_seconds', 'Prefix command latency.', ['command'])
+COMMAND_ERRORS = registry.counter('bookbot_command_errors_total', 'Prefix commands that raised an error.', ['command'])
+INTERACTION_LATENCY = registry.histogram('bookbot_interaction_latency_seconds', 'Component and slash command interaction handler latency.', ['action'])
+INTERACTION_ERRORS = registry.counter('bookbot_interaction_errors_total', 'Component and slash command interaction handlers that raised an error.', ['action'])
+FETCH_LATENCY = registry.histogram('bookbot_fetch_latency_seconds', 'External source fetch latency.', ['source'])
+FETCH_ERRORS = registry.counter('bookbot_fetch_errors_total', 'External source fetch errors.', ['source'])
+DB_STATEMENT_LATENCY = registry.histogram('bookbot_db_statement_seconds', 'SQLite statement latency by statement type.', ['statement'],
+                                          buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0))
+EVENT_LOOP_LAG = registry.histogram('bookbot_event_loop_lag_seconds', 'How late the event loop woke up a periodic probe.',
+                                    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 10.0))
+EVENT_LOOP_LAG_LAST = registry.gauge('bookbot_event_loop_lag_last_seconds', 'Most recent event loop lag sample.')
+
+def statement_type(query):
+    words = query.split(None, 1)
+    return words[0].upper() if words else 'UNKNOWN'
+
+# Set to a list in scrape worker processes, whose own registry is never scraped: their
+# fetches are collected here and sent back to the bot with the job's result
+fetch_log = None
+
+def record_fetch(source, seconds=None, error=False):
+    if fetch_log is not None:
+        fetch_log.append((source, seconds, error))
+        return
+    if error:
+        FETCH_ERRORS.inc(source=source)
+    if seconds is not None:
+        FETCH_LATENCY.observe(seconds, source=source)
+
+def track_fetch(source):
+    """Decorator timing a blocking fetcher and counting the exceptions it raises."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                record_fetch(source, error=True)
+                raise
+            finally:
+                record_fetch(source, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def register_collected(name_prefix, descriptions, collect):
+    """Expose each key of the dict returned by ``collect()`` as its own metric.
+
+    ``descriptions`` maps each key to ``(type, documentation)``, type being
+    'gauge' or 'counter'.
+    """
+    for key, (metric_type, documentation) in descriptions.items():
+        make = registry.counter if metric_type == 'counter' else registry.gauge
+        make(f'{name_prefix}{key}', documentation, function=lambda key=key: collect()[key])
+
+async def monitor_event_loop_lag(interval=0.5):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        EVENT_LOOP_LAG.observe(lag)
+        EVENT_LOOP_LAG_LAST.set(lag)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port, host='127.0.0.1'):
+    # Served from its own thread so scrapes still work while the event loop is stalled
+    httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name='metrics-server', daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{httpd.server_address[1]}/metrics")
+    return httpd
@@ -0,0 +1,154 @@
+"""Item-item "readers like you" recommendations.
+
+Books are compared by the cosine similarity of their columns in a sparse
+users x books matrix of ratings (a book in someone's library without a rating
+counts as a middling one). Only the top NEIGHBOURS_PER_BOOK neighbours of each
+book are stored in book_neighbours, so $recommend is a single indexed read.
+
+The bot refreshes the table in the background, recomputing only books whose
+ratings changed since the last run, or every book while the table is empty.
+Rebuild it from scratch with:
+
+    python recommendations.py --full
+
+NumPy and SciPy are only needed by the batch job (pip install numpy scipy).
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+NEIGHBOURS_PER_BOOK = int(os.getenv("RECOMMENDATION_NEIGHBOURS", "20"))
+REFRESH_INTERVAL = float(os.getenv("RECOMMENDATION_REFRESH_SECONDS", "600"))
+UNRATED_WEIGHT = 0.5
+COLUMN_BATCH = 1024
+
+REFRESH_SECONDS = registry.gauge('bookbot_recommendation_refresh_seconds', 'Duration of the most recent recommendation refresh.')
+REFRESHED_BOOKS = registry.counter('bookbot_recommendation_books_refreshed_total', 'Books whose neighbours were recomputed.')
+
+def load_matrix(conn):
+    """Return (book_ids, column-normalized users x books CSC matrix), or None if nobody has any books."""
+    import numpy as np
+    from scipy import sparse
+
+    rows = conn.execute("""
+        SELECT user_id, book_id, COALESCE(rating / 10.0, ?) FROM user_books
+    """, (UNRATED_WEIGHT,)).fetchall()
+    if not rows:
+        return None
+    ratings = np.array(rows, dtype=np.float64)
+    users, user_index = np.unique(ratings[:, 0], return_inverse=True)
+    book_ids, book_index = np.unique(ratings[:, 1].astype(np.int64), return_inverse=True)
+    matrix = sparse.csc_matrix((ratings[:, 2], (user_index, book_index)), shape=(len(users), len(book_ids)))
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    inverse_norms = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    return book_ids, (matrix @ sparse.diags(inverse_norms)).tocsc()
+
+def top_neighbours(book_ids, normalized, columns, k=NEIGHBOURS_PER_BOOK):
+    """(book_id, neighbour_id, score) rows for the top ``k`` neighbours of each of ``columns``."""
+    import numpy as np
+
+    rows = []
+    transposed = normalized.T.tocsr()
+    for start in range(0, len(columns), COLUMN_BATCH):
+        batch = columns[start:start + COLUMN_BATCH]
+        # books x batch similarities; only books sharing a reader with the column are non-zero
+        similarities = (transposed @ normalized[:, batch]).tocsc()
+        for position, column in enumerate(batch):
+            lo, hi = similarities.indptr[position], similarities.indptr[position + 1]
+            neighbours, scores = similarities.indices[lo:hi], similarities.data[lo:hi]
+            keep = neighbours != column
+            neighbours, scores = neighbours[keep], scores[keep]
+            if len(scores) > k:
+                top = np.argpartition(-scores, k)[:k]
+                neighbours, scores = neighbours[top], scores[top]
+            book_id = int(book_ids[column])
+            rows.extend(zip([book_id] * len(scores), book_ids[neighbours].tolist(), scores.tolist()))
+    return rows
+
+def refresh(db_path, full=False, k=NEIGHBOURS_PER_BOOK):
+    """Recompute neighbours for changed books (or all of them); returns how many books were refreshed."""
+    import numpy as np
+
+    start = time.perf_counter()
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        marks = conn.execute("SELECT marked_at, book_id FROM recommendation_dirty_books").fetchall()
+        # Marks made after this snapshot stay dirty for the next refresh
+        snapshot = max((marked_at for marked_at, _ in marks), default=0)
+        dirty = [book_id for _, book_id in marks]
+        # A database from before this table existed has libraries but no neighbours and nothing marked
+        if not full and conn.execute("SELECT 1 FROM book_neighbours LIMIT 1").fetchone() is None:
+            full = True
+        if not full and not dirty:
+            return 0
+        loaded = load_matrix(conn)
+        book_ids, normalized = loaded if loaded else (np.array([], dtype=np.int64), None)
+
+        if full:
+            affected = book_ids
+        else:
+            # A rating change alters the book's column norm and so its similarity to every
+            # book it shares a reader with; books that used to list it may also have lost it
+            dirty_ids = np.array(dirty, dtype=np.int64)
+            dirty_columns = np.flatnonzero(np.isin(book_ids, dirty_ids))
+            affected = [dirty_ids]
+            if len(dirty_columns):
+                co_read = normalized.T.tocsr() @ normalized[:, dirty_columns]
+                affected.append(book_ids[np.unique(co_read.tocoo().row)])
+            placeholders = ','.join('?' * len(dirty))
+            previous = conn.execute(f"SELECT DISTINCT book_id FROM book_neighbours WHERE neighbour_id IN ({placeholders})", dirty).fetchall()
+            affected.append(np.array([book_id for (book_id,) in previous], dtype=np.int64))
+            affected = np.unique(np.concatenate(affected))
+
+        columns = np.flatnonzero(np.isin(book_ids, affected))
+        rows = top_neighbours(book_ids, normalized, columns, k) if len(columns) else []
+
+        with conn:
+            if full:
+                conn.execute("DELETE FROM book_neighbours")
+            else:
+                conn.executemany("DELETE FROM book_neighbours WHERE book_id = ?", [(int(book_id),) for book_id in affected])
+            conn.executemany("INSERT INTO book_neighbours (book_id, neighbour_id, score) VALUES (?, ?, ?)", rows)
+            conn.execute("DELETE FROM recommendation_dirty_books WHERE marked_at <= ?", (snapshot,))
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - start
+    REFRESH_SECONDS.set(elapsed)
+    REFRESHED_BOOKS.inc(len(affected))
+    logger.info(f"Refreshed recommendations for {len(affected)} books ({len(rows)} neighbours) in {elapsed:.2f}s")
+    return len(affected)
+
+async def refresh_periodically(db_path, interval=REFRESH_INTERVAL):
+    try:
+        import numpy, scipy  # noqa: F401
+    except ImportError:
+        logger.warning("NumPy/SciPy are not installed; $recommend will use whatever book_neighbours already holds")
+        return
+    while True:
+        try:
+            # The matrix work runs in a thread so it never blocks the event loop
+            await asyncio.to_thread(refresh, db_path)
+        except Exception:
+            logger.exception("Recommendation refresh failed")
+        await asyncio.sleep(interval)
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh the book_neighbours table used by $recommend.")
+    parser.add_argument("--db", default="library.db")
+    parser.add_argument("--full", action="store_true", help="recompute every book instead of only changed ones")
+    parser.add_argument("--neighbours", type=int, default=NEIGHBOURS_PER_BOOK)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    refresh(args.db, args.full, args.neighbours)
+
+if __name__ == "__main__":
+    main()
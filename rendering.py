@@ -0,0 +1,58 @@
+MESSAGE_LIMIT = 2000
+
+def truncate(text, max_length):
+    return text if len(text) <= max_length else text[:max_length - 1] + '…'
+
+def render_chunks(rows, format_row, header='', max_length=MESSAGE_LIMIT, start=1):
+    """Yield message bodies of at most ``max_length`` characters.
+
+    ``format_row(number, row)`` is only called for the rows of the chunk being
+    built, so the caller can send each chunk before the next one is formatted.
+    The header is repeated on every chunk.
+    """
+    chunk = header
+    has_rows = False
+    for number, row in enumerate(rows, start):
+        line = truncate(format_row(number, row), max_length - len(header) - 1)
+        separator = '\n' if chunk else ''
+        if has_rows and len(chunk) + len(separator) + len(line) > max_length:
+            yield chunk
+            chunk, separator = header, '\n' if header else ''
+        chunk += separator + line
+        has_rows = True
+    if has_rows:
+        yield chunk
+
+def render_page(rows, format_row, header='', max_length=MESSAGE_LIMIT, start=1):
+    """One message body for a paged view: as many rows as fit, then "…and N more" for any that do not."""
+    rows = list(rows)
+    # Room for the "…and N more" line, which only the last row may use
+    reserve = len(f'\n…and {len(rows)} more')
+    body = header
+    shown = 0
+    for number, row in enumerate(rows, start):
+        line = truncate(format_row(number, row), max_length - len(header) - reserve - 1)
+        separator = '\n' if body else ''
+        limit = max_length if shown == len(rows) - 1 else max_length - reserve
+        if shown and len(body) + len(separator) + len(line) > limit:
+            break
+        body += separator + line
+        shown += 1
+    if shown < len(rows):
+        body += f'\n…and {len(rows) - shown} more'
+    return body
+
+async def send_chunked(destination, rows, format_row, header='', empty_message=None):
+    """Send ``rows`` as size-bounded messages.
+
+    Returns the number of messages sent; ``empty_message`` is sent instead when there are no rows.
+    """
+    sent = 0
+    if header:
+        header = truncate(header, MESSAGE_LIMIT // 2)
+    for content in render_chunks(rows, format_row, header=header):
+        await destination.send(content)
+        sent += 1
+    if not sent and empty_message:
+        await destination.send(empty_message)
+    return sent
@@ -0,0 +1,314 @@
+import asyncio
+import itertools
+import logging
+import os
+import pickle
+import sys
+
+from metrics import record_fetch, registry
+from scrape_worker import HEADER, encode
+
+logger = logging.getLogger(__name__)
+
+SCRAPE_WORKERS = int(os.getenv('SCRAPE_WORKERS', '2'))
+MAX_PENDING_JOBS = 100
+MAX_PENDING_PER_USER = 4
+PER_USER_CONCURRENCY = 1
+PER_GUILD_CONCURRENCY = 2
+MAX_TASKS_PER_CHILD = 20  # recycle workers so leaked browser/parser memory is returned
+DEFAULT_JOB_TIMEOUT = 120
+WORKER_STOP_GRACE = 10  # seconds a stopped worker gets to close its browser before it is killed
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scrape_worker.py')
+
+QUEUE_DEPTH = registry.gauge('bookbot_scrape_queue_pending', 'Scrape jobs waiting for a worker.')
+JOBS_RUNNING = registry.gauge('bookbot_scrape_jobs_running', 'Scrape jobs currently running in worker processes.')
+JOB_WAIT = registry.histogram('bookbot_scrape_job_wait_seconds', 'Time scrape jobs spent queued.', ['job'])
+JOB_RUN = registry.histogram('bookbot_scrape_job_run_seconds', 'Time scrape jobs spent running in a worker process.', ['job'])
+JOB_OUTCOMES = registry.counter('bookbot_scrape_jobs_total', 'Finished scrape jobs by outcome.', ['job', 'outcome'])
+
+class QueueFull(Exception):
+    pass
+
+class UserQueueFull(QueueFull):
+    pass
+
+class WorkerExited(Exception):
+    pass
+
+class ScrapeWorker:
+    """One ``scrape_worker.py`` process, fed a job at a time over its stdin.
+
+    The process is started on first use and replaced after MAX_TASKS_PER_CHILD
+    jobs, or after it dies.
+    """
+
+    def __init__(self):
+        self.process = None
+        self.jobs_run = 0
+        self.busy = False
+
+    async def call(self, func, args):
+        if self.process is None:
+            self.process = await asyncio.create_subprocess_exec(sys.executable, WORKER_SCRIPT,
+                                                                stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE)
+            self.jobs_run = 0
+        process = self.process
+        self.busy = True
+        try:
+            process.stdin.write(encode((func, args)))
+            await process.stdin.drain()
+            header = await process.stdout.readexactly(HEADER.size)
+            ok, value, fetches = pickle.loads(await process.stdout.readexactly(HEADER.unpack(header)[0]))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.process = None
+            raise WorkerExited(f"Scrape worker exited with code {await process.wait()}")
+        finally:
+            self.busy = False
+        for fetch in fetches:
+            record_fetch(*fetch)
+        self.jobs_run += 1
+        if self.jobs_run >= MAX_TASKS_PER_CHILD:
+            await self.stop()
+        if not ok:
+            raise value
+        return value
+
+    async def stop(self, terminate=False):
+        """Let the process exit once its stdin is closed, or with ``terminate`` interrupt its job."""
+        process, self.process = self.process, None
+        if process is None or process.returncode is not None:
+            return
+        if terminate:
+            process.terminate()
+        else:
+            process.stdin.close()
+        try:
+            await asyncio.wait_for(process.wait(), WORKER_STOP_GRACE)
+        except asyncio.TimeoutError:
+            logger.warning(f"Scrape worker {process.pid} did not exit in {WORKER_STOP_GRACE}s, killing it")
+            process.kill()
+            await process.wait()
+
+class CancellationToken:
+    __slots__ = ('cancelled',)
+
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class ScrapeJob:
+    __slots__ = ('priority', 'seq', 'deadline', 'user_id', 'guild_id', 'func', 'args', 'token', 'future', 'enqueued_at')
+
+    def __init__(self, priority, seq, deadline, user_id, guild_id, func, args, token, future, enqueued_at):
+        self.priority = priority
+        self.seq = seq
+        self.deadline = deadline
+        self.user_id = user_id
+        self.guild_id = guild_id
+        self.func = func
+        self.args = args
+        self.token = token
+        self.future = future
+        self.enqueued_at = enqueued_at
+
+    @property
+    def name(self):
+        return getattr(self.func, '__name__', 'job')
+
+    def sort_key(self):
+        return self.priority, self.seq
+
+    async def result(self):
+        return await self.future
+
+    def cancel(self):
+        self.token.cancel()
+        if not self.future.done():
+            self.future.cancel()
+
+class ScrapeQueue:
+    """Runs blocking scrapers in a bounded set of worker processes.
+
+    Jobs are picked by priority (lower first) then submission order, skipping jobs
+    whose user or guild is already at its concurrency limit. A job that passes its
+    deadline has its worker process terminated, and the slot stays occupied until
+    that process has exited, so the number of live scraper processes never exceeds
+    ``workers``.
+    """
+
+    def __init__(self, workers=SCRAPE_WORKERS, max_pending=MAX_PENDING_JOBS, max_pending_per_user=MAX_PENDING_PER_USER,
+                 per_user_concurrency=PER_USER_CONCURRENCY, per_guild_concurrency=PER_GUILD_CONCURRENCY):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_pending_per_user = max_pending_per_user
+        self.per_user_concurrency = per_user_concurrency
+        self.per_guild_concurrency = per_guild_concurrency
+        self.pending = []
+        self.running_by_user = {}
+        self.running_by_guild = {}
+        self.running = 0
+        self.counter = itertools.count()
+        self.scrape_workers = []
+        self.dispatchers = []
+        self.wakeup = None
+        self.closed = False
+        QUEUE_DEPTH.set_function(lambda: len(self.pending))
+        JOBS_RUNNING.set_function(lambda: self.running)
+
+    def start(self):
+        if self.dispatchers:
+            return
+        self.wakeup = asyncio.Condition()
+        self.scrape_workers = [ScrapeWorker() for _ in range(self.workers)]
+        self.dispatchers = [asyncio.create_task(self.dispatch(worker)) for worker in self.scrape_workers]
+
+    def submit(self, func, *args, user_id, guild_id=0, priority=0, timeout=DEFAULT_JOB_TIMEOUT):
+        """Queue ``func(*args)`` and return ``(job, position)``; position 1 runs next."""
+        if self.closed:
+            raise QueueFull("The scrape queue is shutting down.")
+        self.start()
+        if len(self.pending) >= self.max_pending:
+            raise QueueFull("Too many price lookups are queued right now.")
+        if sum(1 for job in self.pending if job.user_id == user_id) >= self.max_pending_per_user:
+            raise UserQueueFull("You already have too many price lookups queued.")
+
+        loop = asyncio.get_running_loop()
+        job = ScrapeJob(priority, next(self.counter), loop.time() + timeout, user_id, guild_id or 0, func, args,
+                        CancellationToken(), loop.create_future(), loop.time())
+        self.pending.append(job)
+        self.pending.sort(key=ScrapeJob.sort_key)
+        loop.call_at(job.deadline, self.expire, job)
+        self.notify()
+        return job, self.position(job)
+
+    def position(self, job):
+        try:
+            return self.pending.index(job) + 1
+        except ValueError:
+            return 0
+
+    def expire(self, job):
+        if job in self.pending:
+            self.pending.remove(job)
+            if not job.future.done():
+                job.future.set_exception(asyncio.TimeoutError())
+            JOB_OUTCOMES.inc(job=job.name, outcome='expired')
+            self.notify()
+
+    def notify(self):
+        async def wake():
+            async with self.wakeup:
+                self.wakeup.notify_all()
+        asyncio.get_running_loop().create_task(wake())
+
+    def eligible(self, job):
+        return (self.running_by_user.get(job.user_id, 0) < self.per_user_concurrency
+                and self.running_by_guild.get(job.guild_id, 0) < self.per_guild_concurrency)
+
+    def next_job(self, now):
+        for job in list(self.pending):
+            if job.token.cancelled or job.future.done():
+                self.pending.remove(job)
+                JOB_OUTCOMES.inc(job=job.name, outcome='cancelled')
+            elif job.deadline <= now:
+                self.pending.remove(job)
+                job.future.set_exception(asyncio.TimeoutError())
+                JOB_OUTCOMES.inc(job=job.name, outcome='expired')
+            elif self.eligible(job):
+                self.pending.remove(job)
+                return job
+        return None
+
+    async def dispatch(self, worker):
+        loop = asyncio.get_running_loop()
+        while True:
+            async with self.wakeup:
+                job = self.next_job(loop.time())
+                while job is None:
+                    await self.wakeup.wait()
+                    job = self.next_job(loop.time())
+            await self.run(job, worker)
+
+    async def run(self, job, worker):
+        loop = asyncio.get_running_loop()
+        self.running += 1
+        self.running_by_user[job.user_id] = self.running_by_user.get(job.user_id, 0) + 1
+        self.running_by_guild[job.guild_id] = self.running_by_guild.get(job.guild_id, 0) + 1
+        started_at = loop.time()
+        JOB_WAIT.observe(started_at - job.enqueued_at, job=job.name)
+        outcome = 'ok'
+        work = None
+        try:
+            work = asyncio.ensure_future(worker.call(job.func, job.args))
+            done, _ = await asyncio.wait({work}, timeout=max(0, job.deadline - started_at))
+            if not done:
+                outcome = 'timeout'
+                if not job.future.done():
+                    job.future.set_exception(asyncio.TimeoutError())
+                # A hung scraper would hold this slot forever; the next job starts a fresh worker
+                work.cancel()
+                await asyncio.gather(work, return_exceptions=True)
+                await worker.stop(terminate=True)
+            elif job.future.done():
+                outcome = 'cancelled'
+            elif work.exception() is not None:
+                outcome = 'error'
+                job.future.set_exception(work.exception())
+            else:
+                job.future.set_result(work.result())
+        except Exception as e:
+            outcome = 'error'
+            logger.exception(f"Scrape job {job.name} failed")
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            if not job.future.done():
+                # The dispatcher was cancelled by close(); don't leave the submitter waiting
+                outcome = 'cancelled'
+                job.future.cancel()
+            if work is not None and not work.done():
+                # close() stops the worker process itself
+                work.cancel()
+            self.running -= 1
+            self.running_by_user[job.user_id] -= 1
+            if not self.running_by_user[job.user_id]:
+                del self.running_by_user[job.user_id]
+            self.running_by_guild[job.guild_id] -= 1
+            if not self.running_by_guild[job.guild_id]:
+                del self.running_by_guild[job.guild_id]
+            JOB_RUN.observe(loop.time() - started_at, job=job.name)
+            JOB_OUTCOMES.inc(job=job.name, outcome=outcome)
+            self.notify()
+
+    async def drain(self):
+        """Refuse new jobs and wait until every queued and running job has finished."""
+        self.closed = True
+        if self.wakeup is None:
+            return
+        async with self.wakeup:
+            await self.wakeup.wait_for(lambda: not self.pending and not self.running)
+
+    async def close(self, drain_timeout=0):
+        """Shut down, first letting jobs finish for up to ``drain_timeout`` seconds.
+
+        Jobs still queued after that are cancelled, and workers still running one are
+        terminated; they exit through SystemExit, so their browsers are closed.
+        """
+        if drain_timeout > 0:
+            try:
+                await asyncio.wait_for(self.drain(), drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Scrape queue did not drain in {drain_timeout:.1f}s ({len(self.pending)} queued, {self.running} running)")
+        self.closed = True
+        for job in self.pending:
+            job.cancel()
+        self.pending.clear()
+        busy = [worker.busy for worker in self.scrape_workers]
+        for task in self.dispatchers:
+            task.cancel()
+        await asyncio.gather(*self.dispatchers, return_exceptions=True)
+        await asyncio.gather(*(worker.stop(terminate) for worker, terminate in zip(self.scrape_workers, busy)))
+
+scrape_queue = ScrapeQueue()
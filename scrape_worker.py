@@ -0,0 +1,69 @@
+"""A scrape worker process, started by scrape_queue.py as ``python scrape_worker.py``.
+
+Reads pickled ``(func, args)`` jobs from stdin one at a time and writes each
+``(ok, result or exception, fetches)`` reply to stdout, until stdin is closed;
+``fetches`` are the job's fetch timings and errors for the bot to record. It is a
+script of its own so a worker only imports the scraper modules, never main.py
+and the bot.
+"""
+import os
+import pickle
+import signal
+import struct
+import sys
+
+import metrics
+
+HEADER = struct.Struct('>I')
+
+def encode(message):
+    body = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    return HEADER.pack(len(body)) + body
+
+def read_message(stream):
+    header = stream.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    return pickle.loads(stream.read(HEADER.unpack(header)[0]))
+
+def run(job):
+    metrics.fetch_log = fetches = []
+    try:
+        func, args = job
+        return True, func(*args), fetches
+    except Exception as e:
+        return False, e, fetches
+
+def reply(channel, result):
+    try:
+        data = encode(result)
+    except Exception as e:
+        # An exception or result that does not pickle still has to reach the bot
+        data = encode((False, RuntimeError(f"{type(e).__name__}: {e}"), result[2]))
+    channel.write(data)
+    channel.flush()
+
+def main():
+    # Shutdown is coordinated by the bot: ignore the terminal's Ctrl+C, and turn SIGTERM into
+    # SystemExit so a scraper's finally blocks (e.g. driver.quit()) still close its browser
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+
+    # Replies get the real stdout to themselves; scrapers' prints go to stderr
+    channel = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+
+    jobs = sys.stdin.buffer
+    while True:
+        try:
+            job = read_message(jobs)
+        except Exception as e:
+            reply(channel, (False, RuntimeError(f"Could not load scrape job: {e}"), []))
+            continue
+        if job is None:
+            return
+        reply(channel, run(job))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import time
+from collections import OrderedDict
+
+SEARCH_SESSION_TTL = 300  # seconds a user has to reply with a title
+MAX_SEARCH_SESSIONS = 10000
+
+class SearchSession:
+    __slots__ = ('stage', 'expires_at')
+
+    def __init__(self, stage, expires_at):
+        self.stage = stage
+        self.expires_at = expires_at
+
+class SearchSessionStore:
+    """Pending ``$search`` prompts keyed by Discord user id.
+
+    Sessions expire after ``ttl`` seconds and the store never holds more than
+    ``max_sessions``; when full, the least recently used session is evicted.
+    """
+
+    # (type, documentation) of each value metrics() reports
+    METRICS = {
+        'search_sessions_live': ('gauge', 'Pending $search prompt sessions.'),
+        'search_sessions_expired_total': ('counter', '$search prompt sessions that expired before the user replied.'),
+        'search_sessions_evicted_total': ('counter', '$search prompt sessions evicted to stay under the session cap.'),
+    }
+
+    def __init__(self, ttl=SEARCH_SESSION_TTL, max_sessions=MAX_SEARCH_SESSIONS, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.clock = clock
+        self.sessions = OrderedDict()
+        self.expired_evictions = 0
+        self.capacity_evictions = 0
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
+
+    def start(self, user_id, stage='awaiting_title'):
+        now = self.clock()
+        self.purge_expired(now)
+        self.sessions.pop(user_id, None)
+        while len(self.sessions) >= self.max_sessions:
+            self.sessions.popitem(last=False)
+            self.capacity_evictions += 1
+        session = SearchSession(stage, now + self.ttl)
+        self.sessions[user_id] = session
+        return session
+
+    def get(self, user_id):
+        session = self.sessions.get(user_id)
+        if session is None:
+            return None
+        now = self.clock()
+        if session.expires_at <= now:
+            del self.sessions[user_id]
+            self.expired_evictions += 1
+            return None
+        session.expires_at = now + self.ttl
+        self.sessions.move_to_end(user_id)
+        return session
+
+    def pop(self, user_id):
+        return self.sessions.pop(user_id, None)
+
+    def purge_expired(self, now=None):
+        # Every access moves a session to the end with a fresh expiry, so the
+        # oldest sessions are always at the front
+        now = self.clock() if now is None else now
+        while self.sessions:
+            user_id, session = next(iter(self.sessions.items()))
+            if session.expires_at > now:
+                break
+            del self.sessions[user_id]
+            self.expired_evictions += 1
+
+    def metrics(self):
+        return {
+            'search_sessions_live': len(self.sessions),
+            'search_sessions_expired_total': self.expired_evictions,
+            'search_sessions_evicted_total': self.capacity_evictions,
+        }
@@ -0,0 +1,181 @@
+"""Run the bot as several worker processes, each connecting a range of gateway shards.
+
+The supervisor splits the shards into contiguous ranges, starts one
+``main.py`` worker per range, restarts workers that exit and forwards
+SIGTERM/SIGINT to them for a graceful shutdown. Workers share the SQLite
+files and talk over a Unix socket bus (see ``ipc.py``): cache invalidations,
+title index updates, messages for channels another worker owns, and health
+reports, which the supervisor serves as per-shard metrics. Usage:
+
+    python sharding.py --workers 4 --shards 16
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import sys
+import tempfile
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()  # before the imports below read their settings
+
+from database import db
+from ipc import BusServer
+from lifecycle import SHUTDOWN_TIMEOUT
+from metrics import registry, start_metrics_server
+from shards import SHARD_UP, record_shard
+
+logger = logging.getLogger(__name__)
+
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+DISCORD_API_BASE = os.getenv('DISCORD_API_BASE', 'https://discord.com/api/v10')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+RESTART_BACKOFF_MIN = 1.0
+RESTART_BACKOFF_MAX = 60.0
+RESTART_BACKOFF_RESET = 300  # a worker that stayed up this long starts over at the minimum backoff
+WORKER_STOP_TIMEOUT = SHUTDOWN_TIMEOUT + 10
+
+WORKER_UP = registry.gauge('bookbot_worker_up', 'Whether each shard worker process is running.', ['worker'])
+WORKER_RESTARTS = registry.counter('bookbot_worker_restarts_total', 'Shard worker processes restarted after exiting.', ['worker'])
+WORKER_IN_FLIGHT = registry.gauge('bookbot_worker_in_flight', 'Commands and interactions each worker is handling.', ['worker'])
+WORKER_SCRAPE_PENDING = registry.gauge('bookbot_worker_scrape_pending', 'Scrape jobs queued in each worker.', ['worker'])
+WORKER_LOOP_LAG = registry.gauge('bookbot_worker_event_loop_lag_seconds', 'Latest event loop lag sample of each worker.', ['worker'])
+WORKER_LAST_REPORT = registry.gauge('bookbot_worker_last_report_timestamp_seconds', 'When each worker last reported its health.', ['worker'])
+
+def assign_shards(shard_count, workers):
+    """Split shards 0..shard_count-1 into ``workers`` contiguous ranges, as even as possible."""
+    workers = max(1, min(workers, shard_count))
+    base, extra = divmod(shard_count, workers)
+    ranges, start = [], 0
+    for worker_id in range(workers):
+        size = base + (1 if worker_id < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return ranges
+
+def recommended_shard_count(token, api_base=DISCORD_API_BASE):
+    # Only needed when no shard count is given, so requests is not imported otherwise
+    import requests
+
+    response = requests.get(f'{api_base}/gateway/bot', headers={'Authorization': f'Bot {token}'}, timeout=10)
+    response.raise_for_status()
+    return response.json()['shards']
+
+async def prepare_databases():
+    # Migrations run once here instead of racing each other in every worker
+    await db.connect()
+    await db.close()
+
+class Supervisor:
+    def __init__(self, shard_count, workers, socket_path, metrics_port=METRICS_PORT):
+        self.shard_count = shard_count
+        self.assignments = assign_shards(shard_count, workers)
+        self.socket_path = socket_path
+        self.metrics_port = metrics_port
+        self.bus = BusServer(socket_path, on_message=self.handle_message)
+        self.processes = {}
+        self.stop_requested = asyncio.Event()
+
+    def worker_env(self, worker_id, shard_ids):
+        env = dict(os.environ)
+        env.update({
+            'BOOKBOT_SHARD_IDS': ','.join(map(str, shard_ids)),
+            'BOOKBOT_SHARD_COUNT': str(self.shard_count),
+            'BOOKBOT_WORKER_ID': str(worker_id),
+            'BOOKBOT_IPC_SOCKET': self.socket_path,
+            'METRICS_PORT': str(self.metrics_port + 1 + worker_id) if self.metrics_port else '0',
+        })
+        if worker_id:
+            # Background jobs run once per deployment, in worker 0, which is also the only
+            # worker to sync slash commands when the deployment sets SYNC_APP_COMMANDS=1
+            env['BOOKBOT_BACKGROUND_JOBS'] = '0'
+            env['SYNC_APP_COMMANDS'] = '0'
+        return env
+
+    def handle_message(self, message):
+        if message.get('type') != 'health':
+            return
+        worker_id = message['worker']
+        WORKER_IN_FLIGHT.set(message['in_flight'], worker=worker_id)
+        WORKER_SCRAPE_PENDING.set(message['scrape_pending'], worker=worker_id)
+        WORKER_LOOP_LAG.set(message['event_loop_lag'], worker=worker_id)
+        WORKER_LAST_REPORT.set(time.time(), worker=worker_id)
+        for shard_id, shard in message['shards'].items():
+            record_shard(int(shard_id), shard)
+
+    async def supervise(self, worker_id, shard_ids):
+        backoff = RESTART_BACKOFF_MIN
+        while not self.stop_requested.is_set():
+            started_at = time.monotonic()
+            process = await asyncio.create_subprocess_exec(sys.executable, MAIN_SCRIPT, env=self.worker_env(worker_id, shard_ids))
+            self.processes[worker_id] = process
+            WORKER_UP.set(1, worker=worker_id)
+            logger.info(f"Worker {worker_id} (pid {process.pid}) started for shards {shard_ids[0]}-{shard_ids[-1]}")
+            returncode = await process.wait()
+            WORKER_UP.set(0, worker=worker_id)
+            WORKER_IN_FLIGHT.set(0, worker=worker_id)
+            for shard_id in shard_ids:
+                SHARD_UP.set(0, shard=shard_id)
+            if self.stop_requested.is_set():
+                logger.info(f"Worker {worker_id} stopped with exit code {returncode}")
+                return
+            if time.monotonic() - started_at > RESTART_BACKOFF_RESET:
+                backoff = RESTART_BACKOFF_MIN
+            logger.warning(f"Worker {worker_id} exited with code {returncode}, restarting in {backoff:.0f}s")
+            WORKER_RESTARTS.inc(worker=worker_id)
+            try:
+                await asyncio.wait_for(self.stop_requested.wait(), backoff)
+            except asyncio.TimeoutError:
+                pass
+            backoff = min(backoff * 2, RESTART_BACKOFF_MAX)
+
+    async def stop(self, supervisors):
+        for process in self.processes.values():
+            if process.returncode is None:
+                process.send_signal(signal.SIGTERM)
+        done, pending = await asyncio.wait(supervisors, timeout=WORKER_STOP_TIMEOUT)
+        if pending:
+            logger.warning(f"{len(pending)} workers did not stop within {WORKER_STOP_TIMEOUT:.0f}s, killing them")
+            for process in self.processes.values():
+                if process.returncode is None:
+                    process.kill()
+            await asyncio.wait(pending)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.stop_requested.set)
+        await prepare_databases()
+        await self.bus.start()
+        logger.info(f"Running {self.shard_count} shards in {len(self.assignments)} workers")
+        supervisors = [asyncio.create_task(self.supervise(worker_id, shard_ids)) for worker_id, shard_ids in enumerate(self.assignments)]
+        await self.stop_requested.wait()
+        logger.info("Stopping workers")
+        await self.stop(supervisors)
+        await self.bus.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--shards', type=int, default=int(os.getenv('SHARD_COUNT', '0')),
+                        help="total shard count (default: SHARD_COUNT, or Discord's recommendation)")
+    parser.add_argument('--workers', type=int, default=int(os.getenv('SHARD_WORKERS', '0')),
+                        help='worker processes (default: SHARD_WORKERS, or one per CPU)')
+    parser.add_argument('--socket', default=os.getenv('BOOKBOT_IPC_SOCKET'),
+                        help='IPC bus socket path (default: a file in the temp directory)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    shard_count = args.shards or recommended_shard_count(os.environ['TOKEN'])
+    workers = args.workers or os.cpu_count() or 1
+    socket_path = args.socket or os.path.join(tempfile.gettempdir(), f'bookbot-{os.getpid()}.sock')
+
+    # The supervisor serves the per-shard and per-worker metrics; worker i serves its own on METRICS_PORT + 1 + i
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+    asyncio.run(Supervisor(shard_count, workers, socket_path).run())
+
+if __name__ == '__main__':
+    main()
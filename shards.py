@@ -0,0 +1,86 @@
+"""The bot's side of a sharded deployment: which shards this worker owns and the health it reports.
+
+The supervisor itself lives in ``sharding.py``; this module is what the bot
+imports, so it stays as light as the rest of main.py's startup imports.
+"""
+import asyncio
+import math
+import os
+
+from ipc import bus
+from lifecycle import lifecycle
+from metrics import registry, EVENT_LOOP_LAG_LAST
+from scrape_queue import scrape_queue
+
+HEALTH_INTERVAL = float(os.getenv('SHARD_HEALTH_INTERVAL', '5'))
+
+SHARD_UP = registry.gauge('bookbot_shard_up', 'Whether each shard is connected to the gateway.', ['shard'])
+SHARD_LATENCY = registry.gauge('bookbot_shard_latency_seconds', 'Gateway heartbeat latency per shard.', ['shard'])
+SHARD_GUILDS = registry.gauge('bookbot_shard_guilds', 'Guilds served by each shard.', ['shard'])
+
+def shard_for_guild(guild_id, shard_count):
+    # Discord's routing: https://discord.com/developers/docs/topics/gateway#sharding
+    return (guild_id >> 22) % shard_count
+
+class ShardConfig:
+    """This process's place in a sharded deployment, read from the environment the supervisor sets.
+
+    Without it the bot runs unsharded: one process owning every guild.
+    """
+
+    def __init__(self, shard_ids=None, shard_count=None, worker_id=0, ipc_socket=None, background_jobs=True):
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.worker_id = worker_id
+        self.ipc_socket = ipc_socket
+        self.background_jobs = background_jobs
+
+    @classmethod
+    def from_env(cls):
+        shard_ids = os.getenv('BOOKBOT_SHARD_IDS')
+        if not shard_ids:
+            return cls()
+        return cls(shard_ids=[int(shard_id) for shard_id in shard_ids.split(',')],
+                   shard_count=int(os.environ['BOOKBOT_SHARD_COUNT']),
+                   worker_id=int(os.getenv('BOOKBOT_WORKER_ID', '0')),
+                   ipc_socket=os.getenv('BOOKBOT_IPC_SOCKET'),
+                   background_jobs=os.getenv('BOOKBOT_BACKGROUND_JOBS', '1') != '0')
+
+    @property
+    def sharded(self):
+        return self.shard_ids is not None
+
+    def owns_guild(self, guild_id):
+        return not self.sharded or shard_for_guild(guild_id, self.shard_count) in self.shard_ids
+
+shard_config = ShardConfig.from_env()
+
+def health_report(bot):
+    shards = {}
+    for shard_id, shard in bot.shards.items():
+        latency = shard.latency
+        shards[shard_id] = {'up': not shard.is_closed(), 'latency': latency if math.isfinite(latency) else None, 'guilds': 0}
+    for guild in bot.guilds:
+        if guild.shard_id in shards:
+            shards[guild.shard_id]['guilds'] += 1
+    return {
+        'shards': shards,
+        'in_flight': lifecycle.in_flight,
+        'scrape_pending': len(scrape_queue.pending),
+        'event_loop_lag': EVENT_LOOP_LAG_LAST.get(),
+    }
+
+async def report_health(bot, interval=HEALTH_INTERVAL):
+    """Worker side: publish this worker's shard health to the supervisor and this worker's own metrics."""
+    while True:
+        report = health_report(bot)
+        for shard_id, shard in report['shards'].items():
+            record_shard(shard_id, shard)
+        bus.publish('health', **report)
+        await asyncio.sleep(interval)
+
+def record_shard(shard_id, shard):
+    SHARD_UP.set(1 if shard['up'] else 0, shard=shard_id)
+    SHARD_GUILDS.set(shard['guilds'], shard=shard_id)
+    if shard['latency'] is not None:
+        SHARD_LATENCY.set(shard['latency'], shard=shard_id)
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+STALL_THRESHOLD = float(os.getenv('STALL_THRESHOLD_SECONDS', '0.5'))
+HEARTBEAT_INTERVAL = 0.05
+CHECK_INTERVAL = 0.1
+SOURCE_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+STALLS = registry.counter('bookbot_event_loop_stalls_total', 'Event loop stalls longer than the watchdog threshold.', ['site', 'activity'])
+STALL_SECONDS = registry.counter('bookbot_event_loop_stall_seconds_total', 'Total time the event loop was stalled.', ['site', 'activity'])
+
+def offending_frame(stack):
+    # The innermost frame in our own code is the call that blocked, even if the
+    # time is spent deeper inside requests, selenium or bs4
+    for frame in reversed(stack):
+        filename = os.path.abspath(frame.filename)
+        if filename.startswith(SOURCE_ROOT) and filename != os.path.abspath(__file__) and 'site-packages' not in filename:
+            return frame
+    return stack[-1] if stack else None
+
+def describe_frame(frame):
+    if frame is None:
+        return 'unknown'
+    return f'{os.path.relpath(frame.filename, SOURCE_ROOT)}:{frame.lineno} {frame.name}'
+
+class StallWatchdog:
+    """Detects event loop stalls from a separate thread and samples the loop thread's stack.
+
+    A heartbeat task on the loop records when it last ran. When the watchdog thread
+    sees no heartbeat for ``threshold`` seconds it logs the loop thread's stack, the
+    offending frame in our code, and the command or interaction that was running.
+    """
+
+    def __init__(self, threshold=STALL_THRESHOLD, heartbeat_interval=HEARTBEAT_INTERVAL, check_interval=CHECK_INTERVAL):
+        self.threshold = threshold
+        self.heartbeat_interval = heartbeat_interval
+        self.check_interval = check_interval
+        self.loop = None
+        self.loop_thread_id = None
+        self.last_beat = time.monotonic()
+        # Outermost frame of each labelled task -> label; written by the loop thread, only read here
+        self.activity_frames = {}
+        self.heartbeat_task = None
+        self.thread = None
+        self.stopped = threading.Event()
+        self.current_stall = None
+
+    def start(self, loop=None):
+        if self.thread is not None:
+            return
+        self.loop = loop or asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.heartbeat_task = self.loop.create_task(self.heartbeat())
+        self.thread = threading.Thread(target=self.watch, name='stall-watchdog', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+        self.report()
+
+    def track_activity(self, label):
+        """Label the current task, e.g. ``command:list``, so stalls can be attributed to it."""
+        task = asyncio.current_task()
+        frame = task.get_coro().cr_frame if task is not None else None
+        if frame is not None:
+            self.activity_frames[frame] = label
+            task.add_done_callback(lambda task: self.activity_frames.pop(frame, None))
+
+    async def heartbeat(self):
+        while True:
+            self.last_beat = time.monotonic()
+            await asyncio.sleep(self.heartbeat_interval)
+
+    def current_activity(self, frame):
+        # asyncio.current_task is not safe to call from this thread; instead find a labelled
+        # task's outermost frame in the loop thread's stack
+        while frame is not None:
+            label = self.activity_frames.get(frame)
+            if label is not None:
+                return label
+            frame = frame.f_back
+        return 'untracked'
+
+    def watch(self):
+        while not self.stopped.wait(self.check_interval):
+            stalled_for = time.monotonic() - self.last_beat
+            if stalled_for >= self.threshold:
+                if self.current_stall is None:
+                    self.current_stall = self.sample(stalled_for) + (self.last_beat,)
+            elif self.current_stall is not None:
+                self.finish_stall()
+
+    def sample(self, stalled_for):
+        frame = sys._current_frames().get(self.loop_thread_id)
+        stack = traceback.extract_stack(frame) if frame is not None else []
+        site = describe_frame(offending_frame(stack))
+        activity = self.current_activity(frame)
+        logger.warning(f"Event loop stalled for {stalled_for:.2f}s in {activity} at {site}\n"
+                       f"{''.join(traceback.format_list(stack))}")
+        return site, activity
+
+    def finish_stall(self):
+        site, activity, stalled_beat = self.current_stall
+        self.current_stall = None
+        # The stall lasted from the beat before it until the first beat after it
+        duration = max(self.threshold, self.last_beat - stalled_beat - self.heartbeat_interval)
+        STALLS.inc(site=site, activity=activity)
+        STALL_SECONDS.inc(duration, site=site, activity=activity)
+
+    def worst_stalls(self, limit=10):
+        totals = [(seconds, site, activity, STALLS.values.get((site, activity), 0))
+                  for (site, activity), seconds in list(STALL_SECONDS.values.items())]
+        totals.sort(reverse=True)
+        return [{'site': site, 'activity': activity, 'stalls': count, 'seconds': seconds}
+                for seconds, site, activity, count in totals[:limit]]
+
+    def report(self):
+        worst = self.worst_stalls()
+        if not worst:
+            return
+        lines = ["Worst event loop stalls this run:"]
+        lines.extend(f"  {stall['seconds']:8.2f}s over {stall['stalls']:4d} stalls  {stall['activity']} at {stall['site']}" for stall in worst)
+        logger.info('\n'.join(lines))
+
+stall_watchdog = StallWatchdog()
@@ -0,0 +1,60 @@
+import logging
+import time
+from contextlib import contextmanager
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+STARTUP_PHASES = registry.gauge('bookbot_startup_phase_seconds', 'Duration of each cold start phase.', ['phase'])
+RECONNECT_SECONDS = registry.gauge('bookbot_reconnect_seconds', 'How long the most recent gateway reconnect took.')
+
+class StartupTimer:
+    """Records how long each cold start phase (imports, database setup, login...) takes."""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.phases = {}
+        self.marks = {}
+        self.reported = False
+        self.disconnected_at = None
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - start
+
+    def mark(self, name):
+        self.marks[name] = time.perf_counter()
+
+    def between(self, name, start_mark, end_mark):
+        if start_mark in self.marks and end_mark in self.marks:
+            self.phases[name] = self.marks[end_mark] - self.marks[start_mark]
+
+    def elapsed(self):
+        return time.perf_counter() - self.started_at
+
+    def report(self):
+        lines = [f"Startup took {self.elapsed():.3f}s:"]
+        lines.extend(f"  {name:<24} {seconds * 1000:9.1f} ms" for name, seconds in self.phases.items())
+        logger.info('\n'.join(lines))
+        for name, seconds in self.phases.items():
+            STARTUP_PHASES.set(seconds, phase=name)
+        STARTUP_PHASES.set(self.elapsed(), phase='total')
+        self.reported = True
+
+    def disconnected(self):
+        if self.disconnected_at is None:
+            self.disconnected_at = time.perf_counter()
+
+    def reconnected(self):
+        if self.disconnected_at is not None:
+            seconds = time.perf_counter() - self.disconnected_at
+            self.disconnected_at = None
+            RECONNECT_SECONDS.set(seconds)
+            logger.info(f"Reconnected to the gateway after {seconds:.3f}s")
+
+startup_timer = StartupTimer()
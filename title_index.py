@@ -0,0 +1,159 @@
+import logging
+import os
+import sys
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict
+
+from catalog import normalize
+from ipc import bus
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+AUTOCOMPLETE_LIMIT = 25  # Discord shows at most 25 choices
+LEADING_ARTICLES = ('the ', 'a ', 'an ')
+MAX_RECENT_TITLES = int(os.getenv('TITLE_INDEX_RECENT_TITLES', '5000'))
+MISSING = object()
+
+TITLE_INDEX_ENTRIES = registry.gauge('bookbot_title_index_entries', 'Keys in the in-memory title prefix index.')
+TITLE_INDEX_BYTES = registry.gauge('bookbot_title_index_bytes', 'Approximate memory held by the title prefix index.')
+TITLE_LOOKUP_LATENCY = registry.histogram('bookbot_title_lookup_seconds', 'Title prefix index lookup latency.',
+                                          buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01))
+
+class TitleIndex:
+    """Sorted array of normalized titles answering prefix queries with a binary search.
+
+    Titles are indexed with and without a leading article, so "way of k" finds
+    "The Way of Kings" as well. Library titles stay indexed; titles only seen in
+    search results are kept for the ``max_recent`` most recently searched, and
+    dropped when the searches that returned them are pruned.
+    """
+
+    def __init__(self, max_recent=MAX_RECENT_TITLES):
+        self.max_recent = max_recent
+        self.entries = []  # sorted (key, title) pairs
+        self.library = set()
+        self.recent = OrderedDict()  # search-only titles, least recently searched first
+        self.item_bytes = 0  # keys, entries and titles; memory_footprint adds the containers
+
+    def __len__(self):
+        return len(self.library) + len(self.recent)
+
+    def keys_for(self, title):
+        key = normalize(title)
+        keys = [key] if key else []
+        for article in LEADING_ARTICLES:
+            if key.startswith(article):
+                keys.append(key[len(article):])
+                break
+        return keys
+
+    def index(self, title, keep_sorted=True):
+        self.item_bytes += sys.getsizeof(title)
+        for key in self.keys_for(title):
+            entry = (key, title)
+            if keep_sorted:
+                insort(self.entries, entry)
+            else:
+                self.entries.append(entry)
+            self.item_bytes += sys.getsizeof(entry) + sys.getsizeof(key)
+
+    def unindex(self, title):
+        self.item_bytes -= sys.getsizeof(title)
+        for key in self.keys_for(title):
+            entry = (key, title)
+            position = bisect_left(self.entries, entry)
+            if position < len(self.entries) and self.entries[position] == entry:
+                del self.entries[position]
+                self.item_bytes -= sys.getsizeof(entry) + sys.getsizeof(key)
+
+    def build(self, library_titles, recent_titles=()):
+        """Index ``library_titles`` and the newest ``max_recent`` of ``recent_titles`` (least recently searched first)."""
+        self.entries, self.library, self.recent, self.item_bytes = [], set(), OrderedDict(), 0
+        for title in library_titles:
+            if title and title not in self.library:
+                self.library.add(title)
+                self.index(title, keep_sorted=False)
+        for title in recent_titles:
+            if title and title not in self.library:
+                self.recent[title] = None
+                self.recent.move_to_end(title)
+        while len(self.recent) > self.max_recent:
+            self.recent.popitem(last=False)
+        for title in self.recent:
+            self.index(title, keep_sorted=False)
+        self.entries.sort()
+        self.update_gauges()
+
+    def add(self, title):
+        self.add_many([title], library=True)
+
+    def add_many(self, titles, library=False, broadcast=True):
+        added = []
+        for title in titles:
+            if not title or title in self.library:
+                continue
+            if library:
+                # A searched title someone added to their library is already indexed; it just stops expiring
+                if self.recent.pop(title, MISSING) is MISSING:
+                    self.index(title)
+                self.library.add(title)
+            elif title in self.recent:
+                self.recent.move_to_end(title)
+                continue
+            else:
+                self.index(title)
+                self.recent[title] = None
+            added.append(title)
+        while len(self.recent) > self.max_recent:
+            self.unindex(self.recent.popitem(last=False)[0])
+        if added:
+            self.update_gauges()
+            # Other shard workers serve autocomplete for their guilds from their own copy
+            if broadcast:
+                bus.publish('titles', titles=added, library=library)
+
+    def discard_recent(self, titles, broadcast=True):
+        """Drop search-only titles whose searches were pruned."""
+        removed = [title for title in titles if self.recent.pop(title, MISSING) is not MISSING]
+        for title in removed:
+            self.unindex(title)
+        if removed:
+            self.update_gauges()
+            if broadcast:
+                bus.publish('titles_pruned', titles=removed)
+
+    def lookup(self, prefix, limit=AUTOCOMPLETE_LIMIT):
+        start = time.perf_counter()
+        prefix = normalize(prefix)
+        matches = []
+        if prefix:
+            position = bisect_left(self.entries, (prefix,))
+            while position < len(self.entries) and len(matches) < limit:
+                key, title = self.entries[position]
+                if not key.startswith(prefix):
+                    break
+                if title not in matches:
+                    matches.append(title)
+                position += 1
+        TITLE_LOOKUP_LATENCY.observe(time.perf_counter() - start)
+        return matches
+
+    def memory_footprint(self):
+        # Kept up to date as titles come and go, so this is cheap enough to refresh on every change
+        return self.item_bytes + sys.getsizeof(self.entries) + sys.getsizeof(self.library) + sys.getsizeof(self.recent)
+
+    def update_gauges(self):
+        TITLE_INDEX_ENTRIES.set(len(self.entries))
+        TITLE_INDEX_BYTES.set(self.memory_footprint())
+
+    def report(self):
+        size = self.memory_footprint()
+        logger.info(f"Title index: {len(self.library)} library and {len(self.recent)} searched titles, "
+                    f"{len(self.entries)} keys, ~{size / 1024:.0f} KiB")
+
+title_index = TitleIndex()
+
+bus.subscribe('titles', lambda message: title_index.add_many(message['titles'], message.get('library', False), broadcast=False))
+bus.subscribe('titles_pruned', lambda message: title_index.discard_recent(message['titles'], broadcast=False))
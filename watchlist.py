@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import os
+import re
+import time
+
+from database import list_due_price_checks, record_price_check, list_triggered_price_watches, mark_price_watches_notified
+from enrichment import RateBudget
+from fetch_HPB_data import search_book as search_hpb
+from fetch_bookfinder_data import search_bookfinder
+from ipc import bus
+from metrics import registry
+from rendering import render_chunks, send_chunked
+from scrape_queue import scrape_queue, QueueFull
+
+logger = logging.getLogger(__name__)
+
+WATCHLIST_RECHECK_SECONDS = int(os.getenv("WATCHLIST_RECHECK_SECONDS", str(6 * 3600)))
+WATCHLIST_BATCH_SIZE = int(os.getenv("WATCHLIST_BATCH_SIZE", "25"))
+# Each check is one HPB and one BookFinder request
+WATCHLIST_CHECKS_PER_MINUTE = float(os.getenv("WATCHLIST_CHECKS_PER_MINUTE", "6"))
+WATCHLIST_IDLE_SECONDS = 300
+WATCHLIST_USER_ID = 0  # scrape queue "user" for background checks, so they run one at a time
+WATCHLIST_PRIORITY = 10  # behind interactive price lookups (priority 0)
+
+PRICE_CHECKS = registry.counter('bookbot_price_checks_total', 'Watched ISBNs re-checked, by outcome.', ['outcome'])
+PRICE_ALERTS = registry.counter('bookbot_price_alerts_total', 'Watches notified of a price at or under target.')
+
+def parse_price(text):
+    """Cents from a price like "$12.99" or "12", or None."""
+    match = re.search(r'(\d+(?:,\d{3})*)(?:\.(\d{1,2}))?', text or '')
+    if not match:
+        return None
+    return int(match.group(1).replace(',', '')) * 100 + int((match.group(2) or '0').ljust(2, '0'))
+
+def format_cents(cents):
+    return f'${cents / 100:.2f}' if cents is not None else 'N/A'
+
+def hpb_price(results):
+    prices = [parse_price(price) for _, _, _, _, listing_prices in results or [] for price in listing_prices]
+    prices = [price for price in prices if price is not None]
+    return min(prices) if prices else None
+
+def bookfinder_price(data):
+    return parse_price(data['first_listing_price']) if data else None
+
+def format_alert_row(number, row):
+    _, user_id, _, title, isbn, target_cents, best_cents = row
+    return f'<@{user_id}> **{title}** (ISBN: {isbn}) is now {format_cents(best_cents)} (target {format_cents(target_cents)})'
+
+class PriceWatcher:
+    """Re-checks watched ISBNs through the scrape queue and posts price alerts.
+
+    Every ISBN is looked up once per round however many users watch it, and the
+    alerts a round produces are grouped into as few messages per channel as fit.
+    """
+
+    def __init__(self, bot, recheck_seconds=WATCHLIST_RECHECK_SECONDS, batch_size=WATCHLIST_BATCH_SIZE, checks_per_minute=WATCHLIST_CHECKS_PER_MINUTE):
+        self.bot = bot
+        self.budget = RateBudget(checks_per_minute)
+        self.recheck_seconds = recheck_seconds
+        self.batch_size = batch_size
+
+    async def result(self, job):
+        try:
+            return await job.result()
+        except asyncio.CancelledError:
+            job.cancel()
+            raise
+        except Exception as e:
+            logger.warning(f"Watchlist {job.name} lookup failed: {e}")
+            return None
+
+    async def check(self, isbn, title):
+        # Background checks share one scrape queue "user", so they run one at a time behind users' lookups
+        hpb_job, _ = scrape_queue.submit(search_hpb, title, user_id=WATCHLIST_USER_ID, priority=WATCHLIST_PRIORITY)
+        try:
+            bookfinder_job, _ = scrape_queue.submit(search_bookfinder, isbn, user_id=WATCHLIST_USER_ID, priority=WATCHLIST_PRIORITY)
+        except QueueFull:
+            hpb_job.cancel()
+            raise
+        hpb_results = await self.result(hpb_job)
+        bookfinder_data = await self.result(bookfinder_job)
+        prices = {source: cents for source, cents in (('hpb', hpb_price(hpb_results)), ('bookfinder', bookfinder_price(bookfinder_data)))
+                  if cents is not None}
+        await record_price_check(isbn, int(time.time()), prices)
+        PRICE_CHECKS.inc(outcome='priced' if prices else 'no_price')
+
+    async def run_batch(self):
+        """Check one batch of due ISBNs and send its alerts; returns how many ISBNs were checked."""
+        due = await list_due_price_checks(int(time.time()) - self.recheck_seconds, self.batch_size)
+        checked = []
+        for isbn, title in due:
+            # The budget spans batches, so a backlog of due ISBNs is worked through at a steady rate
+            await self.budget.acquire()
+            try:
+                await self.check(isbn, title)
+            except QueueFull:
+                # Interactive lookups have the queue; try the rest next round
+                PRICE_CHECKS.inc(outcome='deferred')
+                break
+            checked.append(isbn)
+        if checked:
+            await self.notify(checked)
+        return len(checked)
+
+    async def notify(self, isbns):
+        watches = await list_triggered_price_watches(isbns)
+        by_channel = {}
+        for watch in watches:
+            by_channel.setdefault(watch[2], []).append(watch)
+        for channel_id, channel_watches in by_channel.items():
+            channel = self.bot.get_channel(channel_id)
+            if channel is None:
+                # In a sharded deployment the channel may belong to another worker's guilds
+                if bus.connected:
+                    bus.publish('channel_message', channel_id=channel_id,
+                                contents=list(render_chunks(channel_watches, format_alert_row, header='**Price alerts:**')))
+                continue
+            await send_chunked(channel, channel_watches, format_alert_row, header='**Price alerts:**')
+        # Channels the bot can no longer see are marked too, so they are not retried every round
+        await mark_price_watches_notified([(watch[6], watch[0]) for watch in watches])
+        PRICE_ALERTS.inc(len(watches))
+
+    async def run(self):
+        while True:
+            try:
+                checked = await self.run_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Watchlist round failed")
+                checked = 0
+            if checked < self.batch_size:
+                await asyncio.sleep(WATCHLIST_IDLE_SECONDS)